@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import itertools
+import subprocess
+
+import video_processing
+
+DEFAULT_DIR = os.getenv('BENCHMARK_DIR', '.benchmark')
+SOURCE_FPS = 30
+AUDIO_RATE = 48000
+
+
+def parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def source_name(duration, resolution, gop):
+    return f"lavfi_{duration}s_{resolution}_gop{gop}.mp4"
+
+
+def generate_source(path, duration, resolution, gop, fps=SOURCE_FPS):
+    """
+    Deterministic test video from lavfi sources: a moving test pattern and a sine
+    tone, single-threaded with bitexact flags so the same arguments produce the
+    same bytes on any machine. Scene-cut detection is off so the GOP is fixed.
+    """
+    if os.path.exists(path):
+        return path
+    tmp_path = path + '.tmp.mp4'
+    command = [
+        'ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={resolution}:rate={fps}:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:beep_factor=4:sample_rate={AUDIO_RATE}:duration={duration}',
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18', '-threads', '1',
+        '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k',
+        '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+        '-movflags', '+faststart',
+        tmp_path
+    ]
+    subprocess.run(command, check=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def split_points(duration, parts):
+    """Evenly spaced split input for the given part count, as plain seconds."""
+    return ','.join(str(round(duration * i / parts, 3)) for i in range(1, parts))
+
+
+def run_measured(command):
+    """Run a command and return (exit code, wall seconds, peak RSS in KB) including its reaped children."""
+    started = time.monotonic()
+    process = subprocess.Popen(command)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.monotonic() - started
+    # Popen never saw the exit, so tell it the child is gone
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, wall, usage.ru_maxrss
+
+
+def run_scenario(scenario, source, work_dir, cores=None, min_threads=None, chunk_min_seconds=None):
+    """Split, speed-adjust and (for chunked runs) concat one source through video_processing."""
+    run_dir = os.path.join(work_dir, scenario['name'])
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    report_path = os.path.join(run_dir, 'encode_report.json')
+
+    command = [
+        sys.executable, os.path.abspath(video_processing.__file__),
+        '--input', os.path.abspath(source),
+        '--basename', os.path.join(run_dir, 'out'),
+        '--speed', str(scenario['speed']),
+        '--splits', split_points(scenario['duration'], scenario['parts']),
+        '--preset', scenario['preset'],
+        '--crf', str(scenario['crf']),
+        '--chunked', scenario['mode'],
+        '--plan', os.path.join(run_dir, 'plan.json'),
+        '--report', report_path,
+        # A fresh index per run so probing is part of the measurement
+        '--index-dir', os.path.join(run_dir, 'index')
+    ]
+    if cores:
+        command += ['--cores', str(cores)]
+    if min_threads:
+        command += ['--min-threads', str(min_threads)]
+    if chunk_min_seconds:
+        command += ['--chunk-min-seconds', str(chunk_min_seconds)]
+
+    exit_code, wall, peak_rss_kb = run_measured(command)
+    result = dict(scenario, exit_code=exit_code, wall_seconds=round(wall, 3), peak_rss_mb=round(peak_rss_kb / 1024, 1))
+    if exit_code != 0:
+        return result
+
+    with open(os.path.join(run_dir, 'plan.json')) as f:
+        outputs = [part['output'] for part in json.load(f)]
+    with open(report_path) as f:
+        report = json.load(f)
+
+    output_frames = scenario['duration'] / scenario['speed'] * SOURCE_FPS
+    result.update({
+        'encode_seconds': report['wall_seconds'],
+        'encode_fps': round(output_frames / report['wall_seconds'], 1) if report['wall_seconds'] > 0 else None,
+        'output_bytes': sum(os.path.getsize(path) for path in outputs),
+        'concurrency': report['concurrency'],
+        'chunks': len(report.get('chunks', []))
+    })
+    shutil.rmtree(run_dir, ignore_errors=True)
+    return result
+
+
+def build_scenarios(args):
+    scenarios = []
+    matrix = itertools.product(
+        parse_list(args.durations, int), parse_list(args.resolutions), parse_list(args.gops, int),
+        parse_list(args.speeds, float), parse_list(args.parts, int), parse_list(args.presets),
+        parse_list(args.modes)
+    )
+    for duration, resolution, gop, speed, parts, preset, mode in matrix:
+        # Chunking only applies to an unsplit video
+        if mode == 'always' and parts > 1:
+            continue
+        scenarios.append({
+            'name': f"{duration}s_{resolution}_gop{gop}_{speed:g}x_{parts}p_{preset}_{mode}",
+            'duration': duration,
+            'resolution': resolution,
+            'gop': gop,
+            'speed': speed,
+            'parts': parts,
+            'preset': preset,
+            'crf': args.crf,
+            'mode': mode
+        })
+    return scenarios
+
+
+def environment():
+    """Enough about the machine and tree to tell whether two result files are comparable."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    ffmpeg = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n', 1)[0]
+    return {
+        'commit': commit,
+        'ffmpeg': ffmpeg,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cores': video_processing.available_cores(),
+        'created_at': int(time.time())
+    }
+
+
+def compare(results, baseline_path):
+    """Print wall-time and size changes against an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = {r['name']: r for r in json.load(f)['results'] if r.get('exit_code') == 0}
+    print(f"\n📊 Compared with {baseline_path}:")
+    for result in results:
+        before = baseline.get(result['name'])
+        if not before or result.get('exit_code') != 0:
+            continue
+        wall = result['wall_seconds'] / before['wall_seconds'] - 1 if before['wall_seconds'] else 0
+        size = result['output_bytes'] / before['output_bytes'] - 1 if before['output_bytes'] else 0
+        print(f"  {result['name']}: wall {wall:+.1%}, size {size:+.1%}, "
+              f"RSS {result['peak_rss_mb'] - before['peak_rss_mb']:+.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark split, speed and concat on synthetic media')
+    parser.add_argument('--durations', default='60,300', help='Source durations in seconds')
+    parser.add_argument('--resolutions', default='640x360,1280x720')
+    parser.add_argument('--gops', default='30,250', help='Source keyframe intervals in frames')
+    parser.add_argument('--speeds', default='1.5,2')
+    parser.add_argument('--parts', default='1,3', help='Part counts to split into')
+    parser.add_argument('--presets', default='veryfast')
+    parser.add_argument('--crf', type=int, default=video_processing.DEFAULT_CRF)
+    parser.add_argument('--modes', default='never,always',
+                        help='video_processing --chunked values (always = chunk and concat)')
+    parser.add_argument('--cores', type=int, default=None)
+    parser.add_argument('--min-threads', type=int, default=None)
+    # Synthetic sources are short, so let them split into chunks the way a long upload would
+    parser.add_argument('--chunk-min-seconds', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per scenario; the fastest is kept')
+    parser.add_argument('--work-dir', default=DEFAULT_DIR, help='Generated sources and scratch outputs')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+        print("❌ ffmpeg and ffprobe are required")
+        sys.exit(1)
+
+    scenarios = build_scenarios(args)
+    os.makedirs(args.work_dir, exist_ok=True)
+    print(f"🏁 {len(scenarios)} scenarios × {args.repeat}")
+
+    results = []
+    for scenario in scenarios:
+        source = generate_source(
+            os.path.join(args.work_dir, source_name(scenario['duration'], scenario['resolution'], scenario['gop'])),
+            scenario['duration'], scenario['resolution'], scenario['gop']
+        )
+        runs = [run_scenario(scenario, source, args.work_dir, args.cores, args.min_threads,
+                             args.chunk_min_seconds)
+                for _ in range(args.repeat)]
+        ok = [run for run in runs if run['exit_code'] == 0]
+        result = min(ok, key=lambda run: run['wall_seconds']) if ok else runs[-1]
+        results.append(result)
+        if ok:
+            print(f"⏱️ {scenario['name']}: {result['wall_seconds']:.2f}s, {result['encode_fps']} fps, "
+                  f"{result['peak_rss_mb']} MB RSS, {result['output_bytes'] / (1024*1024):.1f} MB out")
+        else:
+            print(f"❌ {scenario['name']}: exit code {result['exit_code']}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"📝 Results written to {args.output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+    sys.exit(0 if all(r['exit_code'] == 0 for r in results) else 1)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except subprocess.CalledProcessError as e:
+        print(f"❌ ffmpeg failed with exit code {e.returncode}")
+        sys.exit(1)
@@ -3,18 +3,36 @@ import sys
 import asyncio
 import logging
 import json
-import requests
-import subprocess
-import psutil
+import contextlib
+import importlib.util
 from pathlib import Path
-from datetime import datetime
-from telethon import TelegramClient, events, Button
-from telethon.sessions import StringSession
+from datetime import datetime, timezone
 from aiohttp import web
 import re
 import base64
 import time
 import hashlib
+import random
+import shutil
+import functools
+from bisect import bisect_left
+from urllib.parse import urlsplit
+from collections import namedtuple, deque, OrderedDict, Counter
+import aiohttp
+
+import job_manifest
+from message_router import MessageRouter, valid_timestamps
+
+# Heavy modules, imported by load_runtime_modules() once the web server is listening
+TelegramClient = events = Button = errors = StringSession = psutil = video_processing = None
+
+def load_runtime_modules():
+    """Import Telethon, psutil and the encoder helpers into this module; runs in a worker thread so the loop keeps serving."""
+    global TelegramClient, events, Button, errors, StringSession, psutil, video_processing
+    from telethon import TelegramClient, events, Button, errors
+    from telethon.sessions import StringSession
+    import psutil
+    import video_processing
 
 # Setup logging
 logging.basicConfig(
@@ -41,17 +59,1337 @@ if not SESSION_STRING:
 MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB for free Telegram
 PORT = int(os.getenv('PORT', 10000))
 
-# Speed options
+# System sampler: one sample every SYSTEM_SAMPLE_INTERVAL seconds, one minute of history by default
+SYSTEM_SAMPLE_INTERVAL = float(os.getenv('SYSTEM_SAMPLE_INTERVAL', 5))
+SYSTEM_SAMPLE_HISTORY = int(os.getenv('SYSTEM_SAMPLE_HISTORY', 12))
+
+# Speed options, as rows of (label, callback data)
 SPEED_OPTIONS = [
-    [Button.inline("0.5x", b"speed_0.5"), Button.inline("0.75x", b"speed_0.75")],
-    [Button.inline("1.25x", b"speed_1.25"), Button.inline("1.3x", b"speed_1.3")],
-    [Button.inline("1.4x", b"speed_1.4"), Button.inline("1.5x", b"speed_1.5")],
-    [Button.inline("2.0x", b"speed_2.0"), Button.inline("3.0x", b"speed_3.0")],
-    [Button.inline("❌ Cancel", b"cancel")]
+    [("0.5x", b"speed_0.5"), ("0.75x", b"speed_0.75")],
+    [("1.0x", b"speed_1.0"), ("1.25x", b"speed_1.25")],
+    [("1.3x", b"speed_1.3"), ("1.4x", b"speed_1.4")],
+    [("1.5x", b"speed_1.5"), ("2.0x", b"speed_2.0")],
+    [("3.0x", b"speed_3.0")]
 ]
+PROCESSING_MODE_NOTES = {
+    'full': "Full: re-encodes the video, frame-accurate cuts",
+    'fast': "Fast: keeps the video frames and only changes their timing (cuts land on keyframes)"
+}
+
+def speed_buttons(processing_mode='full'):
+    """Speed step keyboard with the processing mode toggle."""
+    toggle = "⚡ Fast mode: ON" if processing_mode == 'fast' else "🐢 Fast mode: OFF"
+    rows = SPEED_OPTIONS + [[(toggle, b"mode_toggle")], [("❌ Cancel", b"cancel")]]
+    return [[Button.inline(label, data) for label, data in row] for row in rows]
+
+# GitHub API settings
+GITHUB_API_URL = 'https://api.github.com'
+GITHUB_API_TIMEOUT = int(os.getenv('GITHUB_API_TIMEOUT', 30))
+GITHUB_API_RETRIES = int(os.getenv('GITHUB_API_RETRIES', 4))
+GITHUB_API_POOL_SIZE = int(os.getenv('GITHUB_API_POOL_SIZE', 10))
+GITHUB_MAX_RATE_LIMIT_WAIT = int(os.getenv('GITHUB_MAX_RATE_LIMIT_WAIT', 120))
+
+# Session store limits
+SESSION_MAX_COUNT = int(os.getenv('SESSION_MAX_COUNT', 1000))
+SESSION_SWEEP_INTERVAL = int(os.getenv('SESSION_SWEEP_INTERVAL', 60))
+SESSION_DEFAULT_TTL = 30 * 60
+
+# Idle seconds allowed at each conversation step before the session expires
+SESSION_STEP_TTLS = {
+    'speed': 15 * 60,
+    'split': 30 * 60,
+    'youtube_title': 30 * 60,
+    'github_title': 30 * 60,
+    'auth': 10 * 60
+}
+
+# Job queue: workflow runs allowed at once and videos a user may have waiting
+WORKFLOW_FILE = 'telegram_download_processor.yml'
+MAX_INFLIGHT_RUNS = int(os.getenv('MAX_INFLIGHT_RUNS', 4))
+MAX_PENDING_PER_USER = int(os.getenv('MAX_PENDING_PER_USER', 5))
+RUN_COUNT_CACHE_SECONDS = 15
+# Stop dispatching while fewer API calls than this are left before the rate limit resets
+GITHUB_MIN_RATE_LIMIT = int(os.getenv('GITHUB_MIN_RATE_LIMIT', 50))
+QUEUE_POSITION_UPDATES = 20
+
+# Local fast lane: small jobs are encoded on the bot host instead of in a workflow run
+LOCAL_MAX_SIZE_MB = int(os.getenv('LOCAL_MAX_SIZE_MB', 50))
+LOCAL_MAX_DURATION = int(os.getenv('LOCAL_MAX_DURATION', 10 * 60))
+LOCAL_WORKERS = int(os.getenv('LOCAL_WORKERS', 1))
+LOCAL_QUEUE_SIZE = int(os.getenv('LOCAL_QUEUE_SIZE', 4))
+LOCAL_MAX_CPU_PERCENT = float(os.getenv('LOCAL_MAX_CPU_PERCENT', 70))
+LOCAL_MIN_RAM_MB = int(os.getenv('LOCAL_MIN_RAM_MB', 512))
+# Source, parts and ffmpeg's scratch space all need room, so ask for a multiple of the source size
+LOCAL_DISK_FACTOR = 4
+LOCAL_PRESET = os.getenv('LOCAL_PRESET', 'veryfast')
+LOCAL_WORK_DIR = Path(os.getenv('LOCAL_WORK_DIR', '/tmp/videos'))
+
+# Progress message edits: Telegram floods out chats edited faster than this
+EDIT_CHAT_INTERVAL = float(os.getenv('EDIT_CHAT_INTERVAL', 1.0))
+EDIT_GLOBAL_RATE = float(os.getenv('EDIT_GLOBAL_RATE', 20))
+EDIT_MEMORY = 5000
+
+# Run poller: one conditional poll of the processing workflow's runs per interval
+RUN_POLL_INTERVAL = int(os.getenv('RUN_POLL_INTERVAL', 15))
+RUN_POLL_PAGE_SIZE = 50
+RUN_WATCH_TIMEOUT = 7 * 3600
+# The workflow's run-name carries the job key, e.g. "video-1a2b3c4d5e6f7a8b full"
+RUN_NAME_PATTERN = re.compile(r'\bvideo-([0-9a-f]+)\b')
+ACTIVE_RUN_STATUSES = {'queued', 'in_progress', 'waiting', 'requested', 'pending'}
+
+# Finished results remembered in memory before falling back to a release lookup
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 500))
+METADATA_GC_INTERVAL = int(os.getenv('METADATA_GC_INTERVAL', 6 * 3600))
+RESULT_MARKER_PATTERN = re.compile(r'<!-- result: (\{.*?\}) -->')
+
+# /metrics: latency histogram buckets in seconds and the event-loop lag probe interval
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 1.0))
+# Path segments that would give every release, file or commit its own series
+GITHUB_ENDPOINT_PLACEHOLDERS = {'tags': ':tag', 'contents': ':path', 'commits': ':sha', 'trees': ':sha',
+                                'heads': ':branch', 'runs': ':id', 'releases': ':id', 'caches': ':id'}
+
+GitHubResponse = namedtuple('GitHubResponse', ['status', 'data', 'text', 'headers'])
+CachedResult = namedtuple('CachedResult', ['job_key', 'release_id', 'release_url', 'release_name',
+                                           'video_title', 'parts', 'youtube'])
+# YouTube states of a result that need no publish run: uploaded, or no YouTube credentials on the runner
+FINISHED_YOUTUBE_STATES = {'done', 'skipped'}
+
+class GitHubRateLimitError(Exception):
+    """Raised when GitHub's rate limit resets too far in the future to wait for"""
+
+class PartialDeliveryError(Exception):
+    """Raised when a local job fails after some of its parts were already sent to the chat"""
+    
+    def __init__(self, sent, total, error):
+        super().__init__(f"sent {sent} of {total} parts, then: {error}")
+        self.sent = sent
+        self.total = total
+
+class Histogram:
+    """Fixed-bucket latency histogram; observe() is a bisect and three additions"""
+    
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+    
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """
+    In-process counters and histograms rendered in the Prometheus text format.
+    Series are plain dict entries keyed by (name, labels), so recording costs a
+    dict lookup; gauges are read from their owners only when /metrics is scraped.
+    """
+    
+    def __init__(self, lag_interval=LOOP_LAG_INTERVAL):
+        self.lag_interval = lag_interval
+        self.help = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.last_lag = 0.0
+        self._task = None
+    
+    def describe(self, name, text):
+        self.help[name] = text
+    
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+    
+    def gauge(self, name, text, collect, kind='gauge'):
+        """
+        Register a series read at scrape time; collect() returns {labels: value}.
+        Use kind='counter' for totals another object already keeps.
+        """
+        self.help[name] = text
+        self.gauges[name] = (collect, kind)
+    
+    def timed(self, handler):
+        """Decorator recording latency and errors of a Telegram handler."""
+        name = handler.__name__
+        
+        @functools.wraps(handler)
+        async def wrapper(*args):
+            started = time.perf_counter()
+            try:
+                return await handler(*args)
+            except Exception:
+                self.inc('bot_handler_errors_total', (('handler', name),))
+                raise
+            finally:
+                self.observe('bot_handler_seconds', time.perf_counter() - started, (('handler', name),))
+        
+        return wrapper
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._probe_loop_lag())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _probe_loop_lag(self):
+        """How late a plain sleep wakes up is how long callbacks waited for the loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, loop.time() - expected)
+            self.observe('bot_event_loop_lag_seconds', lag)
+            self.last_lag = lag
+    
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ''
+        escaped = []
+        for key, value in pairs:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{key}="{value}"')
+        return '{' + ','.join(escaped) + '}'
+    
+    def _header(self, lines, name, kind, seen):
+        if name not in seen:
+            seen.add(name)
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+    
+    def render(self):
+        lines, seen = [], set()
+        for (name, labels), value in sorted(self.counters.items()):
+            self._header(lines, name, 'counter', seen)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            self._header(lines, name, 'histogram', seen)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        
+        for name, (collect, kind) in self.gauges.items():
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning(f"Metrics gauge {name} failed: {e}")
+                continue
+            self._header(lines, name, kind, seen)
+            for labels, value in values.items():
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('bot_handler_seconds', 'Telegram handler latency')
+metrics.describe('bot_handler_errors_total', 'Telegram handler calls that raised')
+metrics.describe('github_request_seconds', 'GitHub API request latency by endpoint and status')
+metrics.describe('google_request_seconds', 'Google API request latency by endpoint and status')
+metrics.describe('bot_workflow_dispatches_total', 'Workflow dispatches by result')
+metrics.describe('bot_event_loop_lag_seconds', 'How late the event loop ran a timer')
+
+def github_endpoint(url):
+    """Low-cardinality label for a GitHub API URL, e.g. releases/tags/:tag."""
+    path = urlsplit(url).path
+    prefix = f"/repos/{GITHUB_REPO}/"
+    path = path[len(prefix):] if path.startswith(prefix) else path.lstrip('/')
+    segments = []
+    for segment in path.split('/'):
+        previous = segments[-1] if segments else None
+        if previous in GITHUB_ENDPOINT_PLACEHOLDERS and segment not in ('tags', 'assets', 'jobs', 'dispatches'):
+            segments.append(GITHUB_ENDPOINT_PLACEHOLDERS[previous])
+            if previous == 'contents':
+                break
+        elif segment.isdigit():
+            segments.append(':id')
+        else:
+            segments.append(segment)
+    return '/'.join(segments)
+
+class GitHubAPIClient:
+    """Shared non-blocking GitHub REST client with keep-alive pooling, retries and rate-limit handling"""
+    
+    RETRY_STATUSES = {500, 502, 503, 504}
+    # Safe to resend after a 5xx or a timeout; a POST may already have taken effect
+    IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'}
+    
+    def __init__(self, token, repo, timeout=GITHUB_API_TIMEOUT, max_retries=GITHUB_API_RETRIES,
+                 pool_size=GITHUB_API_POOL_SIZE, backoff_base=1.0,
+                 max_rate_limit_wait=GITHUB_MAX_RATE_LIMIT_WAIT):
+        self.token = token
+        self.repo = repo
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.backoff_base = backoff_base
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = 0
+        self._session = None
+    
+    @property
+    def configured(self):
+        return bool(self.token and self.repo)
+    
+    def repo_url(self, path):
+        """Build an API URL below /repos/{owner}/{repo}."""
+        return f"{GITHUB_API_URL}/repos/{self.repo}/{path.lstrip('/')}"
+    
+    def _get_session(self):
+        """Create the pooled session lazily so it binds to the running event loop."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=10),
+                headers={
+                    'Authorization': f'token {self.token}',
+                    'Accept': 'application/vnd.github.v3+json',
+                    'User-Agent': 'telegram-video-bot'
+                }
+            )
+        return self._session
+    
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    def _backoff(self, attempt):
+        return self.backoff_base * (2 ** attempt) + random.uniform(0, self.backoff_base)
+    
+    def _update_rate_limit(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is not None and remaining.isdigit():
+            self.rate_limit_remaining = int(remaining)
+        if reset is not None and reset.isdigit():
+            self.rate_limit_reset = int(reset)
+    
+    def _rate_limit_delay(self, status, headers):
+        """Seconds to wait before retrying a rate-limited response, or None if not rate limited."""
+        if status not in (403, 429):
+            return None
+        retry_after = headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        if headers.get('X-RateLimit-Remaining') == '0':
+            return max(self.rate_limit_reset - time.time(), 1)
+        return None
+    
+    async def _wait_for_rate_limit(self):
+        """Hold requests back while the primary rate limit is exhausted."""
+        if self.rate_limit_remaining != 0:
+            return
+        delay = self.rate_limit_reset - time.time()
+        if delay <= 0:
+            self.rate_limit_remaining = None
+            return
+        if delay > self.max_rate_limit_wait:
+            raise GitHubRateLimitError(f"GitHub rate limit exhausted, resets in {int(delay)}s")
+        logger.warning(f"GitHub rate limit exhausted, waiting {delay:.0f}s")
+        await asyncio.sleep(delay)
+        self.rate_limit_remaining = None
+    
+    async def request(self, method, url, **kwargs):
+        """
+        Send a request, retrying rate-limited responses and connection failures
+        with backoff. 5xx responses and timeouts are only retried for idempotent
+        methods; a POST is resent only when the connection failed before it went out.
+        """
+        session = self._get_session()
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_rate_limit()
+            last_attempt = attempt == self.max_retries
+            
+            started = time.perf_counter()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    text = await response.text()
+                    headers = response.headers
+                    status = response.status
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                metrics.observe('github_request_seconds', time.perf_counter() - started,
+                                (('method', method), ('endpoint', github_endpoint(url)), ('status', 'error')))
+                if last_attempt or not (idempotent or isinstance(e, aiohttp.ClientConnectorError)):
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"GitHub {method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            
+            metrics.observe('github_request_seconds', time.perf_counter() - started,
+                            (('method', method), ('endpoint', github_endpoint(url)), ('status', str(status))))
+            self._update_rate_limit(headers)
+            
+            if not last_attempt:
+                delay = self._rate_limit_delay(status, headers)
+                if delay is None and idempotent and status in self.RETRY_STATUSES:
+                    delay = self._backoff(attempt)
+                if delay is not None:
+                    if delay > self.max_rate_limit_wait:
+                        raise GitHubRateLimitError(f"GitHub asked to wait {int(delay)}s")
+                    logger.warning(f"GitHub {method} {url} returned {status}, retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+            
+            data = None
+            if text and 'json' in headers.get('Content-Type', ''):
+                try:
+                    data = json.loads(text)
+                except ValueError:
+                    data = None
+            return GitHubResponse(status, data, text, headers)
+    
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+    
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+    
+    async def put(self, url, **kwargs):
+        return await self.request('PUT', url, **kwargs)
+    
+    async def patch(self, url, **kwargs):
+        return await self.request('PATCH', url, **kwargs)
+
+github_client = GitHubAPIClient(GITHUB_TOKEN, GITHUB_REPO)
+
+class UserSession:
+    """Conversation state for a single user"""
+    
+    __slots__ = (
+        'user_id', 'chat_id', 'step', 'file_metadata', 'file_size', 'speed',
+        'split_timestamps', 'youtube_title', 'github_title', 'waiting_for_auth',
+        'auth_message_id', 'created_at', 'last_active', 'pending', 'processing_mode'
+    )
+    
+    def __init__(self, user_id, chat_id=None, step=None, file_metadata=None, file_size=0):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.step = step
+        self.file_metadata = file_metadata
+        self.file_size = file_size
+        self.speed = None
+        self.split_timestamps = None
+        self.youtube_title = None
+        self.github_title = None
+        self.waiting_for_auth = False
+        self.auth_message_id = None
+        self.created_at = time.monotonic()
+        self.last_active = self.created_at
+        # Videos sent while this conversation was still open: (file_metadata, file_size)
+        self.pending = deque()
+        self.processing_mode = 'full'
+
+class SessionStore:
+    """Bounded user session store with per-step TTLs and LRU eviction"""
+    
+    def __init__(self, max_sessions=SESSION_MAX_COUNT, step_ttls=SESSION_STEP_TTLS,
+                 default_ttl=SESSION_DEFAULT_TTL, sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.max_sessions = max_sessions
+        self.step_ttls = step_ttls
+        self.default_ttl = default_ttl
+        self.sweep_interval = sweep_interval
+        self.evictions = Counter()
+        self._sessions = OrderedDict()
+        self._task = None
+    
+    def __len__(self):
+        return len(self._sessions)
+    
+    def __contains__(self, user_id):
+        return user_id in self._sessions
+    
+    def _ttl(self, session):
+        ttl = self.step_ttls.get(session.step, self.default_ttl)
+        if session.waiting_for_auth:
+            ttl = max(ttl, self.step_ttls.get('auth', self.default_ttl))
+        return ttl
+    
+    def _is_expired(self, session, now):
+        # Videos waiting on the session would be lost with it, so those sessions never expire
+        return not session.pending and now - session.last_active > self._ttl(session)
+    
+    def get(self, user_id):
+        """Return the live session for a user, dropping it if it has expired."""
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        
+        now = time.monotonic()
+        if self._is_expired(session, now):
+            del self._sessions[user_id]
+            self.evictions['expired'] += 1
+            return None
+        
+        session.last_active = now
+        self._sessions.move_to_end(user_id)
+        return session
+    
+    def create(self, user_id, **fields):
+        """Start a new session for a user, replacing any existing one."""
+        self._sessions.pop(user_id, None)
+        session = UserSession(user_id, **fields)
+        self._sessions[user_id] = session
+        
+        while len(self._sessions) > self.max_sessions:
+            # Least recently used first, skipping sessions that hold pending videos
+            victim = next((uid for uid, other in self._sessions.items()
+                           if not other.pending and uid != user_id), None)
+            if victim is None:
+                break
+            del self._sessions[victim]
+            self.evictions['lru'] += 1
+        
+        return session
+    
+    def discard(self, user_id):
+        self._sessions.pop(user_id, None)
+    
+    def sweep(self):
+        """Remove every expired session and return how many were dropped."""
+        now = time.monotonic()
+        expired = [uid for uid, session in self._sessions.items() if self._is_expired(session, now)]
+        for user_id in expired:
+            del self._sessions[user_id]
+        self.evictions['expired'] += len(expired)
+        return len(expired)
+    
+    def step_counts(self):
+        return Counter(session.step or 'idle' for session in self._sessions.values())
+    
+    def start(self):
+        """Start the expiry sweeper on the running loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                logger.info(f"Expired {removed} idle sessions ({len(self._sessions)} active)")
+
+class ResultCache:
+    """
+    Content-addressed lookup of finished jobs. The source key identifies the
+    Telegram document, the job key adds the processing parameters, and the
+    release tagged with the job key holds the encoded parts. Hits are kept in a
+    bounded LRU; misses fall through to a release lookup so results survive restarts.
+    """
+    
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.stats = Counter()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def source_key(metadata):
+        """Stable identity of the Telegram document (id and size, not the per-send reference)."""
+        return hashlib.sha256(f"{metadata['file_id']}:{metadata['size']}".encode()).hexdigest()[:16]
+    
+    @staticmethod
+    def job_key(source_key, speed, split_timestamps, processing_mode='full'):
+        """Source plus every parameter that changes the encoded parts; titles only affect publishing."""
+        splits = ','.join(ts.strip() for ts in (split_timestamps or '').split(',') if ts.strip())
+        # Full-mode keys keep their original form so earlier results still match
+        mode = f"|{processing_mode}" if processing_mode != 'full' else ''
+        return hashlib.sha256(f"{source_key}|{float(speed):g}|{splits}{mode}".encode()).hexdigest()[:16]
+    
+    @staticmethod
+    def release_tag(job_key):
+        return f"video-{job_key}"
+    
+    def _remember(self, entry):
+        self._entries[entry.job_key] = entry
+        self._entries.move_to_end(entry.job_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evicted'] += 1
+    
+    def invalidate(self, job_key):
+        self._entries.pop(job_key, None)
+    
+    async def lookup(self, job_key):
+        """Return the CachedResult for a job, or None when it has to be processed."""
+        entry = self._entries.get(job_key)
+        if entry is not None:
+            self._entries.move_to_end(job_key)
+            self.stats['hits'] += 1
+            return entry
+        
+        response = await github_client.get(github_client.repo_url(f"releases/tags/{self.release_tag(job_key)}"))
+        release = response.data if response.status == 200 else None
+        match = RESULT_MARKER_PATTERN.search((release or {}).get('body') or '')
+        if match:
+            details = json.loads(match.group(1))
+            parts = [asset for asset in release.get('assets', []) if asset['name'].endswith('.mp4')]
+            # A release whose run is still uploading (or failed half way) is not a result yet
+            if details.get('parts') and len(parts) >= details['parts']:
+                youtube = details.get('youtube')
+                # Without confirmed YouTube uploads the title matches nothing, so the job is republished
+                video_title = details.get('video_title') if youtube == 'done' else None
+                entry = CachedResult(job_key, release['id'], release['html_url'], release['name'],
+                                     video_title, details['parts'], youtube)
+                # Pending results are looked up again next time, since a publish run may finish them
+                if youtube in FINISHED_YOUTUBE_STATES:
+                    self._remember(entry)
+                self.stats['hits'] += 1
+                return entry
+        
+        self.stats['misses'] += 1
+        return None
+    
+    async def source_cached(self, source_key):
+        """Whether the runner cache still holds the downloaded source."""
+        response = await github_client.get(github_client.repo_url('actions/caches'),
+                                           params={'key': f"source-{source_key}"})
+        return response.status == 200 and bool((response.data or {}).get('total_count'))
+    
+    async def retitle(self, entry, release_name):
+        """Rename the release in place; no run needed."""
+        response = await github_client.patch(github_client.repo_url(f"releases/{entry.release_id}"),
+                                             json={'name': release_name})
+        if response.status == 404:
+            self.invalidate(entry.job_key)
+            return None
+        if response.status != 200:
+            raise RuntimeError(f"Could not rename release: {response.status} - {response.text}")
+        entry = entry._replace(release_name=release_name)
+        if entry.youtube in FINISHED_YOUTUBE_STATES:
+            self._remember(entry)
+        return entry
+
+result_cache = ResultCache()
+
+class QueuedJob:
+    """A fully described video waiting for a workflow run"""
+    
+    __slots__ = (
+        'user_id', 'chat_id', 'job_key', 'metadata', 'speed', 'split_timestamps',
+        'youtube_title', 'github_title', 'job_mode', 'processing_mode', 'cached', 'cache_summary',
+        'message', 'position', 'enqueued_at'
+    )
+    
+    def __init__(self, user_id, chat_id, job_key, metadata, speed, split_timestamps,
+                 youtube_title, github_title, job_mode='full', processing_mode='full', cached=None,
+                 cache_summary='', message=None):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.job_key = job_key
+        self.metadata = metadata
+        self.speed = speed
+        self.split_timestamps = split_timestamps
+        self.youtube_title = youtube_title
+        self.github_title = github_title
+        self.job_mode = job_mode
+        self.processing_mode = processing_mode
+        self.cached = cached
+        self.cache_summary = cache_summary
+        self.message = message
+        self.position = None
+        self.enqueued_at = time.monotonic()
+
+class JobQueue:
+    """
+    Fair dispatch queue for workflow runs. Every user has a FIFO of jobs and
+    users are served round-robin, so one user's burst cannot starve the rest.
+    A job is only dispatched while fewer than max_inflight runs are queued or
+    in progress on GitHub and the API rate limit still has headroom.
+    """
+    
+    def __init__(self, dispatch, poller, notify=None, max_inflight=MAX_INFLIGHT_RUNS,
+                 max_per_user=MAX_PENDING_PER_USER):
+        self.dispatch = dispatch
+        self.poller = poller
+        self.notify = notify
+        self.max_inflight = max_inflight
+        self.max_per_user = max_per_user
+        self.stats = Counter()
+        # user_id -> deque of jobs; dict order is the round-robin order
+        self._queues = OrderedDict()
+        self._ready = asyncio.Event()
+        self._active_runs = 0
+        self._active_fetched_at = 0.0
+        # (job_key, dispatched_at) of runs GitHub has not listed yet; a refresh alone would forget them
+        self._unseen = []
+        self._task = None
+    
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+    
+    def pending_for(self, user_id):
+        return len(self._queues.get(user_id, ()))
+    
+    @property
+    def inflight(self):
+        """Active runs as of the last check, including dispatches GitHub has not listed yet."""
+        return self._active_runs + len(self._unseen)
+    
+    def order(self):
+        """Jobs in the order they will be dispatched."""
+        queues = [list(queue) for queue in self._queues.values()]
+        ordered = []
+        for depth in range(max(map(len, queues), default=0)):
+            ordered.extend(queue[depth] for queue in queues if depth < len(queue))
+        return ordered
+    
+    def put(self, job):
+        """Queue a job and return its position, or None if the user already has too many waiting."""
+        queue = self._queues.setdefault(job.user_id, deque())
+        if len(queue) >= self.max_per_user:
+            return None
+        queue.append(job)
+        self.stats['queued'] += 1
+        self._ready.set()
+        job.position = self.order().index(job) + 1
+        return job.position
+    
+    def _requeue(self, job):
+        """Put a job that could not be dispatched back at the head of the line."""
+        self._queues.setdefault(job.user_id, deque()).appendleft(job)
+        self._queues.move_to_end(job.user_id, last=False)
+    
+    def _next(self):
+        user_id, queue = self._queues.popitem(last=False)
+        job = queue.popleft()
+        if queue:
+            # The user goes to the back of the rotation
+            self._queues[user_id] = queue
+        return job
+    
+    def _settle_unseen(self, runs):
+        """Drop dispatches that now show up in the run list (or never will)."""
+        now = time.time()
+        claimed = set()
+        unseen = []
+        for job_key, dispatched_at in self._unseen:
+            run = next((run for run in runs
+                        if run['id'] not in claimed and RunPoller.job_key(run) == job_key
+                        and RunPoller._created_at(run) >= dispatched_at - 60), None)
+            if run is not None:
+                claimed.add(run['id'])
+            elif now - dispatched_at < RUN_WATCH_TIMEOUT:
+                unseen.append((job_key, dispatched_at))
+        self._unseen = unseen
+    
+    async def active_runs(self):
+        """Queued plus in-progress runs of the processing workflow, from the shared run poller."""
+        if time.monotonic() - self._active_fetched_at >= RUN_COUNT_CACHE_SECONDS:
+            runs = await self.poller.refresh(max_age=RUN_COUNT_CACHE_SECONDS)
+            self._settle_unseen(runs)
+            self._active_runs = self.poller.active_count()
+            self._active_fetched_at = time.monotonic()
+        return self.inflight
+    
+    async def _wait_for_capacity(self):
+        while True:
+            remaining = github_client.rate_limit_remaining
+            if remaining is not None and remaining < GITHUB_MIN_RATE_LIMIT:
+                delay = max(github_client.rate_limit_reset - time.time(), 1)
+                self.stats['rate_limited'] += 1
+                logger.warning(f"Only {remaining} GitHub API calls left, pausing dispatch for {delay:.0f}s")
+                await asyncio.sleep(delay)
+                github_client.rate_limit_remaining = None
+                continue
+            if await self.active_runs() < self.max_inflight:
+                return
+            self.stats['throttled'] += 1
+            await asyncio.sleep(RUN_COUNT_CACHE_SECONDS)
+    
+    async def _update_positions(self):
+        if not self.notify:
+            return
+        for position, job in enumerate(self.order()[:QUEUE_POSITION_UPDATES], 1):
+            if job.position != position:
+                job.position = position
+                await self.notify(job, position, len(self))
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            if not self._queues:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            
+            try:
+                await self._wait_for_capacity()
+            except Exception as e:
+                logger.error(f"Could not check workflow capacity: {e}")
+                await asyncio.sleep(RUN_COUNT_CACHE_SECONDS)
+                continue
+            
+            job = self._next()
+            try:
+                if await self.dispatch(job):
+                    self.stats['dispatched'] += 1
+                    # Counted on its own until a refresh lists the run
+                    self._unseen.append((job.job_key, time.time()))
+                else:
+                    self.stats['failed'] += 1
+            except GitHubRateLimitError as e:
+                logger.warning(f"Dispatch rate limited, keeping job {job.job_key} queued: {e}")
+                self.stats['rate_limited'] += 1
+                self._requeue(job)
+                await asyncio.sleep(github_client.max_rate_limit_wait)
+                continue
+            except Exception as e:
+                logger.error(f"Dispatch error for job {job.job_key}: {e}")
+                self.stats['failed'] += 1
+            
+            try:
+                await self._update_positions()
+            except Exception as e:
+                logger.error(f"Queue position update error: {e}")
+
+class LocalLane:
+    """
+    Runs small jobs on the bot host: download through the bot's own client, the
+    same split and speed plan as the workflow with ffmpeg as asyncio subprocesses,
+    and the parts sent back into the chat. A fixed number of workers drain a
+    bounded queue; a job is only admitted while the sampled CPU, RAM and disk
+    leave room for it. Anything else, and any job that fails here, goes to the
+    workflow queue.
+    """
+    
+    def __init__(self, client, monitor, editor, fallback, workers=LOCAL_WORKERS, queue_size=LOCAL_QUEUE_SIZE,
+                 max_size=LOCAL_MAX_SIZE_MB * 1024 * 1024, max_duration=LOCAL_MAX_DURATION, work_dir=LOCAL_WORK_DIR):
+        self.client = client
+        self.monitor = monitor
+        self.editor = editor
+        self.fallback = fallback
+        self.workers = workers
+        self.max_size = max_size
+        self.max_duration = max_duration
+        self.work_dir = work_dir
+        self.running = 0
+        self.queued_bytes = 0
+        self.stats = Counter()
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+    
+    def __len__(self):
+        return self._queue.qsize()
+    
+    def eligible(self, job):
+        """Whether the job is small and simple enough to run here at all."""
+        duration = job.metadata.get('duration')
+        return (
+            self.workers > 0
+            and startup.dependencies.get('FFmpeg', False)
+            and job.job_mode == 'full'
+            and job.metadata['size'] <= self.max_size
+            and duration is not None and duration <= self.max_duration
+        )
+    
+    def admit(self, job):
+        """(True, None) when there is room for the job right now, else (False, reason)."""
+        if self._queue.full():
+            return False, 'local queue full'
+        snapshot = self.monitor.snapshot()
+        if snapshot is None:
+            return False, 'no system samples yet'
+        latest = snapshot['latest']
+        if snapshot['cpu_avg'] > LOCAL_MAX_CPU_PERCENT:
+            return False, f"CPU at {snapshot['cpu_avg']:.0f}%"
+        if latest.ram_available < LOCAL_MIN_RAM_MB * 1024 * 1024:
+            return False, f"{latest.ram_available / (1024**2):.0f}MB RAM free"
+        # Jobs already waiting will take their share of the disk too
+        needed = LOCAL_DISK_FACTOR * (job.metadata['size'] + self.queued_bytes)
+        if latest.disk_free < needed:
+            return False, f"{latest.disk_free / (1024**3):.1f}GB disk free"
+        return True, None
+    
+    def put(self, job):
+        """Queue an admitted job and return its position."""
+        self._queue.put_nowait(job)
+        self.queued_bytes += job.metadata['size']
+        self.stats['queued'] += 1
+        return self._queue.qsize() + self.running
+    
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            self.queued_bytes -= job.metadata['size']
+            self.running += 1
+            try:
+                await self.process(job)
+                self.stats['completed'] += 1
+            except asyncio.CancelledError:
+                raise
+            except PartialDeliveryError as e:
+                # A workflow run would deliver the parts the user already has a second time
+                logger.error(f"Local job {job.job_key} failed part way through sending: {e}")
+                self.stats['failed'] += 1
+                self.editor.edit(job.message, f"⚠️ **Sent {e.sent} of {e.total} parts**, then sending failed: "
+                                              f"{str(e.__cause__)[:300]}\nSend the video again to retry.")
+            except Exception as e:
+                logger.error(f"Local job {job.job_key} failed, handing it to the workflow: {e}")
+                self.stats['failed'] += 1
+                job.cache_summary += '; local run failed'
+                position = self.fallback(job)
+                if position is None:
+                    self.editor.edit(job.message, f"❌ **Local processing failed:** {str(e)[:300]}")
+                else:
+                    self.editor.edit(job.message, f"⚠️ **Local processing failed**, queued for the GitHub workflow "
+                                                  f"at position {position}")
+            finally:
+                self.running -= 1
+    
+    async def _exec(self, *commands):
+        """Run commands one after another; a cancelled job takes its ffmpeg down with it."""
+        for command in commands:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+            if process.returncode != 0:
+                raise RuntimeError(f"{command[0]} exited with {process.returncode}: {stderr.decode(errors='replace')[-300:]}")
+        return stdout
+    
+    async def probe(self, path):
+        """(duration, streams, frame_rate) from one ffprobe call."""
+        output = await self._exec([
+            'ffprobe', '-v', 'error', '-show_entries', 'format=duration:stream=codec_type,codec_name,r_frame_rate',
+            '-of', 'json', str(path)
+        ])
+        info = json.loads(output)
+        streams = info.get('streams', [])
+        frame_rate = next(
+            (stream['r_frame_rate'] for stream in streams
+             if stream.get('codec_type') == 'video' and stream.get('r_frame_rate', '0/0') != '0/0'),
+            '25/1'
+        )
+        return float(info['format']['duration']), streams, frame_rate
+    
+    async def process(self, job):
+        metadata = job.metadata
+        # Identical jobs share a job_key, so the requesting message keeps their directories apart
+        job_dir = self.work_dir / f"{job.job_key}-{job.user_id}-{metadata['original_message_id']}"
+        job_dir.mkdir(parents=True, exist_ok=True)
+        started = time.monotonic()
+        try:
+            self.editor.edit(job.message, f"📥 **Downloading locally...** ({metadata['size'] / (1024**2):.1f}MB)")
+            message = await self.client.get_messages(metadata['chat_id'], ids=metadata['original_message_id'])
+            if message is None or message.file is None:
+                raise RuntimeError('the original message is gone')
+            
+            def progress(current, total):
+                self.editor.edit(job.message, f"📥 **Downloading locally...** {current * 100 / total:.0f}%")
+            
+            source = job_dir / f"source{Path(metadata['file_name']).suffix or '.mp4'}"
+            await self.client.download_media(message, file=str(source), progress_callback=progress)
+            
+            duration, streams, frame_rate = await self.probe(source)
+            has_audio = any(stream.get('codec_type') == 'audio' for stream in streams)
+            basename = str(job_dir / Path(metadata['file_name']).stem)
+            plan = video_processing.build_plan(duration, job.split_timestamps, basename, job.speed)
+            
+            fast = False
+            if job.processing_mode == 'fast':
+                fast, reason = video_processing.fast_path_check(streams, frame_rate, job.speed)
+                if not fast:
+                    logger.info(f"Local job {job.job_key} falls back to a full encode: {reason}")
+            audio_codec = next((stream.get('codec_name') for stream in streams if stream.get('codec_type') == 'audio'), None)
+            # The workers share the host, so each encode gets its slice of the cores
+            threads = max(1, video_processing.available_cores() // self.workers)
+            
+            for part in plan:
+                self.editor.edit(job.message, f"🎞️ **Processing locally...** part {part.index}/{len(plan)} at {job.speed}x")
+                if fast:
+                    commands = video_processing.build_fast_commands(str(source), part, job.speed, has_audio, audio_codec)
+                else:
+                    commands = [video_processing.build_encode_command(
+                        str(source), part, job.speed, has_audio, LOCAL_PRESET, video_processing.DEFAULT_CRF,
+                        threads, frame_rate
+                    )]
+                await self._exec(*commands)
+            
+            self.editor.edit(job.message, f"📤 **Sending {len(plan)} part(s)...**")
+            for sent, part in enumerate(plan):
+                try:
+                    await self.client.send_file(
+                        job.chat_id,
+                        part.output,
+                        caption=f"🎬 {job.youtube_title} — part {part.index}/{len(plan)} at {job.speed}x",
+                        reply_to=metadata['original_message_id'],
+                        supports_streaming=True
+                    )
+                except Exception as e:
+                    if sent:
+                        raise PartialDeliveryError(sent, len(plan), e) from e
+                    raise
+            
+            self.editor.edit(job.message,
+                f"✅ **Processed locally!**\n\n"
+                f"• Speed: {job.speed}x ({'fast' if fast else 'full'} mode)\n"
+                f"• Parts: {len(plan)}\n"
+                f"• Took: {time.monotonic() - started:.0f}s\n\n"
+                f"Small videos are sent back here instead of going to YouTube and GitHub Releases."
+            )
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, job_dir, True)
+
+class MessageEditor:
+    """
+    Rate-limited, coalescing message edits. Only the newest pending text per
+    message is kept, edits are spaced per chat and globally, unchanged text is
+    dropped, and a FloodWait pauses the queue instead of failing the edit.
+    """
+    
+    def __init__(self, chat_interval=EDIT_CHAT_INTERVAL, global_rate=EDIT_GLOBAL_RATE, memory=EDIT_MEMORY):
+        self.chat_interval = chat_interval
+        self.global_interval = 1.0 / global_rate
+        self.memory = memory
+        self.stats = Counter()
+        # (chat_id, message_id) -> (message, text, kwargs), oldest first
+        self._pending = OrderedDict()
+        self._last_text = OrderedDict()
+        self._chat_next = {}
+        self._global_next = 0.0
+        self._paused_until = 0.0
+        self._wake = asyncio.Event()
+        self._task = None
+    
+    def __len__(self):
+        return len(self._pending)
+    
+    def edit(self, message, text, **kwargs):
+        """Schedule an edit; returns immediately."""
+        key = (message.chat_id, message.id)
+        if key in self._pending:
+            self.stats['coalesced'] += 1
+        elif self._last_text.get(key) == text:
+            self.stats['unchanged'] += 1
+            return
+        self._pending[key] = (message, text, kwargs)
+        self._wake.set()
+    
+    def _remember(self, key, text):
+        self._last_text[key] = text
+        self._last_text.move_to_end(key)
+        while len(self._last_text) > self.memory:
+            self._last_text.popitem(last=False)
+    
+    def _next_ready(self, now):
+        """Oldest pending edit whose chat is allowed another edit, or the time one will be."""
+        soonest = None
+        for key in self._pending:
+            allowed_at = self._chat_next.get(key[0], 0)
+            if allowed_at <= now:
+                return key, now
+            soonest = allowed_at if soonest is None else min(soonest, allowed_at)
+        return None, soonest
+    
+    async def _send(self, key):
+        message, text, kwargs = self._pending.pop(key)
+        if self._last_text.get(key) == text:
+            self.stats['unchanged'] += 1
+            return
+        try:
+            await message.edit(text, **kwargs)
+            self.stats['sent'] += 1
+            self._remember(key, text)
+        except errors.FloodWaitError as e:
+            self.stats['flood_waits'] += 1
+            self._paused_until = time.monotonic() + e.seconds
+            logger.warning(f"FloodWait on message edits, pausing for {e.seconds}s")
+            # Retry first, unless a newer text arrived while we were sending
+            if key not in self._pending:
+                self._pending[key] = (message, text, kwargs)
+                self._pending.move_to_end(key, last=False)
+        except errors.MessageNotModifiedError:
+            self.stats['unchanged'] += 1
+            self._remember(key, text)
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.warning(f"Message edit failed: {e}")
+        finally:
+            now = time.monotonic()
+            self._chat_next[key[0]] = now + self.chat_interval
+            self._global_next = now + self.global_interval
+            if len(self._chat_next) > self.memory:
+                self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            
+            now = time.monotonic()
+            delay = max(self._paused_until, self._global_next) - now
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            
+            key, ready_at = self._next_ready(now)
+            if key is None:
+                # Every pending chat is cooling down; wake early if a new chat gets an edit
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), ready_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            await self._send(key)
 
-# Store user sessions
-user_sessions = {}
+class RunWatch:
+    """A dispatched job whose progress message follows its workflow run"""
+    
+    __slots__ = ('job_key', 'message', 'speed', 'youtube_title', 'dispatched_at', 'run_id')
+    
+    def __init__(self, job_key, message, speed, youtube_title):
+        self.job_key = job_key
+        self.message = message
+        self.speed = speed
+        self.youtube_title = youtube_title
+        self.dispatched_at = time.time()
+        self.run_id = None
+
+class RunPoller:
+    """
+    Single background poller for the processing workflow's runs, shared by every
+    watcher and by /workflow_status. Requests carry the last ETag, so when nothing
+    changed GitHub answers 304, which does not count against the rate limit.
+    """
+    
+    def __init__(self, editor, interval=RUN_POLL_INTERVAL):
+        self.editor = editor
+        self.interval = interval
+        self.runs = []
+        self.fetched_at = 0.0
+        self.stats = Counter()
+        self._etags = {}
+        self._watches = []
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task = None
+    
+    def __len__(self):
+        return len(self._watches)
+    
+    @staticmethod
+    def job_key(run):
+        match = RUN_NAME_PATTERN.search(run.get('display_title') or run.get('name') or '')
+        return match.group(1) if match else None
+    
+    @staticmethod
+    def _created_at(run):
+        return datetime.strptime(run['created_at'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+    
+    async def _get(self, url, params=None):
+        """GET with If-None-Match; a 304 returns the body cached with that ETag."""
+        key = (url, tuple(sorted((params or {}).items())))
+        cached = self._etags.get(key)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+        response = await github_client.get(url, params=params, headers=headers)
+        if response.status == 304 and cached:
+            self.stats['not_modified'] += 1
+            return cached[1]
+        if response.status != 200:
+            self.stats['errors'] += 1
+            return None
+        self.stats['fetched'] += 1
+        etag = response.headers.get('ETag')
+        if etag:
+            self._etags[key] = (etag, response.data)
+        return response.data
+    
+    def _forget(self, url):
+        for key in [key for key in self._etags if key[0] == url]:
+            del self._etags[key]
+    
+    async def refresh(self, max_age=0):
+        """Latest page of runs, polling GitHub only if the copy is older than max_age seconds."""
+        async with self._lock:
+            if time.monotonic() - self.fetched_at >= max_age:
+                data = await self._get(github_client.repo_url(f"actions/workflows/{WORKFLOW_FILE}/runs"),
+                                       {'per_page': RUN_POLL_PAGE_SIZE})
+                if data is not None:
+                    self.runs = data.get('workflow_runs', [])
+                    self.fetched_at = time.monotonic()
+            return self.runs
+    
+    def active_count(self):
+        return sum(1 for run in self.runs if run['status'] in ACTIVE_RUN_STATUSES)
+    
+    def watch(self, job):
+        self._watches.append(RunWatch(job.job_key, job.message, job.speed, job.youtube_title))
+        self._wake.set()
+    
+    async def _find_run(self, watch, runs, claimed):
+        if watch.run_id is not None:
+            run = next((run for run in runs if run['id'] == watch.run_id), None)
+            return run or await self._get(github_client.repo_url(f"actions/runs/{watch.run_id}"))
+        # Oldest unclaimed run for this job created after the dispatch (allowing for clock skew)
+        candidates = [run for run in runs
+                      if run['id'] not in claimed and self.job_key(run) == watch.job_key
+                      and self._created_at(run) >= watch.dispatched_at - 60]
+        run = min(candidates, key=self._created_at, default=None)
+        if run:
+            watch.run_id = run['id']
+        return run
+    
+    @staticmethod
+    def render(watch, run, jobs):
+        if run['status'] == 'completed':
+            header = {
+                'success': "✅ **Done!** The processed parts are published.",
+                'cancelled': "⏹️ **Run cancelled.**",
+            }.get(run.get('conclusion'), f"❌ **Run {run.get('conclusion') or 'failed'}.**")
+        elif run['status'] == 'in_progress':
+            steps = ((jobs or {}).get('jobs') or [{}])[0].get('steps') or []
+            done = sum(1 for step in steps if step['status'] == 'completed')
+            current = next((step['name'] for step in steps if step['status'] == 'in_progress'), None)
+            header = f"⚙️ **Processing** ({done}/{len(steps)} steps)" if steps else "⚙️ **Processing**"
+            if current:
+                header += f"\nNow: {current}"
+        else:
+            header = "🕒 **Run queued on GitHub**"
+        
+        return (
+            f"{header}\n\n"
+            f"• Speed: {watch.speed}x\n"
+            f"• YouTube: {watch.youtube_title}\n"
+            f"• File Hash: `{watch.job_key}`\n"
+            f"🔗 [Run #{run['run_number']}]({run['html_url']})"
+        )
+    
+    async def poll(self):
+        runs = await self.refresh()
+        claimed = {watch.run_id for watch in self._watches if watch.run_id is not None}
+        now = time.time()
+        
+        for watch in list(self._watches):
+            run = await self._find_run(watch, runs, claimed)
+            if run is None:
+                if now - watch.dispatched_at > RUN_WATCH_TIMEOUT:
+                    self._watches.remove(watch)
+                continue
+            claimed.add(run['id'])
+            
+            jobs_url = github_client.repo_url(f"actions/runs/{run['id']}/jobs")
+            jobs = await self._get(jobs_url) if run['status'] == 'in_progress' else None
+            
+            self.editor.edit(watch.message, self.render(watch, run, jobs), link_preview=False)
+            
+            if run['status'] == 'completed':
+                self._watches.remove(watch)
+                self._forget(jobs_url)
+                self._forget(github_client.repo_url(f"actions/runs/{run['id']}"))
+    
+    def start(self):
+        if self._task is None and github_client.configured:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            if not self._watches:
+                self._wake.clear()
+                await self._wake.wait()
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Run poll error: {e}")
+            await asyncio.sleep(self.interval)
 
 class FileMetadataHandler:
     """Handles extraction and storage of Telegram file metadata"""
@@ -75,85 +1413,164 @@ class FileMetadataHandler:
             return None
     
     @staticmethod
-    def store_metadata_in_github(metadata, youtube_title):
-        """Store file metadata directly in GitHub repository"""
+    async def prepare_job_manifest(metadata, youtube_title, job_key):
+        """
+        Pack the job into a sealed manifest for the dispatch inputs. Only when it is
+        too large to inline is it committed as a file. Without JOB_MANIFEST_KEY
+        nothing is dispatched, since the workflow rejects unsigned manifests.
+        Returns (workflow inputs, error).
+        """
         try:
-            if not GITHUB_TOKEN or not GITHUB_REPO:
+            if not github_client.configured:
                 return None, "GitHub credentials not configured"
             
-            headers = {
-                'Authorization': f'token {GITHUB_TOKEN}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            
-            # Create unique file hash for this upload
-            unique_hash = hashlib.md5(
-                f"{metadata['file_id']}{metadata['access_hash']}{time.time()}".encode()
-            ).hexdigest()[:12]
-            
-            metadata_file_name = f"telegram_file_{unique_hash}.json"
-            
-            # Prepare metadata content
+            expires_at = int(time.time()) + job_manifest.DEFAULT_TTL
             metadata_content = {
                 'telegram_file': metadata,
+                'source_key': ResultCache.source_key(metadata),
                 'title': youtube_title,
                 'created_at': datetime.now().isoformat(),
-                'expires_at': int(time.time()) + 86400  # 24 hours expiry
+                'expires_at': expires_at
             }
             
-            content_json = json.dumps(metadata_content, indent=2)
-            content_b64 = base64.b64encode(content_json.encode()).decode()
-            
-            # Store in metadata directory
-            url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/telegram_metadata/{metadata_file_name}"
+            key = job_manifest.load_key()
+            if not key:
+                # The workflow only opens sealed manifests
+                return None, "JOB_MANIFEST_KEY not configured"
+            manifest = job_manifest.encode(metadata_content, key)
+            if len(manifest) <= job_manifest.MAX_INLINE_LENGTH:
+                return {'job_manifest': manifest}, None
             
+            # Fallback: commit it; the run checks out this commit, so no raw URL round trip
+            path = job_manifest.manifest_path(job_key, expires_at)
             data = {
-                'message': f'Telegram file metadata: {youtube_title}',
-                'content': content_b64,
+                'message': f'Job manifest: {youtube_title}',
+                'content': base64.b64encode(manifest.encode()).decode(),
                 'branch': 'main'
             }
+            response = await github_client.put(github_client.repo_url(f"contents/{path}"), json=data)
             
-            response = requests.put(url, headers=headers, json=data)
-            
-            if response.status_code in [200, 201]:
-                # Return the raw URL and file hash for workflow
-                raw_url = f"https://raw.githubusercontent.com/{GITHUB_REPO}/main/telegram_metadata/{metadata_file_name}"
-                return unique_hash, raw_url
+            if response.status in [200, 201]:
+                return {'metadata_url': path}, None
             else:
-                error_msg = f"Failed to store metadata: {response.status_code} - {response.text}"
+                error_msg = f"Failed to store metadata: {response.status} - {response.text}"
                 logger.error(error_msg)
                 return None, error_msg
                 
+        except GitHubRateLimitError:
+            # The queue keeps the job and retries once the limit resets
+            raise
         except Exception as e:
             error_msg = f"Error storing metadata: {str(e)}"
             logger.error(error_msg)
             return None, error_msg
 
+class MetadataCollector:
+    """Removes expired telegram_metadata entries in one commit per sweep"""
+    
+    def __init__(self, interval=METADATA_GC_INTERVAL, branch='main'):
+        self.interval = interval
+        self.branch = branch
+        self.removed = 0
+        self._task = None
+    
+    def start(self):
+        if self._task is None and github_client.configured:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def collect(self, now=None):
+        """Delete every expired entry through the Git Data API. Returns how many were removed."""
+        now = now or time.time()
+        
+        response = await github_client.get(github_client.repo_url(f"git/ref/heads/{self.branch}"))
+        if response.status != 200:
+            return 0
+        head = response.data['object']['sha']
+        response = await github_client.get(github_client.repo_url(f"git/commits/{head}"))
+        base_tree = response.data['tree']['sha']
+        
+        response = await github_client.get(github_client.repo_url(f"git/trees/{base_tree}"))
+        directory = next((entry for entry in response.data['tree']
+                          if entry['path'] == job_manifest.METADATA_DIR and entry['type'] == 'tree'), None)
+        if directory is None:
+            return 0
+        response = await github_client.get(github_client.repo_url(f"git/trees/{directory['sha']}"))
+        
+        expired = []
+        for entry in response.data['tree']:
+            expires_at = job_manifest.path_expiry(entry['path'])
+            if entry['type'] == 'blob' and expires_at is not None and expires_at <= now:
+                expired.append(entry['path'])
+        if not expired:
+            return 0
+        
+        # A null sha on top of the current tree deletes the path
+        response = await github_client.post(github_client.repo_url('git/trees'), json={
+            'base_tree': base_tree,
+            'tree': [{'path': f"{job_manifest.METADATA_DIR}/{name}", 'mode': '100644', 'type': 'blob', 'sha': None}
+                     for name in expired]
+        })
+        if response.status != 201:
+            raise RuntimeError(f"Could not build tree: {response.status} - {response.text}")
+        response = await github_client.post(github_client.repo_url('git/commits'), json={
+            'message': f'Remove {len(expired)} expired job manifests',
+            'tree': response.data['sha'],
+            'parents': [head]
+        })
+        if response.status != 201:
+            raise RuntimeError(f"Could not create commit: {response.status} - {response.text}")
+        # Not forced: if main moved meanwhile, the next sweep simply tries again
+        response = await github_client.patch(github_client.repo_url(f"git/refs/heads/{self.branch}"),
+                                             json={'sha': response.data['sha']})
+        if response.status != 200:
+            logger.warning(f"Manifest cleanup lost a race with another push: {response.status}")
+            return 0
+        
+        self.removed += len(expired)
+        return len(expired)
+    
+    async def _run(self):
+        while True:
+            try:
+                removed = await self.collect()
+                if removed:
+                    logger.info(f"Removed {removed} expired job manifests")
+            except Exception as e:
+                logger.error(f"Manifest cleanup error: {e}")
+            await asyncio.sleep(self.interval)
+
 class GitHubWorkflowHandler:
     """Handler for triggering GitHub workflows with Telegram metadata"""
     
     @staticmethod
-    async def trigger_telegram_workflow(file_hash, metadata_url, playback_speed, 
-                                       split_timestamps, release_name, video_title):
-        """Trigger GitHub workflow with Telegram metadata reference"""
+    async def trigger_telegram_workflow(file_hash, manifest_inputs, playback_speed, 
+                                       split_timestamps, release_name, video_title, job_mode='full',
+                                       processing_mode='full'):
+        """Trigger GitHub workflow with the job manifest (or the path it was committed to)"""
         try:
-            headers = {
-                'Authorization': f'token {GITHUB_TOKEN}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            
             # Encode metadata for workflow input
             workflow_inputs = {
                 'file_hash': file_hash,
-                'metadata_url': metadata_url,
+                **manifest_inputs,
                 'playback_speed': str(playback_speed),
                 'split_timestamps': split_timestamps or '',
                 'release_name': release_name,
-                'video_title': video_title
+                'video_title': video_title,
+                'job_mode': job_mode,
+                'processing_mode': processing_mode
             }
             
             # Trigger the NEW workflow that handles Telegram downloads
-            url = f'https://api.github.com/repos/{GITHUB_REPO}/actions/workflows/telegram_download_processor.yml/dispatches'
+            url = github_client.repo_url('actions/workflows/telegram_download_processor.yml/dispatches')
             
             data = {
                 'ref': 'main',
@@ -163,13 +1580,15 @@ class GitHubWorkflowHandler:
             logger.info(f"Triggering workflow with URL: {url}")
             logger.info(f"Workflow inputs: {workflow_inputs}")
             
-            response = requests.post(url, headers=headers, json=data)
+            response = await github_client.post(url, json=data)
             
-            if response.status_code == 204:
+            if response.status == 204:
                 return True, "✅ Workflow triggered successfully! The file will be downloaded directly from Telegram."
             else:
-                return False, f"❌ Failed to trigger workflow: {response.status_code} - {response.text}"
+                return False, f"❌ Failed to trigger workflow: {response.status} - {response.text}"
                 
+        except GitHubRateLimitError:
+            raise
         except Exception as e:
             logger.error(f"Workflow trigger error: {str(e)}")
             return False, str(e)
@@ -206,7 +1625,12 @@ class YouTubeAuthHandler:
                 'redirect_uri': 'urn:ietf:wg:oauth:2.0:oob'
             }
             
+            import requests
+            
+            started = time.perf_counter()
             response = requests.post(token_url, data=data)
+            metrics.observe('google_request_seconds', time.perf_counter() - started,
+                            (('endpoint', 'oauth2/token'), ('status', str(response.status_code))))
             response_data = response.json()
             
             if 'refresh_token' in response_data:
@@ -218,58 +1642,128 @@ class YouTubeAuthHandler:
             logger.error(f"Token exchange error: {str(e)}")
             return False, str(e)
 
+SystemSample = namedtuple('SystemSample', [
+    'timestamp', 'cpu_percent', 'ram_total', 'ram_used', 'ram_available', 'ram_percent',
+    'disk_total', 'disk_used', 'disk_free', 'disk_percent', 'bytes_sent', 'bytes_recv', 'load_avg'
+])
+
 class SystemMonitor:
+    """Samples system load in the background so /specs and /status read cached values"""
+    
+    def __init__(self, interval=SYSTEM_SAMPLE_INTERVAL, history=SYSTEM_SAMPLE_HISTORY):
+        self.interval = interval
+        self.samples = deque(maxlen=history)
+        self.cpu_count = psutil.cpu_count()
+        self.boot_time = datetime.fromtimestamp(psutil.boot_time()).strftime("%Y-%m-%d %H:%M:%S")
+        self._task = None
+    
+    def start(self):
+        """Start the sampler task on the running loop."""
+        if self._task is None:
+            # Prime the counter so the first non-blocking reading is meaningful
+            psutil.cpu_percent(interval=None)
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
     @staticmethod
-    def get_system_specs():
+    def _collect():
+        """Take one sample. Every call here is non-blocking."""
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        net_io = psutil.net_io_counters()
+        return SystemSample(
+            timestamp=time.monotonic(),
+            cpu_percent=psutil.cpu_percent(interval=None),
+            ram_total=memory.total,
+            ram_used=memory.used,
+            ram_available=memory.available,
+            ram_percent=memory.percent,
+            disk_total=disk.total,
+            disk_used=disk.used,
+            disk_free=disk.free,
+            disk_percent=disk.percent,
+            bytes_sent=net_io.bytes_sent,
+            bytes_recv=net_io.bytes_recv,
+            load_avg=psutil.getloadavg()
+        )
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                sample = await loop.run_in_executor(None, self._collect)
+                self.samples.append(sample)
+            except Exception as e:
+                logger.error(f"System sampler error: {str(e)}")
+            await asyncio.sleep(self.interval)
+    
+    def snapshot(self):
+        """Latest sample plus averages and rates over the buffered window, or None before the first sample."""
+        if not self.samples:
+            return None
+        
+        window = list(self.samples)
+        first, last = window[0], window[-1]
+        elapsed = last.timestamp - first.timestamp
+        
+        if elapsed > 0:
+            sent_rate = (last.bytes_sent - first.bytes_sent) / elapsed
+            recv_rate = (last.bytes_recv - first.bytes_recv) / elapsed
+        else:
+            sent_rate = recv_rate = 0.0
+        
+        return {
+            'latest': last,
+            'window_seconds': elapsed,
+            'cpu_avg': sum(s.cpu_percent for s in window) / len(window),
+            'ram_avg': sum(s.ram_percent for s in window) / len(window),
+            'net_sent_rate': sent_rate,
+            'net_recv_rate': recv_rate
+        }
+    
+    def get_system_specs(self):
         """Get system specifications."""
         try:
-            # CPU Info
-            cpu_count = psutil.cpu_count()
-            cpu_percent = psutil.cpu_percent(interval=1)
-            
-            # Memory Info
-            memory = psutil.virtual_memory()
-            total_ram_gb = memory.total / (1024**3)
-            used_ram_gb = memory.used / (1024**3)
-            free_ram_gb = memory.available / (1024**3)
-            ram_percent = memory.percent
-            
-            # Disk Info
-            disk = psutil.disk_usage('/')
-            total_disk_gb = disk.total / (1024**3)
-            used_disk_gb = disk.used / (1024**3)
-            free_disk_gb = disk.free / (1024**3)
-            disk_percent = disk.percent
-            
-            # System Info
-            boot_time = datetime.fromtimestamp(psutil.boot_time()).strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Network Info
-            net_io = psutil.net_io_counters()
+            snapshot = self.snapshot()
+            if snapshot is None:
+                return "⏳ System sampler is still collecting data, try again in a few seconds."
+            
+            latest = snapshot['latest']
+            load_1, load_5, load_15 = latest.load_avg
+            window = f"{snapshot['window_seconds']:.0f}s avg"
             
             specs = f"""
 **🖥️ SYSTEM SPECIFICATIONS**
 
 **💻 CPU:**
-• Cores: {cpu_count}
-• Usage: {cpu_percent}%
+• Cores: {self.cpu_count}
+• Usage: {latest.cpu_percent:.1f}% ({snapshot['cpu_avg']:.1f}% {window})
+• Load: {load_1:.2f} / {load_5:.2f} / {load_15:.2f}
 
 **🧠 RAM:**
-• Total: {total_ram_gb:.2f} GB
-• Used: {used_ram_gb:.2f} GB ({ram_percent}%)
-• Free: {free_ram_gb:.2f} GB
+• Total: {latest.ram_total / (1024**3):.2f} GB
+• Used: {latest.ram_used / (1024**3):.2f} GB ({latest.ram_percent}%, {snapshot['ram_avg']:.1f}% {window})
+• Free: {latest.ram_available / (1024**3):.2f} GB
 
 **💾 DISK:**
-• Total: {total_disk_gb:.2f} GB
-• Used: {used_disk_gb:.2f} GB ({disk_percent}%)
-• Free: {free_disk_gb:.2f} GB
+• Total: {latest.disk_total / (1024**3):.2f} GB
+• Used: {latest.disk_used / (1024**3):.2f} GB ({latest.disk_percent}%)
+• Free: {latest.disk_free / (1024**3):.2f} GB
 
-**🌐 NETWORK:**
-• Sent: {net_io.bytes_sent / (1024**2):.2f} MB
-• Received: {net_io.bytes_recv / (1024**2):.2f} MB
+**🌐 NETWORK ({window}):**
+• Upload: {snapshot['net_sent_rate'] / (1024**2):.2f} MB/s
+• Download: {snapshot['net_recv_rate'] / (1024**2):.2f} MB/s
 
 **📊 SYSTEM:**
-• Boot Time: {boot_time}
+• Boot Time: {self.boot_time}
 • Max File Size: {MAX_FILE_SIZE/(1024**3):.1f} GB
 
 **⚙️ BOT INFO:**
@@ -291,6 +1785,50 @@ class TelegramVideoBot:
             API_HASH
         )
         self.me = None
+        self.monitor = SystemMonitor()
+        self.sessions = SessionStore()
+        self.manifest_gc = MetadataCollector()
+        self.editor = MessageEditor()
+        self.runs = RunPoller(self.editor)
+        self.jobs = JobQueue(self.dispatch_job, self.runs, notify=self.notify_queue_position)
+        self.router = MessageRouter(self.sessions)
+        self.local = LocalLane(self.client, self.monitor, self.editor, fallback=self.jobs.put)
+        self.register_metrics()
+    
+    def register_metrics(self):
+        """Gauges read from the bot's own structures when /metrics is scraped"""
+        metrics.gauge('bot_sessions', 'Open conversations by step',
+                      lambda: {(('step', step),): count for step, count in self.sessions.step_counts().items()})
+        metrics.gauge('bot_session_evictions_total', 'Sessions dropped by reason',
+                      lambda: {(('reason', reason),): count for reason, count in self.sessions.evictions.items()},
+                      kind='counter')
+        metrics.gauge('bot_queued_jobs', 'Jobs waiting for a workflow slot', lambda: {(): len(self.jobs)})
+        metrics.gauge('bot_local_jobs', 'Jobs in the local lane by state',
+                      lambda: {(('state', 'queued'),): len(self.local), (('state', 'running'),): self.local.running})
+        metrics.gauge('bot_local_jobs_total', 'Local lane jobs by outcome',
+                      lambda: {(('outcome', outcome),): count for outcome, count in self.local.stats.items()},
+                      kind='counter')
+        metrics.gauge('bot_inflight_runs', 'Dispatched runs not finished yet', lambda: {(): self.jobs.inflight})
+        metrics.gauge('bot_watched_runs', 'Runs the poller is following', lambda: {(): len(self.runs)})
+        metrics.gauge('bot_message_edits_total', 'Message edits by outcome',
+                      lambda: {(('outcome', outcome),): count for outcome, count in self.editor.stats.items()},
+                      kind='counter')
+        metrics.gauge('bot_routed_messages_total', 'Incoming messages by route',
+                      lambda: {(('route', route),): count for route, count in self.router.stats.items()},
+                      kind='counter')
+        metrics.gauge('bot_pending_edits', 'Edits waiting to be sent', lambda: {(): len(self.editor)})
+        metrics.gauge('bot_result_cache_total', 'Result cache lookups by outcome',
+                      lambda: {(('outcome', outcome),): count for outcome, count in result_cache.stats.items()},
+                      kind='counter')
+        metrics.gauge('github_rate_limit_remaining', 'GitHub API calls left in the window',
+                      lambda: {(): github_client.rate_limit_remaining}
+                      if github_client.rate_limit_remaining is not None else {})
+        metrics.gauge('bot_startup_phase_seconds', 'Time spent in each startup phase',
+                      lambda: {(('phase', name),): round(seconds, 6) for name, seconds in startup.phases.items()})
+        metrics.gauge('bot_ready', 'Whether the bot is logged in with handlers registered',
+                      lambda: {(): int(startup.ready)})
+        metrics.gauge('bot_event_loop_lag_last_seconds', 'Latest event-loop lag probe',
+                      lambda: {(): round(metrics.last_lag, 6)})
     
     async def start(self):
         """Start the Telegram bot."""
@@ -300,22 +1838,37 @@ class TelegramVideoBot:
         print(f"🌐 Web server port: {PORT}")
         print("="*60)
         
-        await self.client.start()
-        self.me = await self.client.get_me()
+        self.monitor.start()
+        metrics.start()
+        self.sessions.start()
+        self.manifest_gc.start()
+        self.jobs.start()
+        self.local.start()
+        self.runs.start()
+        self.editor.start()
+        with startup.phase('login'):
+            await self.client.start()
+            self.me = await self.client.get_me()
         
         # Setup handlers
-        await self.setup_handlers()
+        with startup.phase('handlers'):
+            await self.setup_handlers()
         
+        startup.ready = True
         print(f"✅ Logged in as: @{self.me.username}")
         print("✅ Bot is ready! Send videos up to 2GB")
         print("="*60)
+        startup.report()
         
-        await self.client.run_until_disconnected()
+        try:
+            await self.client.run_until_disconnected()
+        finally:
+            startup.ready = False
     
     async def setup_handlers(self):
-        """Setup all event handlers."""
+        """Register the router as the only NewMessage handler, plus the button callback handler."""
         
-        @self.client.on(events.NewMessage(pattern='/start'))
+        @metrics.timed
         async def start_handler(event):
             """Handle /start command."""
             if not self.me:
@@ -346,7 +1899,7 @@ class TelegramVideoBot:
             """
             await event.reply(welcome)
         
-        @self.client.on(events.NewMessage(pattern='/help'))
+        @metrics.timed
         async def help_handler(event):
             """Handle /help command."""
             help_text = """
@@ -370,20 +1923,29 @@ class TelegramVideoBot:
 **Split Format:** 01:30:00,02:45:00,03:15:00
 
 **Speed Options:**
-0.5x, 0.75x, 1.25x, 1.3x, 1.4x, 1.5x, 2.0x, 3.0x
+0.5x, 0.75x, 1.0x, 1.25x, 1.3x, 1.4x, 1.5x, 2.0x, 3.0x
+
+**Fast Mode:**
+Toggle it at the speed step to keep the video frames and only change their timing.
+Much quicker on long videos; cuts land on keyframes, and videos whose frame rate
+would go out of range are fully encoded instead.
+
+**Small Videos:**
+Videos up to {max_mb}MB and {max_minutes} minutes are processed right here when the
+bot has room, and the parts are sent back to this chat instead of YouTube and GitHub.
 
 **YouTube Auth:**
 Use /auth_youtube to setup automatic uploads
-            """
+            """.format(max_mb=LOCAL_MAX_SIZE_MB, max_minutes=LOCAL_MAX_DURATION // 60)
             await event.reply(help_text)
         
-        @self.client.on(events.NewMessage(pattern='/specs'))
+        @metrics.timed
         async def specs_handler(event):
             """Handle /specs command."""
-            specs = SystemMonitor.get_system_specs()
+            specs = self.monitor.get_system_specs()
             await event.reply(specs)
         
-        @self.client.on(events.NewMessage(pattern='/auth_youtube'))
+        @metrics.timed
         async def auth_youtube_handler(event):
             """Handle YouTube authentication."""
             user_id = event.sender_id
@@ -408,34 +1970,28 @@ Use /auth_youtube to setup automatic uploads
                 )
                 
                 # Store that user is waiting for auth code
-                if user_id not in user_sessions:
-                    user_sessions[user_id] = {}
-                user_sessions[user_id]['waiting_for_auth'] = True
-                user_sessions[user_id]['auth_message_id'] = message.id
+                session = self.sessions.get(user_id)
+                if session is None:
+                    session = self.sessions.create(user_id, chat_id=event.chat_id)
+                session.waiting_for_auth = True
+                session.auth_message_id = message.id
                 
             except Exception as e:
                 await event.reply(f"❌ Error setting up auth: {str(e)[:200]}")
         
-        @self.client.on(events.NewMessage(pattern='/workflow_status'))
+        @metrics.timed
         async def workflow_status_handler(event):
             """Check GitHub workflow status."""
             try:
-                if not GITHUB_TOKEN or not GITHUB_REPO:
+                if not github_client.configured:
                     await event.reply("❌ GitHub credentials not configured!")
                     return
                 
-                headers = {
-                    'Authorization': f'token {GITHUB_TOKEN}',
-                    'Accept': 'application/vnd.github.v3+json'
-                }
-                
-                url = f'https://api.github.com/repos/{GITHUB_REPO}/actions/runs'
-                response = requests.get(url, headers=headers)
+                # Served from the shared poller; at most one conditional request per interval
+                runs = (await self.runs.refresh(max_age=RUN_POLL_INTERVAL))[:5]
                 
-                if response.status_code == 200:
-                    runs = response.json()['workflow_runs'][:5]  # Last 5 runs
-                    
-                    status_text = "**Recent Workflow Runs:**\n\n"
+                if runs:
+                    status_text = "**Recent Processing Runs:**\n\n"
                     for run in runs:
                         status_emoji = {
                             'completed': '✅',
@@ -454,40 +2010,61 @@ Use /auth_youtube to setup automatic uploads
                             'neutral': '⚪'
                         }.get(run.get('conclusion'), '❓')
                         
+                        job_key = RunPoller.job_key(run)
                         status_text += (
                             f"{status_emoji} **Run #{run['run_number']}**\n"
                             f"Status: {run['status']} {conclusion_emoji}\n"
-                            f"Created: {run['created_at'][:19].replace('T', ' ')}\n"
-                            f"Branch: {run['head_branch']}\n\n"
+                            f"File Hash: `{job_key or 'n/a'}`\n"
+                            f"Created: {run['created_at'][:19].replace('T', ' ')}\n\n"
                         )
                     
                     await event.reply(status_text)
+                elif self.runs.fetched_at:
+                    await event.reply("ℹ️ No processing runs yet.")
                 else:
-                    await event.reply(f"❌ Failed to fetch workflow status: {response.text}")
+                    await event.reply("❌ Failed to fetch workflow status")
                     
             except Exception as e:
                 await event.reply(f"❌ Error: {str(e)[:200]}")
         
-        @self.client.on(events.NewMessage(pattern='/status'))
+        @metrics.timed
         async def status_handler(event):
             """Handle /status command."""
-            import psutil
+            snapshot = self.monitor.snapshot()
+            
+            if snapshot:
+                latest = snapshot['latest']
+                system = (
+                    f"• CPU Usage: {latest.cpu_percent:.1f}% ({snapshot['cpu_avg']:.1f}% avg)\n"
+                    f"• RAM Usage: {latest.ram_percent}%\n"
+                    f"• Disk Usage: {latest.disk_percent}%\n"
+                    f"• Network: ↑{snapshot['net_sent_rate'] / (1024**2):.2f} MB/s "
+                    f"↓{snapshot['net_recv_rate'] / (1024**2):.2f} MB/s"
+                )
+                free_disk = f"{latest.disk_free/(1024**3):.1f}GB"
+            else:
+                system = "• Collecting samples..."
+                free_disk = "n/a"
             
-            disk = psutil.disk_usage('/')
-            memory = psutil.virtual_memory()
+            steps = self.sessions.step_counts()
+            step_summary = ', '.join(f"{step}: {count}" for step, count in steps.items()) or 'none'
             
             status = f"""
 **🤖 BOT STATUS**
 
 **👤 Account:** @{self.me.username if self.me else 'Loading...'}
-**🔄 Active sessions:** {len(user_sessions)}
-**💾 Free disk:** {disk.free/(1024**3):.1f}GB
+**🔄 Active sessions:** {len(self.sessions)} ({step_summary})
+**🧹 Evicted sessions:** {self.sessions.evictions['expired']} expired, {self.sessions.evictions['lru']} over limit
+**📬 Job queue:** {len(self.jobs)} waiting, {self.jobs.stats['dispatched']} dispatched, {self.jobs.inflight} runs active (max {self.jobs.max_inflight})
+**🏠 Local lane:** {len(self.local)} waiting, {self.local.running} running (max {self.local.workers}), {self.local.stats['completed']} done, {self.local.stats['failed']} handed to the workflow
+**✏️ Message edits:** {self.editor.stats['sent']} sent, {self.editor.stats['coalesced']} coalesced, {self.editor.stats['unchanged']} unchanged, {self.editor.stats['flood_waits']} flood waits
+**📡 Run poller:** {len(self.runs)} watched, {self.runs.stats['fetched']} fetched, {self.runs.stats['not_modified']} not modified
+**🗃️ Result cache:** {len(result_cache)} entries, {result_cache.stats['hits']} hits, {result_cache.stats['misses']} misses
+**💾 Free disk:** {free_disk}
 **📁 Max file size:** {MAX_FILE_SIZE/(1024**3):.1f}GB
 
 **⚙️ SYSTEM:**
-• CPU Usage: {psutil.cpu_percent()}%
-• RAM Usage: {memory.percent}%
-• Disk Usage: {disk.percent}%
+{system}
 
 **🔧 CONFIGURATION:**
 • GitHub Repo: {GITHUB_REPO or 'Not set'}
@@ -497,12 +2074,7 @@ Use /auth_youtube to setup automatic uploads
             """
             await event.reply(status)
         
-        @self.client.on(events.NewMessage(
-            func=lambda e: e.video or (
-                e.document and e.document.mime_type and 
-                'video' in str(e.document.mime_type).lower()
-            )
-        ))
+        @metrics.timed
         async def video_handler(event):
             """Handle incoming videos - EXTRACT METADATA IMMEDIATELY"""
             user_id = event.sender_id
@@ -538,21 +2110,33 @@ Use /auth_youtube to setup automatic uploads
                     'file_name': file_name,
                     'original_message_id': event.message.id,
                     'chat_id': event.chat_id,
+                    # Seconds, from the video attribute; None for documents without one
+                    'duration': event.file.duration,
                     'extracted_at': int(time.time())
                 }
                 
+                # Mid-conversation: keep the video until the current one is submitted
+                session = self.sessions.get(user_id)
+                if session is not None and session.step is not None:
+                    if len(session.pending) >= MAX_PENDING_PER_USER:
+                        await event.reply(f"❌ **Too many videos waiting!** Finish the current one first "
+                                          f"(max {MAX_PENDING_PER_USER} waiting).")
+                        return
+                    session.pending.append((file_metadata, media.size))
+                    await event.reply(
+                        f"📥 **Video saved!** ({len(session.pending)} waiting)\n"
+                        f"I'll ask about it once you finish setting up the current one."
+                    )
+                    return
+                
                 # Store session with METADATA (not the message object)
-                user_sessions[user_id] = {
-                    'file_metadata': file_metadata,  # Store extracted metadata
-                    'file_size': media.size,
-                    'chat_id': event.chat_id,
-                    'timestamp': datetime.now(),
-                    'step': 'speed',
-                    'speed': None,
-                    'split_timestamps': None,
-                    'youtube_title': None,
-                    'github_title': None
-                }
+                self.sessions.create(
+                    user_id,
+                    chat_id=event.chat_id,
+                    step='speed',
+                    file_metadata=file_metadata,  # Store extracted metadata
+                    file_size=media.size
+                )
                 
                 # Send speed selection buttons
                 file_size_mb = media.size / (1024*1024)
@@ -560,98 +2144,108 @@ Use /auth_youtube to setup automatic uploads
                     f"✅ **Video received!**\n"
                     f"Size: {file_size_mb:.1f}MB\n"
                     f"**Step 1/4: Choose playback speed:**",
-                    buttons=SPEED_OPTIONS
+                    buttons=speed_buttons()
                 )
                 
             except Exception as e:
                 logger.error(f"Video handler error: {str(e)}")
                 await event.reply(f"❌ Error: {str(e)[:200]}")
         
-        @self.client.on(events.NewMessage)
-        async def text_handler(event):
-            """Handle text messages for workflow inputs."""
-            user_id = event.sender_id
-            text = event.text.strip()
+        @metrics.timed
+        async def auth_code_handler(event, session, text):
+            """Exchange the YouTube authorization code the user pasted."""
+            try:
+                success, result = YouTubeAuthHandler.exchange_code_for_token(text)
+                
+                if success:
+                    # Update GitHub secret
+                    if GitHubWorkflowHandler.update_youtube_token(result):
+                        await event.reply("✅ **YouTube token updated successfully!**\n"
+                                        "Your videos will now upload to YouTube automatically.")
+                    else:
+                        await event.reply("✅ **Token received but failed to update GitHub.**\n"
+                                        "Manual update required.")
+                else:
+                    await event.reply(f"❌ **Token exchange failed:**\n{result}")
+                
+                session.waiting_for_auth = False
+            except Exception as e:
+                logger.error(f"Auth code handler error: {str(e)}")
+                await event.reply(f"❌ Error: {str(e)[:200]}")
+        
+        @metrics.timed
+        async def split_handler(event, session, text):
+            """Step 2: split timestamps, empty for none."""
+            if text == '':
+                session.split_timestamps = ''
+                session.step = 'youtube_title'
+                await event.reply(
+                    "✅ **No splits selected!**\n"
+                    "**Step 3/4: Enter YouTube video title:**"
+                )
+            elif valid_timestamps(text):
+                session.split_timestamps = text
+                session.step = 'youtube_title'
+                await event.reply(
+                    "✅ **Split timestamps saved!**\n"
+                    "**Step 3/4: Enter YouTube video title:**"
+                )
+            else:
+                await event.reply(
+                    "❌ **Invalid format!**\n"
+                    "Please enter timestamps in HH:MM:SS format separated by commas.\n"
+                    "Example: 01:30:00,02:45:00,03:15:00\n"
+                    "Or press Enter for no splits\n"
+                    "Enter split timestamps again:"
+                )
+        
+        @metrics.timed
+        async def youtube_title_handler(event, session, text):
+            """Step 3: YouTube title."""
+            if len(text) < 5:
+                await event.reply("❌ **Title too short!** Please enter a valid YouTube title (min 5 characters):")
+                return
             
-            if user_id not in user_sessions:
+            session.youtube_title = text
+            session.step = 'github_title'
+            await event.reply(
+                "✅ **YouTube title saved!**\n"
+                "**Step 4/4: Enter GitHub release title:**"
+            )
+        
+        @metrics.timed
+        async def github_title_handler(event, session, text):
+            """Step 4: GitHub release title, then the job is submitted."""
+            if len(text) < 3:
+                await event.reply("❌ **Title too short!** Please enter a valid GitHub release title (min 3 characters):")
                 return
             
-            session = user_sessions[user_id]
+            session.github_title = text
             
+            # All data collected, start processing
+            await self.start_workflow_processing(event.sender_id, event)
+        
+        # speed -> split -> youtube_title -> github_title; the speed step only takes buttons
+        self.router.video = video_handler
+        self.router.auth = auth_code_handler
+        for name, handler in (('/start', start_handler), ('/help', help_handler), ('/specs', specs_handler),
+                              ('/auth_youtube', auth_youtube_handler), ('/workflow_status', workflow_status_handler),
+                              ('/status', status_handler)):
+            self.router.command(name, handler)
+        self.router.state('split', split_handler)
+        self.router.state('youtube_title', youtube_title_handler)
+        self.router.state('github_title', github_title_handler)
+        
+        @self.client.on(events.NewMessage)
+        async def router_handler(event):
             try:
-                # Handle YouTube auth code
-                if session.get('waiting_for_auth') and len(text) > 20 and ' ' not in text:
-                    success, result = YouTubeAuthHandler.exchange_code_for_token(text)
-                    
-                    if success:
-                        # Update GitHub secret
-                        if GitHubWorkflowHandler.update_youtube_token(result):
-                            await event.reply("✅ **YouTube token updated successfully!**\n"
-                                            "Your videos will now upload to YouTube automatically.")
-                        else:
-                            await event.reply("✅ **Token received but failed to update GitHub.**\n"
-                                            "Manual update required.")
-                    else:
-                        await event.reply(f"❌ **Token exchange failed:**\n{result}")
-                    
-                    session['waiting_for_auth'] = False
-                    return
-                
-                # Handle split timestamps
-                if session.get('step') == 'split':
-                    # Allow empty string for no splits
-                    if text == '':
-                        session['split_timestamps'] = ''
-                        session['step'] = 'youtube_title'
-                        await event.reply(
-                            "✅ **No splits selected!**\n"
-                            "**Step 3/4: Enter YouTube video title:**"
-                        )
-                    elif self.validate_timestamps(text):
-                        session['split_timestamps'] = text
-                        session['step'] = 'youtube_title'
-                        await event.reply(
-                            "✅ **Split timestamps saved!**\n"
-                            "**Step 3/4: Enter YouTube video title:**"
-                        )
-                    else:
-                        await event.reply(
-                            "❌ **Invalid format!**\n"
-                            "Please enter timestamps in HH:MM:SS format separated by commas.\n"
-                            "Example: 01:30:00,02:45:00,03:15:00\n"
-                            "Or press Enter for no splits\n"
-                            "Enter split timestamps again:"
-                        )
-                
-                # Handle YouTube title
-                elif session.get('step') == 'youtube_title':
-                    if len(text) < 5:
-                        await event.reply("❌ **Title too short!** Please enter a valid YouTube title (min 5 characters):")
-                        return
-                    
-                    session['youtube_title'] = text
-                    session['step'] = 'github_title'
-                    await event.reply(
-                        "✅ **YouTube title saved!**\n"
-                        "**Step 4/4: Enter GitHub release title:**"
-                    )
-                
-                # Handle GitHub title
-                elif session.get('step') == 'github_title':
-                    if len(text) < 3:
-                        await event.reply("❌ **Title too short!** Please enter a valid GitHub release title (min 3 characters):")
-                        return
-                    
-                    session['github_title'] = text
-                    
-                    # All data collected, start processing
-                    await self.start_workflow_processing(user_id, event)
-                    
+                await self.router.dispatch(event)
             except Exception as e:
-                logger.error(f"Text handler error: {str(e)}")
+                logger.error(f"Message handler error: {str(e)}")
                 await event.reply(f"❌ Error: {str(e)[:200]}")
         
         @self.client.on(events.CallbackQuery())
+        @metrics.timed
         async def callback_handler(event):
             """Handle button callbacks."""
             user_id = event.sender_id
@@ -663,19 +2257,32 @@ Use /auth_youtube to setup automatic uploads
                     self.cleanup_user_session(user_id)
                     return
                 
+                elif data == "mode_toggle":
+                    session = self.sessions.get(user_id)
+                    if session is None or session.step != 'speed':
+                        await event.edit("❌ **Session expired!** Send video again.")
+                        return
+                    
+                    session.processing_mode = 'full' if session.processing_mode == 'fast' else 'fast'
+                    await event.edit(
+                        f"**Step 1/4: Choose playback speed:**\n"
+                        f"{PROCESSING_MODE_NOTES[session.processing_mode]}",
+                        buttons=speed_buttons(session.processing_mode)
+                    )
+                
                 elif data.startswith("speed_"):
                     speed = float(data.split("_")[1])
                     
-                    if user_id not in user_sessions:
+                    session = self.sessions.get(user_id)
+                    if session is None:
                         await event.edit("❌ **Session expired!** Send video again.")
                         return
                     
-                    session = user_sessions[user_id]
-                    session['speed'] = speed
-                    session['step'] = 'split'
+                    session.speed = speed
+                    session.step = 'split'
                     
                     await event.edit(
-                        f"✅ **Speed selected:** {speed}x\n"
+                        f"✅ **Speed selected:** {speed}x ({session.processing_mode} mode)\n"
                         f"**Step 2/4: Enter split timestamps (HH:MM:SS,HH:MM:SS)**\n"
                         f"Example: 01:00:00,02:00:00\n"
                         f"Or press Enter for no splits:"
@@ -689,101 +2296,295 @@ Use /auth_youtube to setup automatic uploads
                     pass
                 self.cleanup_user_session(user_id)
     
-    def validate_timestamps(self, timestamps):
-        """Validate HH:MM:SS format."""
-        if not timestamps:
-            return True
-        
-        pattern = r'^(\d{1,2}:\d{2}:\d{2})(,\d{1,2}:\d{2}:\d{2})*$'
-        if re.match(pattern, timestamps):
-            # Validate each timestamp
-            parts = timestamps.split(',')
-            for part in parts:
-                h, m, s = map(int, part.split(':'))
-                if h > 23 or m > 59 or s > 59:
-                    return False
-            return True
-        return False
-    
     async def start_workflow_processing(self, user_id, event):
-        """Start workflow processing USING ALREADY-EXTRACTED METADATA"""
+        """Check the result cache and queue the finished conversation as a job"""
+        progress_msg = None
         try:
-            session = user_sessions[user_id]
+            session = self.sessions.get(user_id)
             
             # Create progress message
             progress_msg = await event.reply("🔍 **Preparing workflow...**")
             
-            # Step 1: Use ALREADY EXTRACTED metadata
-            await progress_msg.edit("📋 **Using extracted file metadata...**")
-            
-            if 'file_metadata' not in session:
-                await progress_msg.edit("❌ **No file metadata found! Please send the video again.**")
+            if session is None or not session.file_metadata:
+                self.editor.edit(progress_msg, "❌ **No file metadata found! Please send the video again.**")
                 self.cleanup_user_session(user_id)
                 return
             
-            metadata = session['file_metadata']
+            metadata = session.file_metadata
             
-            # Step 2: Store metadata in GitHub
-            await progress_msg.edit("💾 **Storing metadata in GitHub...**")
+            # Look for an earlier run of the same video with the same settings
+            self.editor.edit(progress_msg, "🗃️ **Checking result cache...**")
             
-            file_hash, metadata_url = FileMetadataHandler.store_metadata_in_github(
-                metadata, session['youtube_title']
-            )
+            source_key = ResultCache.source_key(metadata)
+            job_key = ResultCache.job_key(source_key, session.speed, session.split_timestamps,
+                                          session.processing_mode)
+            cached = await result_cache.lookup(job_key)
             
-            if not file_hash:
-                await progress_msg.edit(f"❌ **Failed to store metadata:**\n{metadata_url}")
-                self.cleanup_user_session(user_id)
-                return
+            job_mode = 'full'
+            # Skipped means the runner has no YouTube credentials, so a new title changes nothing
+            if cached and (cached.youtube == 'skipped' or cached.video_title == session.youtube_title):
+                # Nothing to publish; at most the release needs its new name
+                if cached.release_name != session.github_title:
+                    cached = await result_cache.retitle(cached, session.github_title)
+                if cached:
+                    self.editor.edit(progress_msg, 
+                        f"♻️ **Already processed!**\n\n"
+                        f"• Speed: {session.speed}x\n"
+                        f"• Parts: {cached.parts}\n"
+                        f"• GitHub Release: [{cached.release_name}]({cached.release_url})\n\n"
+                        f"🗃️ **Cache:** result hit, nothing to re-run"
+                    )
+                    self.cleanup_user_session(user_id)
+                    return
             
-            # Step 3: Trigger workflow with metadata
-            await progress_msg.edit("🚀 **Triggering GitHub workflow...**")
+            if cached:
+                # Same parts, new YouTube title: republish without downloading or encoding.
+                # The publish run renames the release itself, so a failed dispatch leaves it as it was
+                job_mode = 'publish'
+                cache_summary = "result hit (republishing stored parts)"
+            else:
+                source_hit = await result_cache.source_cached(source_key)
+                cache_summary = f"result miss, source {'hit' if source_hit else 'miss'}"
             
-            success, message = await GitHubWorkflowHandler.trigger_telegram_workflow(
-                file_hash=file_hash,
-                metadata_url=metadata_url,
-                playback_speed=session['speed'],
-                split_timestamps=session.get('split_timestamps', ''),
-                release_name=session['github_title'],
-                video_title=session['youtube_title']
+            job = QueuedJob(
+                user_id=user_id,
+                chat_id=session.chat_id,
+                job_key=job_key,
+                metadata=metadata,
+                speed=session.speed,
+                split_timestamps=session.split_timestamps or '',
+                youtube_title=session.youtube_title,
+                github_title=session.github_title,
+                job_mode=job_mode,
+                processing_mode=session.processing_mode,
+                cached=cached,
+                cache_summary=cache_summary,
+                message=progress_msg
             )
+            if self.local.eligible(job):
+                admitted, reason = self.local.admit(job)
+                if admitted:
+                    position = self.local.put(job)
+                    self.editor.edit(progress_msg, 
+                        f"🏠 **Processing on the bot host!** Position {position}\n\n"
+                        f"• Speed: {job.speed}x\n"
+                        f"• Size: {metadata['size'] / (1024**2):.1f}MB\n"
+                        f"The parts will be sent back to this chat."
+                    )
+                    self.cleanup_user_session(user_id)
+                    return
+                job.cache_summary += f"; local lane skipped ({reason})"
+            
+            position = self.jobs.put(job)
             
-            if success:
-                await progress_msg.edit(
-                    f"✅ **Processing started!**\n\n"
-                    f"**Details:**\n"
-                    f"• Speed: {session['speed']}x\n"
-                    f"• YouTube: {session['youtube_title']}\n"
-                    f"• GitHub Release: {session['github_title']}\n"
-                    f"• File Hash: `{file_hash}`\n\n"
-                    f"📡 **Workflow will:**\n"
-                    f"1. Download directly from Telegram\n"
-                    f"2. Process at {session['speed']}x speed\n"
-                    f"3. Upload to YouTube & GitHub Releases\n\n"
-                    f"Check status with /workflow_status"
+            if position is None:
+                self.editor.edit(progress_msg, 
+                    f"❌ **Queue full!** You already have {self.jobs.pending_for(user_id)} videos waiting.\n"
+                    f"Send this one again once they have started."
                 )
             else:
-                await progress_msg.edit(f"❌ **Failed:**\n{message}")
+                self.editor.edit(progress_msg, 
+                    f"⏳ **Queued!** Position {position} of {len(self.jobs)}\n\n"
+                    f"• Speed: {job.speed}x\n"
+                    f"• YouTube: {job.youtube_title}\n"
+                    f"🗃️ **Cache:** {cache_summary}"
+                )
             
-            # Cleanup
             self.cleanup_user_session(user_id)
             
         except Exception as e:
             logger.error(f"Workflow processing error: {str(e)}")
-            await progress_msg.edit(f"❌ **Error:** {str(e)[:500]}")
+            if progress_msg:
+                self.editor.edit(progress_msg, f"❌ **Error:** {str(e)[:500]}")
             self.cleanup_user_session(user_id)
     
+    async def notify_queue_position(self, job, position, total):
+        self.editor.edit(
+            job.message,
+            f"⏳ **Queued!** Position {position} of {total}\n\n"
+            f"• Speed: {job.speed}x\n"
+            f"• YouTube: {job.youtube_title}\n"
+            f"🗃️ **Cache:** {job.cache_summary}"
+        )
+    
+    async def dispatch_job(self, job):
+        """
+        Pack the manifest and trigger the workflow for a job the queue released.
+        Returns whether a run was started; GitHubRateLimitError is left to the queue.
+        """
+        progress_msg = job.message
+        
+        self.editor.edit(progress_msg, "📦 **Packing job manifest...**")
+        
+        manifest_inputs, error = await FileMetadataHandler.prepare_job_manifest(
+            job.metadata, job.youtube_title, job.job_key
+        )
+        
+        if not manifest_inputs:
+            metrics.inc('bot_workflow_dispatches_total', (('result', 'manifest_failed'),))
+            self.editor.edit(progress_msg, f"❌ **Failed to store metadata:**\n{error}")
+            return False
+        
+        self.editor.edit(progress_msg, "🚀 **Triggering GitHub workflow...**")
+        
+        success, message = await GitHubWorkflowHandler.trigger_telegram_workflow(
+            file_hash=job.job_key,
+            manifest_inputs=manifest_inputs,
+            playback_speed=job.speed,
+            split_timestamps=job.split_timestamps,
+            release_name=job.github_title,
+            video_title=job.youtube_title,
+            job_mode=job.job_mode,
+            processing_mode=job.processing_mode
+        )
+        
+        metrics.inc('bot_workflow_dispatches_total', (('result', 'ok' if success else 'failed'),))
+        waited = time.monotonic() - job.enqueued_at
+        if success and job.job_mode == 'publish':
+            # The run changes the title and name; the next lookup reads them from the release
+            result_cache.invalidate(job.job_key)
+            self.editor.edit(progress_msg, 
+                f"♻️ **Republishing existing result!**\n\n"
+                f"**Details:**\n"
+                f"• Speed: {job.speed}x\n"
+                f"• YouTube: {job.youtube_title}\n"
+                f"• GitHub Release: [{job.github_title}]({job.cached.release_url})\n"
+                f"• File Hash: `{job.job_key}`\n"
+                f"• Queued for: {waited:.0f}s\n\n"
+                f"🗃️ **Cache:** {job.cache_summary}\n\n"
+                f"The stored parts will be uploaded to YouTube with the new title.\n"
+                f"Check status with /workflow_status"
+            )
+        elif success:
+            self.editor.edit(progress_msg, 
+                f"✅ **Processing started!**\n\n"
+                f"**Details:**\n"
+                f"• Speed: {job.speed}x\n"
+                f"• YouTube: {job.youtube_title}\n"
+                f"• GitHub Release: {job.github_title}\n"
+                f"• File Hash: `{job.job_key}`\n"
+                f"• Queued for: {waited:.0f}s\n\n"
+                f"🗃️ **Cache:** {job.cache_summary}\n\n"
+                f"📡 **Workflow will:**\n"
+                f"1. Download directly from Telegram\n"
+                f"2. Process at {job.speed}x speed ({job.processing_mode} mode)\n"
+                f"3. Upload to YouTube & GitHub Releases\n\n"
+                f"Check status with /workflow_status"
+            )
+        else:
+            self.editor.edit(progress_msg, f"❌ **Failed:**\n{message}")
+            return False
+        
+        # From here on the message follows the run
+        self.runs.watch(job)
+        return True
+    
     def cleanup_user_session(self, user_id):
-        """Clean up user session - NO FILES TO DELETE"""
+        """End the current conversation and move on to the user's next waiting video, if any"""
         try:
-            if user_id in user_sessions:
-                del user_sessions[user_id]
+            session = self.sessions.get(user_id)
+            if session is None or not session.pending:
+                self.sessions.discard(user_id)
+                return
+            
+            pending = session.pending
+            file_metadata, file_size = pending.popleft()
+            next_session = self.sessions.create(
+                user_id,
+                chat_id=session.chat_id,
+                step='speed',
+                file_metadata=file_metadata,
+                file_size=file_size
+            )
+            next_session.pending = pending
+            asyncio.create_task(self.client.send_message(
+                session.chat_id,
+                f"🎬 **Next video:** {file_metadata['file_name']} ({file_size / (1024*1024):.1f}MB)\n"
+                f"{len(pending)} more waiting after this one.\n"
+                f"**Step 1/4: Choose playback speed:**",
+                buttons=speed_buttons()
+            ))
         except Exception as e:
             logger.error(f"Cleanup error: {e}")
 
+class StartupProfile:
+    """Wall time of each startup phase, and whether the bot can serve users yet"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = OrderedDict()
+        self.current = 'web_server'
+        self.ready = False
+        self.error = None
+        self.dependencies = {}
+        # Set once built; kept here rather than on the web app, which is frozen by then
+        self.bot = None
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.current = name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+    
+    def report(self):
+        breakdown = ', '.join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        logger.info(f"Startup took {time.perf_counter() - self.started:.2f}s ({breakdown})")
+
+startup = StartupProfile()
+
+async def check_dependencies():
+    """ffmpeg and Python module checks, run concurrently in the background."""
+    async def has_ffmpeg():
+        try:
+            process = await asyncio.create_subprocess_exec(
+                'ffmpeg', '-version', stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+            )
+            return await process.wait() == 0
+        except OSError:
+            return False
+    
+    loop = asyncio.get_running_loop()
+    modules = {'PyNaCl': 'nacl', 'psutil': 'psutil'}
+    results = await asyncio.gather(
+        has_ffmpeg(),
+        *(loop.run_in_executor(None, importlib.util.find_spec, module) for module in modules.values())
+    )
+    startup.dependencies = dict(zip(['FFmpeg', *modules], [results[0]] + [spec is not None for spec in results[1:]]))
+    for name, found in startup.dependencies.items():
+        print(f"✅ {name} is installed" if found else f"❌ {name} not found!")
+
 # Web server functions
 async def handle_health(request):
     """Health check endpoint."""
-    return web.Response(text="✅ Bot is running!")
+    if startup.ready:
+        return web.Response(text="✅ Bot is running!")
+    if startup.error:
+        return web.Response(text=f"❌ Bot failed to start during {startup.current}")
+    return web.Response(text=f"⏳ Bot is starting ({startup.current})")
+
+async def handle_livez(request):
+    """Liveness: the process and its event loop are responding."""
+    return web.Response(text="ok")
+
+async def handle_readyz(request):
+    """Readiness: logged in to Telegram, handlers registered and still connected."""
+    bot = startup.bot
+    if startup.ready and bot is not None and bot.client.is_connected():
+        return web.Response(text="ready")
+    if startup.error:
+        return web.Response(status=503, text=f"startup failed: {startup.error}")
+    return web.Response(status=503, text=f"starting: {startup.current}")
+
+async def handle_metrics(request):
+    """Prometheus text exposition of the bot's counters, histograms and gauges."""
+    # The version parameter tells scrapers this is the 0.0.4 text format
+    return web.Response(body=metrics.render().encode(), headers={
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+        'X-Content-Type-Options': 'nosniff'
+    })
 
 async def handle_root(request):
     """Root endpoint."""
@@ -829,73 +2630,86 @@ async def handle_root(request):
     """
     return web.Response(text=html, content_type='text/html')
 
-async def start_bot(app):
-    """Start the Telegram bot in background."""
-    bot = TelegramVideoBot()
-    app['bot'] = bot
-    # Start bot in background
-    asyncio.create_task(bot.start())
+async def run_bot():
+    """Import the Telegram stack, build the bot and log in, all after the port is open."""
+    loop = asyncio.get_running_loop()
+    try:
+        with startup.phase('imports'):
+            await loop.run_in_executor(None, load_runtime_modules)
+        with startup.phase('client'):
+            bot = TelegramVideoBot()
+            startup.bot = bot
+        await bot.start()
+    except Exception as e:
+        startup.error = str(e)
+        logger.exception(f"Bot failed during {startup.current}")
+        startup.report()
 
 async def cleanup_bot(app):
     """Cleanup bot on shutdown."""
-    if 'bot' in app:
-        bot = app['bot']
+    bot = startup.bot
+    if bot is not None:
+        await bot.monitor.stop()
+        await bot.sessions.stop()
+        await bot.manifest_gc.stop()
+        await bot.jobs.stop()
+        await bot.local.stop()
+        await bot.runs.stop()
+        await bot.editor.stop()
         await bot.client.disconnect()
+    await metrics.stop()
+    await github_client.close()
+
+def log_task_failure(task):
+    """Surface an exception from a background start-up task instead of dropping it with the task."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task {task.get_coro().__qualname__} failed", exc_info=task.exception())
 
 async def main():
     """Main function to start both web server and bot."""
-    # Check dependencies
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-        print("✅ FFmpeg is installed")
-    except:
-        print("❌ FFmpeg not found!")
-    
-    # Check Python dependencies
-    try:
-        import nacl
-        print("✅ PyNaCl is installed")
-    except ImportError:
-        print("❌ PyNaCl not found!")
-    
-    try:
-        import psutil
-        print("✅ psutil is installed")
-    except ImportError:
-        print("❌ psutil not found!")
-    
-    # Create web application
-    app = web.Application()
-    
-    # Add routes
-    app.router.add_get('/', handle_root)
-    app.router.add_get('/health', handle_health)
-    
-    # Add startup and cleanup callbacks
-    app.on_startup.append(start_bot)
-    app.on_cleanup.append(cleanup_bot)
-    
-    # Create temp directory
-    Path("/tmp/videos").mkdir(parents=True, exist_ok=True)
-    
-    # Start web server
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', PORT)
-    
-    print(f"🌐 Starting web server on port {PORT}...")
-    await site.start()
+    with startup.phase('web_server'):
+        # Create web application
+        app = web.Application()
+        
+        # Add routes
+        app.router.add_get('/', handle_root)
+        app.router.add_get('/health', handle_health)
+        app.router.add_get('/livez', handle_livez)
+        app.router.add_get('/readyz', handle_readyz)
+        app.router.add_get('/metrics', handle_metrics)
+        
+        # Add cleanup callback
+        app.on_cleanup.append(cleanup_bot)
+        
+        # Create temp directory
+        Path("/tmp/videos").mkdir(parents=True, exist_ok=True)
+        
+        # Start web server before anything slow, so the host sees the port right away
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '0.0.0.0', PORT)
+        
+        print(f"🌐 Starting web server on port {PORT}...")
+        await site.start()
     
     print("✅ Web server started!")
-    print("📡 Bot is running in background")
+    print("📡 Bot is starting in background (see /readyz)")
     print("🛑 Send SIGINT (Ctrl+C) to stop")
     
+    # Dependency checks and the bot's own start-up run alongside each other
+    tasks = [asyncio.create_task(check_dependencies()), asyncio.create_task(run_bot())]
+    for task in tasks:
+        task.add_done_callback(log_task_failure)
+    
     # Keep running
     try:
         await asyncio.Event().wait()
     except KeyboardInterrupt:
         print("\n👋 Shutting down...")
     finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
         await runner.cleanup()
 
 if __name__ == '__main__':
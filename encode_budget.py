@@ -0,0 +1,120 @@
+import os
+import time
+
+import video_processing
+
+# x264 presets from fastest to slowest
+PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
+# Typical encode time relative to medium; only the ratios matter, the sample sets the scale
+PRESET_COST = {
+    'ultrafast': 0.18, 'superfast': 0.27, 'veryfast': 0.42, 'faster': 0.65, 'fast': 0.8,
+    'medium': 1.0, 'slow': 1.55, 'slower': 2.7, 'veryslow': 5.4
+}
+DEFAULT_DEADLINE_SHARE = float(os.getenv('ENCODE_DEADLINE_SHARE', 0.6))
+SAMPLE_SECONDS = int(os.getenv('ENCODE_SAMPLE_SECONDS', 20))
+
+
+class EncodeBudget:
+    """
+    Picks the slowest x264 preset whose estimated encode time fits in a share of
+    the time left before the job deadline. The estimate starts from a short
+    sample encode and is recalibrated from every finished part, so the parts
+    still waiting can drop to a faster preset if the first ones ran slow.
+    Costs are kept in core-seconds per output second at medium.
+    """
+
+    def __init__(self, plan, speed, cores, threads_for, deadline, share=DEFAULT_DEADLINE_SHARE,
+                 slowest=video_processing.DEFAULT_PRESET, started=None):
+        self.speed = float(speed)
+        self.cores = cores
+        self.threads_for = threads_for
+        self.slowest = slowest
+        self.started = started or time.time()
+        # Encoding has to be done by here; the rest of the budget is for uploads
+        self.encode_deadline = self.started + share * (deadline - self.started)
+        self.remaining = {part.index: (part.end - part.start) / self.speed for part in plan}
+        self.preset = slowest
+        self.estimate = None
+        self.planned = None
+        self.history = []
+        self._core_seconds = 0.0
+        self._output_seconds = 0.0
+
+    @property
+    def calibrated(self):
+        return self._output_seconds > 0
+
+    def observe(self, output_seconds, threads, preset, wall):
+        """Fold one measured encode (the sample or a finished part) into the cost estimate."""
+        self._core_seconds += wall * threads / PRESET_COST[preset]
+        self._output_seconds += output_seconds
+
+    def estimate_seconds(self, preset):
+        """Wall time to encode every remaining part with this preset on the available cores."""
+        if not self.remaining:
+            return 0.0
+        unit = self._core_seconds / self._output_seconds * PRESET_COST[preset]
+        packed = sum(self.remaining.values()) * unit / self.cores
+        # The longest part cannot go faster than its own thread share allows
+        longest = max(seconds * unit / self.threads_for[index] for index, seconds in self.remaining.items())
+        return max(packed, longest)
+
+    def choose(self, now=None):
+        """Re-pick the preset for the parts not started yet; returns it."""
+        if not self.calibrated:
+            return self.preset
+        available = self.encode_deadline - (now or time.time())
+        candidates = PRESETS[:PRESETS.index(self.slowest) + 1]
+        chosen = candidates[0]
+        for preset in reversed(candidates):
+            if self.estimate_seconds(preset) <= available:
+                chosen = preset
+                break
+        if chosen != self.preset:
+            print(f"🎚️ Encoder preset {self.preset} → {chosen} "
+                  f"({self.estimate_seconds(chosen) / 60:.0f} min estimated, {max(0, available) / 60:.0f} min left)")
+        if self.estimate_seconds(chosen) > available:
+            print(f"⚠️ Even {chosen} is estimated to overrun the encode budget")
+        self.preset = chosen
+        self.estimate = self.estimate_seconds(chosen)
+        if self.planned is None:
+            self.planned = self.estimate
+        return chosen
+
+    def start_part(self, part):
+        """Preset for a part that is about to start. Parts still encoding count as remaining work."""
+        preset = self.choose()
+        self.history.append((part.index, preset))
+        return preset
+
+    def finish_part(self, part, preset, wall):
+        self.remaining.pop(part.index, None)
+        self.observe((part.end - part.start) / self.speed, self.threads_for[part.index], preset, wall)
+
+    def summary(self):
+        """Release-notes line describing the encoder settings that were used."""
+        presets = sorted({preset for _, preset in self.history}, key=PRESETS.index) or [self.preset]
+        line = f"- Encoder preset: {', '.join(presets)}"
+        if self.planned is not None:
+            budget = self.encode_deadline - self.started
+            line += f" (estimated {self.planned / 60:.0f} min of a {budget / 60:.0f} min encode budget)"
+        return line
+
+
+def sample_encode(source, duration, speed, has_audio, preset, crf, threads, frame_rate, output,
+                  seconds=SAMPLE_SECONDS, start=None):
+    """
+    Time a short encode from the middle of the source, where the content is more
+    typical than an intro, or from start when only a prefix is available yet.
+    Returns (output seconds, wall seconds).
+    """
+    seconds = min(seconds, duration)
+    if start is None:
+        start = max(0.0, duration / 2 - seconds / 2)
+    part = video_processing.PartPlan(0, start, start + seconds, output)
+    try:
+        wall = video_processing.encode_part(source, part, speed, has_audio, preset, crf, threads, frame_rate)
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+    return seconds / float(speed), wall
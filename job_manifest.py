@@ -0,0 +1,155 @@
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import base64
+import argparse
+import binascii
+import urllib.request
+
+import nacl.secret
+import nacl.utils
+import nacl.exceptions
+
+MANIFEST_VERSION = 1
+MANIFEST_PREFIX = f"v{MANIFEST_VERSION}."
+# workflow_dispatch caps the whole inputs payload, so big manifests go through a file instead
+MAX_INLINE_LENGTH = int(os.getenv('JOB_MANIFEST_MAX_INLINE', 8192))
+DEFAULT_TTL = 24 * 3600
+METADATA_DIR = 'telegram_metadata'
+
+# <job_key>.<expires_at>.manifest, plus the older telegram_file_<hash>[_<created_at>].json names
+MANIFEST_NAME = re.compile(r'^(?P<key>[0-9a-f]+)\.(?P<expires>\d+)\.manifest$')
+LEGACY_NAME = re.compile(r'^telegram_file_(?P<key>[0-9a-f]+)(?:_(?P<created>\d+))?\.json$')
+
+
+class ManifestError(Exception):
+    """Raised when a manifest cannot be opened, is from an unknown schema or has expired"""
+
+
+def load_key(value=None):
+    """32-byte SecretBox key from JOB_MANIFEST_KEY (hex or base64), or None when unset."""
+    value = value if value is not None else os.getenv('JOB_MANIFEST_KEY', '')
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        key = bytes.fromhex(value) if len(value) == 2 * nacl.secret.SecretBox.KEY_SIZE else base64.b64decode(value)
+    except (ValueError, binascii.Error) as e:
+        raise ManifestError(f"JOB_MANIFEST_KEY is not hex or base64: {e}") from e
+    if len(key) != nacl.secret.SecretBox.KEY_SIZE:
+        raise ManifestError(f"JOB_MANIFEST_KEY must be {nacl.secret.SecretBox.KEY_SIZE} bytes, got {len(key)}")
+    return key
+
+
+def encode(content, key):
+    """
+    Seal a job description: compact JSON, zlib, then SecretBox so the runner can
+    tell it came from the bot and the Telegram access hash never shows up in the
+    run's inputs in clear text.
+    """
+    payload = dict(content, v=MANIFEST_VERSION)
+    compressed = zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), 9)
+    sealed = nacl.secret.SecretBox(key).encrypt(compressed)
+    return MANIFEST_PREFIX + base64.urlsafe_b64encode(bytes(sealed)).rstrip(b'=').decode()
+
+
+def decode(token, key, now=None, allow_unsigned=False):
+    """
+    Open a manifest produced by encode(). Plain JSON (the pre-manifest format)
+    carries no authentication and is only accepted with allow_unsigned.
+    """
+    token = token.strip()
+    if token.startswith('{'):
+        if not allow_unsigned:
+            raise ManifestError('Unsigned JSON manifests are not accepted (see --allow-unsigned)')
+        try:
+            return json.loads(token)
+        except ValueError as e:
+            raise ManifestError(f"Manifest is corrupt: {e}") from e
+    if not token.startswith(MANIFEST_PREFIX):
+        raise ManifestError(f"Unsupported manifest version: {token[:8]!r}")
+    if key is None:
+        raise ManifestError('JOB_MANIFEST_KEY is not set')
+
+    body = token[len(MANIFEST_PREFIX):]
+    try:
+        sealed = base64.urlsafe_b64decode(body + '=' * (-len(body) % 4))
+        content = json.loads(zlib.decompress(nacl.secret.SecretBox(key).decrypt(sealed)))
+    except nacl.exceptions.CryptoError as e:
+        raise ManifestError('Manifest failed authentication (wrong key or tampered)') from e
+    except (ValueError, binascii.Error, zlib.error) as e:
+        raise ManifestError(f"Manifest is corrupt: {e}") from e
+
+    if content.pop('v', None) != MANIFEST_VERSION:
+        raise ManifestError('Manifest schema version does not match its prefix')
+    expires_at = content.get('expires_at')
+    if expires_at and (now or time.time()) > expires_at:
+        raise ManifestError('Manifest has expired')
+    return content
+
+
+def manifest_path(job_key, expires_at):
+    """Repository path for a manifest too large to inline; the expiry is in the name so GC never reads it."""
+    return f"{METADATA_DIR}/{job_key}.{int(expires_at)}.manifest"
+
+
+def path_expiry(name, ttl=DEFAULT_TTL):
+    """When a telegram_metadata entry expires, or 0 for old names with no timestamp."""
+    match = MANIFEST_NAME.match(name)
+    if match:
+        return int(match.group('expires'))
+    match = LEGACY_NAME.match(name)
+    if match:
+        created = match.group('created')
+        return int(created) + ttl if created else 0
+    return None
+
+
+def read_source(source):
+    """Manifest text from a checked-out path or, for older dispatches, a URL."""
+    if os.path.exists(source):
+        with open(source) as f:
+            return f.read()
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=30) as response:
+            return response.read().decode()
+    raise ManifestError(f"Manifest source not found: {source}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Open or create job manifests')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    decode_parser = sub.add_parser('decode', help='Write the job metadata carried by a manifest')
+    decode_parser.add_argument('--manifest', default='', help='Inline manifest from the dispatch inputs')
+    decode_parser.add_argument('--source', default='', help='Manifest file path or URL when not inlined')
+    decode_parser.add_argument('--output', default='metadata.json')
+    decode_parser.add_argument('--allow-unsigned', action='store_true',
+                               help='Also accept plain JSON metadata from before sealed manifests (off by default)')
+
+    sub.add_parser('keygen', help='Print a new key for JOB_MANIFEST_KEY')
+
+    args = parser.parse_args()
+
+    if args.command == 'keygen':
+        print(nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE).hex())
+        return
+
+    try:
+        token = args.manifest or read_source(args.source)
+        content = decode(token, load_key(), allow_unsigned=args.allow_unsigned)
+    except ManifestError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    with open(args.output, 'w') as f:
+        json.dump(content, f, indent=2)
+    inline = 'inline' if args.manifest else 'file'
+    print(f"✅ Opened {inline} job manifest ({len(token)} chars) → {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import struct
+import argparse
+import subprocess
+from array import array
+from bisect import bisect_left, bisect_right
+
+INDEX_MAGIC = b'MIDX'
+INDEX_VERSION = 1
+# magic, version, header length
+INDEX_PREFIX = struct.Struct('<4sBI')
+DEFAULT_INDEX_DIR = os.getenv('MEDIA_INDEX_DIR', '.media_index')
+STREAM_FIELDS = 'index,codec_type,codec_name,width,height,r_frame_rate,sample_rate,channels'
+
+
+class MediaIndexError(Exception):
+    """Raised when an index file is missing, corrupt or from another format version"""
+
+
+class MediaIndex:
+    """
+    Everything the planners need to know about a source, probed once.
+    Keyframe times and byte offsets live in parallel typed arrays so a
+    multi-hour source costs a few hundred KB instead of a list of dicts.
+    """
+
+    __slots__ = ('file_hash', 'size', 'duration', 'has_audio', 'frame_rate', 'streams',
+                 'keyframe_times', 'keyframe_offsets')
+
+    def __init__(self, file_hash, size, duration, has_audio, frame_rate, streams,
+                 keyframe_times=None, keyframe_offsets=None):
+        self.file_hash = file_hash
+        self.size = size
+        self.duration = duration
+        self.has_audio = has_audio
+        self.frame_rate = frame_rate
+        self.streams = streams
+        self.keyframe_times = keyframe_times if keyframe_times is not None else array('d')
+        self.keyframe_offsets = keyframe_offsets if keyframe_offsets is not None else array('q')
+
+    def __len__(self):
+        return len(self.keyframe_times)
+
+    def keyframe_before(self, t):
+        """(time, byte offset) of the last keyframe at or before t."""
+        i = bisect_right(self.keyframe_times, t) - 1
+        if i < 0:
+            return 0.0, 0
+        return self.keyframe_times[i], self.keyframe_offsets[i]
+
+    def keyframes_between(self, start, end):
+        """Keyframe times strictly inside (start, end), without copying the whole array."""
+        lo = bisect_right(self.keyframe_times, start)
+        hi = bisect_left(self.keyframe_times, end)
+        return self.keyframe_times[lo:hi]
+
+    # Serialisation
+
+    def _header(self):
+        return {
+            'file_hash': self.file_hash,
+            'size': self.size,
+            'duration': self.duration,
+            'has_audio': self.has_audio,
+            'frame_rate': self.frame_rate,
+            'streams': self.streams,
+            'keyframes': len(self.keyframe_times)
+        }
+
+    def to_bytes(self):
+        header = json.dumps(self._header(), separators=(',', ':')).encode()
+        times, offsets = array('d', self.keyframe_times), array('q', self.keyframe_offsets)
+        if sys.byteorder != 'little':
+            times.byteswap()
+            offsets.byteswap()
+        return INDEX_PREFIX.pack(INDEX_MAGIC, INDEX_VERSION, len(header)) + header + times.tobytes() + offsets.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < INDEX_PREFIX.size:
+            raise MediaIndexError('Index file is truncated')
+        magic, version, header_length = INDEX_PREFIX.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise MediaIndexError(f'Unsupported index format {magic!r} v{version}')
+        offset = INDEX_PREFIX.size
+        header = json.loads(data[offset:offset + header_length])
+        offset += header_length
+        count = header.pop('keyframes')
+        times, offsets = array('d'), array('q')
+        times.frombytes(data[offset:offset + count * times.itemsize])
+        offset += count * times.itemsize
+        offsets.frombytes(data[offset:offset + count * offsets.itemsize])
+        if len(times) != count or len(offsets) != count:
+            raise MediaIndexError('Index file is truncated')
+        if sys.byteorder != 'little':
+            times.byteswap()
+            offsets.byteswap()
+        return cls(keyframe_times=times, keyframe_offsets=offsets, **header)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'rb') as f:
+                return cls.from_bytes(f.read())
+        except (OSError, ValueError, struct.error) as e:
+            raise MediaIndexError(f'Could not read {path}: {e}') from e
+
+
+def index_path(file_hash, index_dir=DEFAULT_INDEX_DIR):
+    return os.path.join(index_dir, f"{file_hash}.midx")
+
+
+def source_key(path):
+    """Fallback cache key when no metadata file hash is available."""
+    return f"{os.path.basename(path)}-{os.path.getsize(path)}"
+
+
+def build_index(path, file_hash):
+    """Probe a file once: container and stream info, then a packet-flag scan for keyframes."""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', f'format=duration:stream={STREAM_FIELDS}',
+         '-of', 'json', path],
+        capture_output=True, text=True, check=True
+    )
+    info = json.loads(result.stdout)
+    streams = info.get('streams', [])
+    frame_rate = next(
+        (stream['r_frame_rate'] for stream in streams
+         if stream.get('codec_type') == 'video' and stream.get('r_frame_rate', '0/0') != '0/0'),
+        '25/1'
+    )
+
+    times, offsets = array('d'), array('q')
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,pos,flags',
+         '-of', 'csv=print_section=0', path],
+        capture_output=True, text=True, check=True
+    )
+    for line in result.stdout.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) >= 3 and 'K' in fields[-1] and fields[0] not in ('', 'N/A'):
+            times.append(float(fields[0]))
+            offsets.append(int(fields[1]) if fields[1] not in ('', 'N/A') else -1)
+
+    # Packets come in decode order; keyframes are what we bisect on, so sort by time
+    if any(a > b for a, b in zip(times, times[1:])):
+        pairs = sorted(zip(times, offsets))
+        times, offsets = array('d', (t for t, _ in pairs)), array('q', (o for _, o in pairs))
+
+    return MediaIndex(
+        file_hash=file_hash,
+        size=os.path.getsize(path),
+        duration=float(info['format']['duration']),
+        has_audio=any(stream.get('codec_type') == 'audio' for stream in streams),
+        frame_rate=frame_rate,
+        streams=streams,
+        keyframe_times=times,
+        keyframe_offsets=offsets
+    )
+
+
+def load_or_probe(path, file_hash=None, index_dir=DEFAULT_INDEX_DIR):
+    """Return the saved index for this source, probing and saving it on a miss."""
+    file_hash = file_hash or source_key(path)
+    cache_path = index_path(file_hash, index_dir)
+    try:
+        index = MediaIndex.load(cache_path)
+        if index.size == os.path.getsize(path):
+            print(f"📇 Media index hit for {file_hash} ({len(index)} keyframes)")
+            return index
+        print(f"⚠️ Media index for {file_hash} is for a different file size, re-probing")
+    except MediaIndexError:
+        pass
+
+    index = build_index(path, file_hash)
+    index.save(cache_path)
+    print(f"📇 Indexed {path}: {index.duration:.1f}s, {len(index)} keyframes → {cache_path}")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Probe a source once and cache its keyframe index')
+    parser.add_argument('--input', required=True)
+    parser.add_argument('--file-hash', default=None, help='Cache key (defaults to file name and size)')
+    parser.add_argument('--index-dir', default=DEFAULT_INDEX_DIR)
+    args = parser.parse_args()
+
+    index = load_or_probe(args.input, args.file_hash, args.index_dir)
+    print(json.dumps({
+        'file_hash': index.file_hash,
+        'duration': index.duration,
+        'has_audio': index.has_audio,
+        'frame_rate': index.frame_rate,
+        'keyframes': len(index),
+        'streams': index.streams
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
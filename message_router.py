@@ -0,0 +1,88 @@
+import re
+from collections import Counter
+
+# One split point, HH:MM:SS with the hour capped at 23; the list form allows comma-separated points
+TIMESTAMP = r'(?:[01]?\d|2[0-3]):[0-5]\d:[0-5]\d'
+TIMESTAMPS_PATTERN = re.compile(rf'{TIMESTAMP}(?:,{TIMESTAMP})*')
+# Google authorization codes are long and have no spaces
+AUTH_CODE_PATTERN = re.compile(r'\S{21,}')
+
+
+def valid_timestamps(text):
+    """Comma-separated HH:MM:SS split points, or empty for no splits."""
+    return not text or TIMESTAMPS_PATTERN.fullmatch(text) is not None
+
+
+def looks_like_auth_code(text):
+    return AUTH_CODE_PATTERN.fullmatch(text) is not None
+
+
+def is_video(message):
+    """Video messages, and documents sent as files with a video MIME type."""
+    document = message.document
+    if document is None:
+        return False
+    return 'video' in (document.mime_type or '').lower() or message.video is not None
+
+
+class MessageRouter:
+    """
+    The bot's single NewMessage handler. Each message is classified once:
+    a command goes to its handler by dict lookup, a video to the video handler,
+    and any other text to the handler for the sender's conversation step, with
+    a pending YouTube authorization taking precedence. Nothing is matched
+    against a list of patterns, so the cost per message does not grow with the
+    number of commands or steps.
+    """
+
+    __slots__ = ('sessions', 'commands', 'states', 'video', 'auth', 'stats')
+
+    def __init__(self, sessions, video=None, auth=None):
+        self.sessions = sessions
+        self.commands = {}
+        self.states = {}
+        self.video = video
+        self.auth = auth
+        self.stats = Counter()
+
+    def command(self, name, handler):
+        self.commands[name] = handler
+
+    def state(self, step, handler):
+        """Handler for text sent while a conversation is at this step: handler(event, session, text)."""
+        self.states[step] = handler
+
+    def classify(self, message):
+        """('command', handler), ('video', handler) or ('text', None) for one message."""
+        text = message.message
+        if text and text[0] == '/':
+            # "/status@SomeBot extra words" -> "/status"
+            name = text.split(None, 1)[0].partition('@')[0].lower()
+            handler = self.commands.get(name)
+            if handler is not None:
+                return 'command', handler
+        if self.video is not None and is_video(message):
+            return 'video', self.video
+        return 'text', None
+
+    async def dispatch(self, event):
+        route, handler = self.classify(event.message)
+        if handler is not None:
+            self.stats[route] += 1
+            return await handler(event)
+
+        session = self.sessions.get(event.sender_id)
+        if session is None:
+            self.stats['ignored'] += 1
+            return
+        # Formatted text, as the conversation has always stored titles with their markdown
+        text = (event.text or '').strip()
+        if session.waiting_for_auth and self.auth is not None and looks_like_auth_code(text):
+            self.stats['auth'] += 1
+            return await self.auth(event, session, text)
+        handler = self.states.get(session.step)
+        if handler is None:
+            self.stats['ignored'] += 1
+            return
+        self.stats['state'] += 1
+        return await handler(event, session, text)
@@ -0,0 +1,456 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import shutil
+import http.client
+from urllib.parse import quote, urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+import media_probe
+import encode_budget
+import video_processing
+import youtube_upload
+
+GITHUB_API_HOST = 'api.github.com'
+GITHUB_UPLOADS_HOST = 'uploads.github.com'
+API_RETRIES = 4
+DEFAULT_RELEASE_CONCURRENCY = int(os.getenv('RELEASE_UPLOAD_CONCURRENCY', 2))
+DEFAULT_YOUTUBE_CONCURRENCY = int(os.getenv('YOUTUBE_UPLOAD_CONCURRENCY', 2))
+YOUTUBE_ATTEMPTS = 3
+DOWNLOAD_CHUNK = 1024 * 1024
+# Machine-readable summary the bot reads back to decide whether a result can be reused
+RESULT_MARKER = '<!-- result: {} -->'
+# Finished parts waiting for an uploader; encoders pause when a stage falls this far behind
+STAGE_QUEUE_SIZE = 4
+
+
+class GitHubReleaseClient:
+    """Minimal blocking GitHub Releases client for the runner"""
+
+    def __init__(self, token, repo):
+        self.token = token
+        self.repo = repo
+
+    def _request(self, host, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        headers.update({
+            'Authorization': f'token {self.token}',
+            'Accept': 'application/vnd.github.v3+json',
+            'User-Agent': 'telegram-video-pipeline'
+        })
+        for attempt in range(API_RETRIES + 1):
+            if hasattr(body, 'seek'):
+                body.seek(0)
+            conn = http.client.HTTPSConnection(host, timeout=300)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (ConnectionError, OSError, http.client.HTTPException) as e:
+                if attempt == API_RETRIES:
+                    raise
+                print(f"⚠️ GitHub {method} {path} failed ({e!r}), retrying")
+                time.sleep(2 ** attempt)
+                continue
+            finally:
+                conn.close()
+
+            if response.status >= 500 and attempt < API_RETRIES:
+                time.sleep(2 ** attempt)
+                continue
+            return response.status, json.loads(data) if data else None
+        raise RuntimeError(f"GitHub {method} {path} failed after {API_RETRIES} retries")
+
+    def get_release(self, tag):
+        status, release = self._request(GITHUB_API_HOST, 'GET', f"/repos/{self.repo}/releases/tags/{quote(tag)}")
+        return release if status == 200 else None
+
+    def publish_release(self, tag, name, body):
+        """Create the release, or bring the name and body of an existing one up to date."""
+        release = self.get_release(tag)
+        payload = {'name': name, 'body': body}
+        if release:
+            if release.get('name') == name and release.get('body') == body:
+                return release
+            status, updated = self._request(GITHUB_API_HOST, 'PATCH', f"/repos/{self.repo}/releases/{release['id']}",
+                                            json.dumps(payload), {'Content-Type': 'application/json'})
+            if status != 200:
+                raise RuntimeError(f"Could not update release {tag}: {status} {updated}")
+            return updated
+        payload.update({'tag_name': tag, 'draft': False, 'prerelease': False})
+        status, release = self._request(GITHUB_API_HOST, 'POST', f"/repos/{self.repo}/releases",
+                                        json.dumps(payload), {'Content-Type': 'application/json'})
+        if status != 201:
+            raise RuntimeError(f"Could not create release {tag}: {status} {release}")
+        return release
+
+    def upload_asset(self, release_id, path):
+        name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            status, asset = self._request(
+                GITHUB_UPLOADS_HOST, 'POST',
+                f"/repos/{self.repo}/releases/{release_id}/assets?name={quote(name)}",
+                f,
+                {'Content-Type': 'application/octet-stream', 'Content-Length': str(os.path.getsize(path))}
+            )
+        if status != 201:
+            raise RuntimeError(f"Could not upload {name}: {status} {asset}")
+        return asset
+
+    def download_asset(self, asset, path):
+        """Stream a release asset to disk, following the redirect to the storage host."""
+        url = f"https://{GITHUB_API_HOST}/repos/{self.repo}/releases/assets/{asset['id']}"
+        headers = {
+            'Authorization': f'token {self.token}',
+            'Accept': 'application/octet-stream',
+            'User-Agent': 'telegram-video-pipeline'
+        }
+        for _ in range(5):
+            parts = urlsplit(url)
+            conn = http.client.HTTPSConnection(parts.netloc, timeout=300)
+            try:
+                conn.request('GET', parts.path + (f"?{parts.query}" if parts.query else ''), headers=headers)
+                response = conn.getresponse()
+                if response.status in (301, 302, 303, 307, 308):
+                    url = response.getheader('Location')
+                    # The storage URL is pre-signed and rejects an Authorization header
+                    headers = {'User-Agent': headers['User-Agent']}
+                    continue
+                if response.status != 200:
+                    raise RuntimeError(f"Could not download {asset['name']}: {response.status}")
+                tmp_path = path + '.part'
+                with open(tmp_path, 'wb') as f:
+                    shutil.copyfileobj(response, f, DOWNLOAD_CHUNK)
+                os.replace(tmp_path, path)
+                return path
+            finally:
+                conn.close()
+        raise RuntimeError(f"Too many redirects downloading {asset['name']}")
+
+
+class PartTracker:
+    """Deletes a part's file once every consumer stage is done with it"""
+
+    def __init__(self, consumers):
+        self.consumers = set(consumers)
+        self.pending = {}
+
+    def add(self, part):
+        self.pending[part.index] = set(self.consumers)
+
+    def done(self, part, stage):
+        remaining = self.pending.get(part.index)
+        if remaining is None:
+            return
+        remaining.discard(stage)
+        if not remaining:
+            del self.pending[part.index]
+            try:
+                os.remove(part.output)
+                print(f"🧹 Removed {part.output}")
+            except OSError:
+                pass
+
+
+class StagePipeline:
+    """Encode, release-asset upload and YouTube upload stages joined by bounded queues"""
+
+    def __init__(self, plan, encode, stages, tracker):
+        self.plan = plan
+        self.encode = encode
+        self.stages = stages
+        self.tracker = tracker
+        self.events = []
+        self.failures = []
+        self._started = time.monotonic()
+
+    def _record(self, stage, part, started):
+        self.events.append({
+            'stage': stage,
+            'part': part.index,
+            'started_at': round(started - self._started, 3),
+            'finished_at': round(time.monotonic() - self._started, 3)
+        })
+
+    async def _encode_stage(self, queues):
+        async def encode_one(part):
+            started = time.monotonic()
+            await self.encode(part)
+            self._record('encode', part, started)
+            self.tracker.add(part)
+            print(f"✅ Encoded part {part.index}, handing it to {len(queues)} upload stages")
+            for queue in queues.values():
+                await queue.put(part)
+
+        try:
+            await asyncio.gather(*(encode_one(part) for part in self.plan))
+        finally:
+            for name, queue in queues.items():
+                for _ in range(self.stages[name][1]):
+                    await queue.put(None)
+
+    async def _upload_worker(self, name, queue, upload):
+        while True:
+            part = await queue.get()
+            if part is None:
+                return
+            started = time.monotonic()
+            try:
+                await upload(part)
+                self._record(name, part, started)
+            except Exception as e:
+                print(f"❌ {name} failed for part {part.index}: {e}")
+                self.failures.append({'stage': name, 'part': part.index, 'error': str(e)})
+            finally:
+                self.tracker.done(part, name)
+
+    async def run(self):
+        queues = {name: asyncio.Queue(maxsize=STAGE_QUEUE_SIZE) for name in self.stages}
+        workers = [
+            self._upload_worker(name, queues[name], upload)
+            for name, (upload, concurrency) in self.stages.items()
+            for _ in range(concurrency)
+        ]
+        await asyncio.gather(self._encode_stage(queues), *workers)
+        return {
+            'wall_seconds': round(time.monotonic() - self._started, 3),
+            'events': self.events,
+            'failures': self.failures
+        }
+
+
+def release_body(text, job_key, video_title, part_count, youtube='pending'):
+    """
+    Release notes ending in the result marker the bot's cache reads. youtube stays
+    'pending' until every stage of a run has succeeded, so a result whose YouTube
+    uploads never finished is republished rather than reported as done.
+    """
+    details = json.dumps({'job_key': job_key, 'video_title': video_title, 'parts': part_count, 'youtube': youtube},
+                         separators=(',', ':')).replace('>', '\\u003e')
+    return f"{text.rstrip()}\n- Split into {part_count} parts\n\n{RESULT_MARKER.format(details)}"
+
+
+def release_parts(assets, basename, speed):
+    """Rebuild the part plan from the assets of an earlier run."""
+    pattern = re.compile(rf"^{re.escape(basename)}_part(\d+)_{re.escape(str(speed))}x\.mp4$")
+    plan = []
+    for asset in assets:
+        match = pattern.match(asset['name'])
+        if match:
+            plan.append(video_processing.PartPlan(int(match.group(1)), 0.0, 0.0, asset['name']))
+    return sorted(plan)
+
+
+def part_titles(title, speed, part, count):
+    if count == 1:
+        return title, f"Processed at {speed}x speed"
+    return f"{title} - Part {part.index} of {count}", f"Processed at {speed}x speed\nPart {part.index} of {count}"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Encode parts and publish them as soon as each one is ready')
+    parser.add_argument('--input', help='Source video (omit with --skip-encode)')
+    parser.add_argument('--basename', required=True)
+    parser.add_argument('--speed', required=True)
+    parser.add_argument('--splits', default='')
+    parser.add_argument('--release-name', required=True)
+    parser.add_argument('--release-tag', required=True)
+    parser.add_argument('--release-body', default='')
+    parser.add_argument('--video-title', required=True)
+    parser.add_argument('--skip-encode', action='store_true', help='Publish parts already listed in --plan')
+    parser.add_argument('--from-release', action='store_true',
+                        help='Republish the parts already attached to --release-tag instead of encoding')
+    parser.add_argument('--job-key', default='', help='Source and parameter hash recorded in the release body')
+    parser.add_argument('--plan', default='plan.json')
+    parser.add_argument('--preset', default=video_processing.DEFAULT_PRESET,
+                        help='Encoder preset, or the slowest one allowed when --deadline is set')
+    parser.add_argument('--processing-mode', choices=['full', 'fast'], default='full',
+                        help='fast = rescale video timestamps instead of re-encoding where the output stays valid')
+    parser.add_argument('--deadline', type=float, default=None,
+                        help='Unix time the job is killed at; picks the preset from a sample encode')
+    parser.add_argument('--deadline-share', type=float, default=encode_budget.DEFAULT_DEADLINE_SHARE,
+                        help='Share of the time left that encoding may use')
+    parser.add_argument('--crf', type=int, default=video_processing.DEFAULT_CRF)
+    parser.add_argument('--cores', type=int, default=None)
+    parser.add_argument('--min-threads', type=int, default=video_processing.MIN_THREADS_PER_ENCODE)
+    parser.add_argument('--release-concurrency', type=int, default=DEFAULT_RELEASE_CONCURRENCY)
+    parser.add_argument('--youtube-concurrency', type=int, default=DEFAULT_YOUTUBE_CONCURRENCY)
+    parser.add_argument('--report', default='pipeline_report.json')
+    parser.add_argument('--file-hash', default=None, help='Media index cache key')
+    parser.add_argument('--index-dir', default=media_probe.DEFAULT_INDEX_DIR)
+    args = parser.parse_args()
+
+    cores = args.cores or video_processing.available_cores()
+    loop = asyncio.get_running_loop()
+    github = GitHubReleaseClient(os.getenv('GITHUB_TOKEN'), os.getenv('GITHUB_REPOSITORY'))
+    index = None
+
+    if args.from_release:
+        existing = await loop.run_in_executor(None, github.get_release, args.release_tag)
+        plan = release_parts(existing['assets'], args.basename, args.speed) if existing else []
+        if not plan:
+            print(f"❌ Release {args.release_tag} has no parts to republish")
+            sys.exit(1)
+        assets = {asset['name']: asset for asset in existing['assets']}
+    elif args.skip_encode:
+        with open(args.plan) as f:
+            plan = [video_processing.PartPlan(**part) for part in json.load(f)]
+    else:
+        index = media_probe.load_or_probe(args.input, args.file_hash, args.index_dir)
+        duration, has_audio, frame_rate = index.duration, index.has_audio, index.frame_rate
+        plan = video_processing.build_plan(duration, args.splits, args.basename, args.speed)
+        with open(args.plan, 'w') as f:
+            json.dump([part._asdict() for part in plan], f, indent=2)
+        video_processing.write_github_env({'TOTAL_DURATION': int(duration)})
+
+    video_processing.write_github_env({'PART_COUNT': len(plan)})
+    print(f"📦 {len(plan)} parts, {cores} cores")
+
+    # Encode stage: same core split as encode_parallel, or keyframe chunks for a single long part
+    concurrency, jobs = video_processing.schedule_encodes(plan, cores, args.min_threads)
+    threads_for = {part.index: threads for part, threads in jobs}
+    if args.from_release:
+        # Nothing to encode; the first stage fetches the stored parts instead
+        concurrency = args.release_concurrency
+    encode_pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    encode_slots = asyncio.Semaphore(max(1, concurrency))
+    single_chunked = index is not None and len(plan) == 1 and video_processing.chunk_count(
+        plan[0].end - plan[0].start, cores, args.min_threads) > 1
+    if single_chunked:
+        # The chunks of a single part share all the cores
+        threads_for = {plan[0].index: cores}
+
+    fast, mode_note = False, None
+    if index is not None and args.processing_mode == 'fast':
+        fast, reason = video_processing.fast_path_check(index.streams, frame_rate, args.speed)
+        if fast:
+            mode_note = '- Fast mode: video frames kept, timestamps rescaled'
+            audio_codec = next((stream.get('codec_name') for stream in index.streams
+                                if stream.get('codec_type') == 'audio'), None)
+            print("⚡ Fast mode: rescaling timestamps instead of encoding video")
+        else:
+            mode_note = f'- Fast mode unavailable ({reason}), fully encoded'
+            print(f"⚠️ Fast mode unavailable: {reason}. Falling back to a full encode")
+
+    budget = None
+    if index is not None and args.deadline and not fast:
+        budget = encode_budget.EncodeBudget(plan, args.speed, cores, threads_for, args.deadline,
+                                            args.deadline_share, slowest=args.preset)
+        threads = max(threads_for.values())
+        print(f"🧪 Sample encode with preset {args.preset} ({threads} threads)")
+        output_seconds, wall = await loop.run_in_executor(None, lambda: encode_budget.sample_encode(
+            args.input, index.duration, args.speed, has_audio, args.preset, args.crf, threads, frame_rate,
+            f"{args.basename}.sample.mp4"))
+        budget.observe(output_seconds, threads, args.preset, wall)
+        budget.choose()
+        print(f"🎚️ Preset {budget.preset}: encode estimated at {budget.estimate / 60:.0f} min, "
+              f"budget {(budget.encode_deadline - time.time()) / 60:.0f} min")
+
+    async def encode(part):
+        if args.skip_encode:
+            return
+        async with encode_slots:
+            if args.from_release:
+                print(f"📥 Fetching {part.output} from the release")
+                await loop.run_in_executor(encode_pool, github.download_asset, assets[part.output], part.output)
+                return
+            if fast:
+                print(f"⚡ Rescaling part {part.index} ({part.end - part.start:.0f}s source)")
+                await loop.run_in_executor(encode_pool, video_processing.encode_fast,
+                                           args.input, part, args.speed, has_audio, audio_codec)
+                return
+            # Re-checked as each part starts, so later parts can fall back to a faster preset
+            preset = budget.start_part(part) if budget else args.preset
+            print(f"⚡ Encoding part {part.index} ({part.end - part.start:.0f}s source, preset {preset})")
+            started = time.monotonic()
+            if single_chunked:
+                await loop.run_in_executor(encode_pool, lambda: video_processing.encode_chunked(
+                    args.input, part, args.speed, has_audio, preset, args.crf,
+                    cores=cores, min_threads=args.min_threads, frame_rate=frame_rate,
+                    keyframes=index.keyframes_between(part.start, part.end)))
+            else:
+                await loop.run_in_executor(encode_pool, lambda: video_processing.encode_part(
+                    args.input, part, args.speed, has_audio, preset, args.crf,
+                    threads_for[part.index], frame_rate))
+            if budget:
+                budget.finish_part(part, preset, time.monotonic() - started)
+
+    # Longest part first so the critical path starts immediately
+    ordered = [part for part, _ in jobs]
+
+    # Release stage; parts already attached by an earlier run of the same job are skipped
+    notes = '\n'.join(line for line in (args.release_body.rstrip(), mode_note,
+                                         budget.summary() if budget else None) if line)
+    body = release_body(notes, args.job_key, args.video_title, len(plan))
+    release = await loop.run_in_executor(
+        None, github.publish_release, args.release_tag, args.release_name, body
+    )
+    published = {asset['name'] for asset in release.get('assets', [])}
+    print(f"🏷️ Release {args.release_tag} ready ({len(published)} assets already attached)")
+    upload_pool = ThreadPoolExecutor(max_workers=args.release_concurrency + args.youtube_concurrency)
+
+    async def upload_release(part):
+        if os.path.basename(part.output) in published:
+            print(f"♻️ {part.output} is already attached to the release")
+            return
+        print(f"📤 Uploading {part.output} to the release")
+        await loop.run_in_executor(upload_pool, github.upload_asset, release['id'], part.output)
+
+    stages = {'release': (upload_release, args.release_concurrency)}
+
+    # YouTube stage, only when a token was generated
+    access_token = os.getenv('ACCESS_TOKEN')
+    if access_token:
+        async def upload_youtube(part):
+            title, description = part_titles(args.video_title, args.speed, part, len(plan))
+            # The session URI is kept in .upload_state, so a retry resumes from the last acknowledged byte
+            for attempt in range(1, YOUTUBE_ATTEMPTS + 1):
+                print(f"📺 Uploading part {part.index} to YouTube (attempt {attempt})")
+                response = await loop.run_in_executor(
+                    upload_pool, youtube_upload.upload_video, part.output, title, description, access_token
+                )
+                if response:
+                    return
+            raise RuntimeError(f'YouTube upload failed after {YOUTUBE_ATTEMPTS} attempts')
+
+        stages['youtube'] = (upload_youtube, args.youtube_concurrency)
+    else:
+        print("ℹ️ No YouTube access token, skipping YouTube uploads")
+
+    pipeline = StagePipeline(ordered, encode, stages, PartTracker(stages.keys()))
+    try:
+        report = await pipeline.run()
+    finally:
+        encode_pool.shutdown(wait=False)
+        upload_pool.shutdown(wait=False)
+
+    final_notes = notes
+    if budget:
+        report['presets'] = dict(budget.history)
+        # Later parts may have switched preset after the release notes were written
+        final_notes = '\n'.join(line for line in (args.release_body.rstrip(), mode_note, budget.summary()) if line)
+    # Only a run with every stage done marks the YouTube uploads as finished
+    youtube = 'pending' if report['failures'] else ('done' if access_token else 'skipped')
+    final_body = release_body(final_notes, args.job_key, args.video_title, len(plan), youtube)
+    if final_body != body:
+        await loop.run_in_executor(
+            None, github.publish_release, args.release_tag, args.release_name, final_body
+        )
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n⏱️ Pipeline finished in {report['wall_seconds']:.1f}s")
+    for event in sorted(report['events'], key=lambda e: (e['part'], e['started_at'])):
+        print(f"   • Part {event['part']} {event['stage']}: +{event['started_at']:.1f}s → +{event['finished_at']:.1f}s")
+
+    if report['failures']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,165 @@
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+from message_router import MessageRouter
+
+COMMANDS = ['/start', '/help', '/specs', '/auth_youtube', '/workflow_status', '/status']
+STEPS = ['speed', 'split', 'youtube_title', 'github_title']
+# Share of each kind of message in the generated traffic
+DEFAULT_MIX = 'command=0.2,video=0.1,conversation=0.3,chatter=0.4'
+
+
+class FakeDocument:
+    __slots__ = ('mime_type',)
+
+    def __init__(self, mime_type):
+        self.mime_type = mime_type
+
+
+class FakeMessage:
+    __slots__ = ('message', 'document', 'video')
+
+    def __init__(self, text, document=None):
+        self.message = text
+        self.document = document
+        self.video = document
+
+
+class FakeEvent:
+    """The few attributes the routers read from a Telethon NewMessage event."""
+
+    __slots__ = ('message', 'text', 'sender_id', 'video', 'document')
+
+    def __init__(self, message, sender_id):
+        self.message = message
+        self.text = message.message
+        self.sender_id = sender_id
+        self.video = message.video
+        self.document = message.document
+
+
+class FakeSession:
+    __slots__ = ('step', 'waiting_for_auth')
+
+    def __init__(self, step):
+        self.step = step
+        self.waiting_for_auth = False
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        kind, _, share = item.partition('=')
+        mix[kind.strip()] = float(share)
+    return mix
+
+
+def build_traffic(count, users, mix, seed=1):
+    """Messages from `users` senders, half of whom are mid-conversation."""
+    rng = random.Random(seed)
+    sessions = {user: FakeSession(rng.choice(STEPS)) for user in range(0, users, 2)}
+    kinds, weights = zip(*mix.items())
+    events = []
+    for _ in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'command':
+            message = FakeMessage(rng.choice(COMMANDS))
+        elif kind == 'video':
+            message = FakeMessage('', FakeDocument('video/mp4'))
+        elif kind == 'conversation':
+            message = FakeMessage(rng.choice(['01:30:00,02:45:00', 'A talk about things', 'Release title', '']))
+        else:
+            message = FakeMessage('just chatting')
+        sender = rng.choice(list(sessions)) if kind == 'conversation' else rng.randrange(users)
+        events.append(FakeEvent(message, sender))
+    return sessions, events
+
+
+async def handled(*args):
+    pass
+
+
+def catch_all_handlers(sessions):
+    """
+    The previous layout: one handler per command with its own pattern, a video
+    filter, and a catch-all text handler, all evaluated for every message the
+    way Telethon checks each registered event builder.
+    """
+    patterns = [(re.compile(command).match, handled) for command in COMMANDS]
+    is_video = lambda e: e.video or (
+        e.document and e.document.mime_type and 'video' in str(e.document.mime_type).lower()
+    )
+
+    async def text_handler(event):
+        session = sessions.get(event.sender_id)
+        if session is None:
+            return
+        text = event.text.strip()
+        if session.waiting_for_auth and len(text) > 20 and ' ' not in text:
+            return
+        if session.step == 'split':
+            # The old validator went through re's pattern cache on every call
+            re.match(r'^(\d{1,2}:\d{2}:\d{2})(,\d{1,2}:\d{2}:\d{2})*$', text)
+
+    async def dispatch(event):
+        for match, handler in patterns:
+            if match(event.text):
+                await handler(event)
+        if is_video(event):
+            await handled(event)
+        await text_handler(event)
+    return dispatch
+
+
+def single_router(sessions):
+    router = MessageRouter(sessions, video=handled, auth=handled)
+    for command in COMMANDS:
+        router.command(command, handled)
+    for step in STEPS[1:]:
+        router.state(step, handled)
+    return router.dispatch
+
+
+async def measure(dispatch, events, repeat):
+    """Best of `repeat` passes over the traffic, in nanoseconds per message."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        for event in events:
+            await dispatch(event)
+        elapsed = time.perf_counter_ns() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-message dispatch cost of the NewMessage routing')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Traffic shares by message kind')
+    parser.add_argument('--repeat', type=int, default=5, help='Passes per router; the fastest is kept')
+    parser.add_argument('--output', default=None, help='Also write the results as JSON')
+    args = parser.parse_args()
+
+    sessions, events = build_traffic(args.messages, args.users, parse_mix(args.mix))
+    results = {}
+    for name, build in (('catch_all', catch_all_handlers), ('router', single_router)):
+        ns = asyncio.run(measure(build(sessions), events, args.repeat))
+        results[name] = {'ns_per_message': round(ns, 1), 'messages_per_second': round(1e9 / ns)}
+        print(f"⏱️ {name}: {ns / 1000:.2f} µs per message, {1e9 / ns:,.0f} messages/s")
+
+    speedup = results['catch_all']['ns_per_message'] / results['router']['ns_per_message']
+    print(f"📊 Router is {speedup:.1f}x the catch-all throughput over {args.messages} messages")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'messages': args.messages, 'users': args.users, 'mix': args.mix, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
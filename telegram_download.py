@@ -0,0 +1,938 @@
+import asyncio
+import sys
+import json
+import os
+import time
+import struct
+import copy
+import hashlib
+import argparse
+import tempfile
+from telethon import TelegramClient, errors
+from telethon.sessions import StringSession
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.help import GetNearestDcRequest
+from telethon.tl.functions.upload import GetFileRequest, GetFileHashesRequest
+from telethon.tl.types import InputDocumentFileLocation
+import media_probe
+import encode_budget
+import video_processing
+
+# Telegram requires limit % 4096 == 0, 1 MiB % limit == 0, and a request must not cross a 1 MiB boundary
+MAX_PART_SIZE = 1024 * 1024
+DEFAULT_PART_SIZE = 512 * 1024
+MIN_PART_SIZE = 128 * 1024
+# upload.getFileHashes covers the file in chunks of this size, so verified parts cannot be smaller
+HASH_CHUNK_SIZE = 128 * 1024
+# Auto part size: what one runner's link can pull, used to size requests against the DC's round trip
+LINK_BYTES_PER_S = float(os.getenv('TELEGRAM_LINK_MB_S', 80)) * 1024 * 1024
+RTT_SAMPLES = 3
+DEFAULT_CONNECTIONS = int(os.getenv('TELEGRAM_DOWNLOAD_CONNECTIONS', 8))
+DEFAULT_PARTS_IN_FLIGHT = int(os.getenv('TELEGRAM_DOWNLOAD_PARTS_IN_FLIGHT', 16))
+PART_RETRIES = 5
+# Streaming mode keeps at most this much downloaded data waiting for ffmpeg
+DEFAULT_STREAM_BUFFER_MB = int(os.getenv('TELEGRAM_STREAM_BUFFER_MB', 64))
+# Give up on streaming if the MP4 header (moov) is larger than this
+STREAM_HEAD_LIMIT = 64 * 1024 * 1024
+# Completed parts are made durable and recorded in the sidecar this often
+CHECKPOINT_INTERVAL = float(os.getenv('TELEGRAM_CHECKPOINT_INTERVAL', 5))
+# Reconnect-and-resume rounds before the download gives up
+DOWNLOAD_ROUNDS = int(os.getenv('TELEGRAM_DOWNLOAD_ROUNDS', 6))
+# Errors that mean the connection went bad; local disk errors are not among them
+RESUMABLE_ERRORS = (ConnectionError, asyncio.TimeoutError, errors.ServerError)
+
+
+class PartIntegrityError(RuntimeError):
+    """Raised when a downloaded part does not match its expected length or Telegram's hashes"""
+
+
+class DownloadCheckpoint:
+    """
+    Sidecar next to the output recording which byte ranges are already on disk,
+    with the SHA-256 of every part, so a retried step fetches only what is missing
+    and the file's digest never needs a second read of the data.
+    """
+
+    def __init__(self, output_path, file_id, size, part_size):
+        self.path = f"{output_path}.ckpt"
+        self.output_path = output_path
+        self.file_id = file_id
+        self.size = size
+        self.part_size = part_size
+        self.digests = {}
+
+    def load(self):
+        """Adopt a sidecar left by an earlier attempt at the same file; returns the parts it covers."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            if os.path.getsize(self.output_path) != self.size:
+                return 0
+        except (OSError, ValueError):
+            return 0
+        if (state.get('file_id'), state.get('size'), state.get('part_size')) != (self.file_id, self.size, self.part_size):
+            return 0
+        self.digests = {int(index): digest for index, digest in state.get('digests', {}).items()}
+        return len(self.digests)
+
+    def saved_part_size(self):
+        """Part size of a sidecar for this same file, so an automatic size can match it."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (state.get('file_id'), state.get('size')) != (self.file_id, self.size):
+            return None
+        return state.get('part_size')
+
+    def ranges(self, indexes):
+        """Completed byte ranges as [start, end) pairs, merging neighbouring parts."""
+        ranges = []
+        for index in sorted(indexes):
+            start, end = index * self.part_size, min(self.size, (index + 1) * self.part_size)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def save(self, digests):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'file_id': self.file_id,
+                'size': self.size,
+                'part_size': self.part_size,
+                'ranges': self.ranges(digests),
+                'digests': {str(index): digest for index, digest in digests.items()},
+                'saved_at': int(time.time())
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def tree_digest(digests, part_count):
+    """SHA-256 over the part digests in order; equal for equal files downloaded with the same part size."""
+    outer = hashlib.sha256()
+    for index in range(part_count):
+        outer.update(bytes.fromhex(digests[index]))
+    return outer.hexdigest()
+
+
+def parse_dc_part_sizes(value):
+    """'4:1024,5:512' (DC id : part size in KB) into {4: 1048576, 5: 524288}."""
+    sizes = {}
+    for item in (value or '').split(','):
+        if ':' in item:
+            dc_id, kb = item.split(':', 1)
+            sizes[int(dc_id)] = int(kb) * 1024
+    return sizes
+
+
+# Measured request sizes can be pinned per DC, e.g. TELEGRAM_DC_PART_SIZES=4:1024,5:1024
+DC_PART_SIZES = parse_dc_part_sizes(os.getenv('TELEGRAM_DC_PART_SIZES', ''))
+
+
+def choose_part_size(rtt, parts_in_flight, link_bytes=LINK_BYTES_PER_S):
+    """
+    Smallest valid request size that keeps a round trip's worth of data in flight
+    across all parts. A distant DC needs big requests to fill the link; a near one
+    keeps smaller parts, which make resume and streaming order finer grained.
+    """
+    target = link_bytes * rtt / parts_in_flight
+    size = MIN_PART_SIZE
+    while size < MAX_PART_SIZE and size < target:
+        size *= 2
+    return size
+
+
+class DCConnection:
+    """One MTProto sender connected directly to the DC that stores the file"""
+
+    def __init__(self, client, dc_id, index):
+        self.client = client
+        self.dc_id = dc_id
+        self.index = index
+        self.sender = None
+        self.bytes = 0
+        self.parts = 0
+        self.busy_time = 0.0
+
+    @property
+    def home_dc(self):
+        return self.dc_id == self.client.session.dc_id
+
+    async def connect(self, auth_key=None):
+        """
+        Connect with an authorization key for this DC. Without one, a foreign DC gets
+        a fresh key with our authorization exported onto it; the key is returned so
+        the other connections (and reconnects) can share it instead of exporting again.
+        """
+        dc = await self.client._get_dc(self.dc_id)
+        if auth_key is None and self.home_dc:
+            auth_key = self.client.session.auth_key
+
+        self.sender = MTProtoSender(auth_key, loggers=self.client._log)
+        await self.sender.connect(self.client._connection(
+            dc.ip_address,
+            dc.port,
+            dc.id,
+            loggers=self.client._log,
+            proxy=self.client._proxy,
+            local_addr=self.client._local_addr
+        ))
+
+        if auth_key is None:
+            # Borrow our authorization on the file's DC
+            auth = await self.client(ExportAuthorizationRequest(self.dc_id))
+            query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+        else:
+            query = GetNearestDcRequest()
+        # Every new session declares the layer and client info, home DC included;
+        # a copy, so concurrent connects do not overwrite each other's query
+        init = copy.copy(self.client._init_request)
+        init.query = query
+        await self.sender.send(InvokeWithLayerRequest(LAYER, init))
+        return self.sender.auth_key
+
+    async def round_trip(self, location):
+        """Seconds for the smallest possible file request, as a latency probe."""
+        started = time.monotonic()
+        await self.sender.send(GetFileRequest(location, 0, 4096))
+        return time.monotonic() - started
+
+    async def disconnect(self):
+        if self.sender is not None:
+            await self.sender.disconnect()
+            self.sender = None
+
+    async def fetch(self, location, offset, limit):
+        started = time.monotonic()
+        result = await self.sender.send(GetFileRequest(location, offset, limit))
+        self.busy_time += time.monotonic() - started
+        self.bytes += len(result.bytes)
+        self.parts += 1
+        return result.bytes
+
+    async def fetch_hashes(self, location, offset):
+        """Telegram's SHA-256 of the 128 KB chunks starting at offset."""
+        return await self.sender.send(GetFileHashesRequest(location, offset))
+
+    def throughput(self):
+        return self.bytes / self.busy_time if self.busy_time > 0 else 0.0
+
+
+class ParallelDownloader:
+    """Downloads a document as byte ranges over several MTProto connections"""
+
+    def __init__(self, client, file_info, output_path, connections=DEFAULT_CONNECTIONS,
+                 parts_in_flight=DEFAULT_PARTS_IN_FLIGHT, part_size=DEFAULT_PART_SIZE, verify=False):
+        """part_size=None picks the size per DC when connecting (see choose_part_size)."""
+        if part_size is not None and (part_size % 4096 or MAX_PART_SIZE % part_size):
+            raise ValueError(f"Part size must be a multiple of 4096 that divides 1 MiB, got {part_size}")
+
+        self.client = client
+        self.file_info = file_info
+        self.output_path = output_path
+        self.size = file_info['size']
+        self.dc_id = file_info['dc_id']
+        self.requested_connections = connections
+        self.requested_parts_in_flight = parts_in_flight
+        self.part_size_source = 'fixed' if part_size else 'default'
+        self.rtt = None
+        self.auth_key = None
+        self.verify = verify
+        self.checkpoint = DownloadCheckpoint(output_path, file_info['file_id'], self.size, part_size)
+        self._set_part_size(part_size or DEFAULT_PART_SIZE)
+        self._auto_part_size = part_size is None
+        self.location = InputDocumentFileLocation(
+            id=file_info['file_id'],
+            access_hash=file_info['access_hash'],
+            file_reference=bytes.fromhex(file_info['file_reference']) if file_info['file_reference'] else b'',
+            thumb_size=''
+        )
+        self.downloaded = 0
+        self.senders = []
+        self.digests = {}
+        self.stats = {'resumed_parts': 0, 'rounds': 0, 'reference_refreshes': 0, 'hash_mismatches': 0,
+                      'authorization_exports': 0}
+        self._part_cache = {}
+        self._telegram_hashes = {}
+        self._refresh_lock = asyncio.Lock()
+
+    def _set_part_size(self, part_size):
+        if self.verify and part_size < HASH_CHUNK_SIZE:
+            # Every part has to hold whole hash chunks; 128 KiB still divides 1 MiB
+            print(f"ℹ️ Raising the part size from {part_size // 1024} KB to {HASH_CHUNK_SIZE // 1024} KB "
+                  f"to check parts against Telegram's hashes")
+            part_size = HASH_CHUNK_SIZE
+        self.part_size = part_size
+        self.part_count = (self.size + part_size - 1) // part_size
+        self.connections = max(1, min(self.requested_connections, self.part_count))
+        self.parts_in_flight = max(self.connections, self.requested_parts_in_flight)
+        self.checkpoint.part_size = part_size
+
+    async def _pick_part_size(self, sender):
+        """
+        Request size for this DC: the one a checkpoint was written with, a pinned
+        TELEGRAM_DC_PART_SIZES entry, or one sized from the measured round trip.
+        """
+        saved = self.checkpoint.saved_part_size()
+        if saved:
+            self._set_part_size(saved)
+            self.part_size_source = 'checkpoint'
+            return
+        if self.dc_id in DC_PART_SIZES:
+            self._set_part_size(DC_PART_SIZES[self.dc_id])
+            self.part_size_source = 'pinned'
+            return
+        samples = []
+        for _ in range(RTT_SAMPLES):
+            location = self.location
+            try:
+                samples.append(await sender.round_trip(location))
+            except errors.FileReferenceExpiredError:
+                await self.refresh_reference(location.file_reference)
+        if samples:
+            self.rtt = min(samples)
+            self._set_part_size(choose_part_size(self.rtt, self.requested_parts_in_flight))
+            self.part_size_source = 'measured'
+
+    def _open_output(self):
+        fd = os.open(self.output_path, os.O_RDWR | os.O_CREAT, 0o644)
+        # Reserve the whole file up front so every range can be written in place
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, self.size)
+            except OSError:
+                os.ftruncate(fd, self.size)
+        else:
+            os.ftruncate(fd, self.size)
+        return fd
+
+    async def refresh_reference(self, stale):
+        """
+        File references expire; fetching the original message again returns a fresh
+        one for the same document. Concurrent callers share a single refresh.
+        """
+        async with self._refresh_lock:
+            if self.location.file_reference != stale:
+                return
+            message_id, chat_id = self.file_info.get('original_message_id'), self.file_info.get('chat_id')
+            if not message_id or not chat_id:
+                raise RuntimeError('File reference expired and the metadata has no original message to refresh it from')
+            message = await self.client.get_messages(chat_id, ids=message_id)
+            document = message.document if message else None
+            if document is None or document.id != self.location.id:
+                raise RuntimeError(f'Message {message_id} no longer carries document {self.location.id}')
+            self.location = InputDocumentFileLocation(
+                id=document.id,
+                access_hash=document.access_hash,
+                file_reference=document.file_reference,
+                thumb_size=''
+            )
+            self.stats['reference_refreshes'] += 1
+            print(f"\n🔄 Refreshed the expired file reference from message {message_id}")
+
+    async def _verify_part(self, sender, index, data):
+        """Check a part against the chunk hashes Telegram reports for it."""
+        offset, end = index * self.part_size, index * self.part_size + len(data)
+        position = offset
+        while position < end:
+            if position not in self._telegram_hashes:
+                for file_hash in await sender.fetch_hashes(self.location, position):
+                    self._telegram_hashes[file_hash.offset] = file_hash
+                if position not in self._telegram_hashes:
+                    raise PartIntegrityError(f"Telegram returned no hash for offset {position}")
+            file_hash = self._telegram_hashes.pop(position)
+            chunk = data[position - offset:position - offset + file_hash.limit]
+            if hashlib.sha256(chunk).digest() != file_hash.hash:
+                self.stats['hash_mismatches'] += 1
+                raise PartIntegrityError(f"Part {index} does not match Telegram's hash at offset {position}")
+            position += file_hash.limit
+
+    async def _get_part(self, sender, index):
+        """Fetch one part and check it; returns (data, sha256 hex)."""
+        expected = min(self.part_size, self.size - index * self.part_size)
+        for attempt in range(PART_RETRIES):
+            data = await self._fetch_part(sender, index)
+            try:
+                if len(data) != expected:
+                    raise PartIntegrityError(f"Part {index} returned {len(data)} bytes, expected {expected}")
+                if self.verify:
+                    await self._verify_part(sender, index, data)
+            except PartIntegrityError as e:
+                if attempt == PART_RETRIES - 1:
+                    raise
+                print(f"\n⚠️ {e}, fetching it again")
+                continue
+            return data, hashlib.sha256(data).hexdigest()
+
+    async def _fetch_part(self, sender, index):
+        offset = index * self.part_size
+        for attempt in range(PART_RETRIES):
+            location = self.location
+            try:
+                return await sender.fetch(location, offset, self.part_size)
+            except errors.FloodWaitError as e:
+                print(f"\n⏳ Flood wait on connection {sender.index}: {e.seconds}s")
+                await asyncio.sleep(e.seconds)
+            except errors.FileReferenceExpiredError:
+                await self.refresh_reference(location.file_reference)
+            except (ConnectionError, asyncio.TimeoutError, errors.RPCError) as e:
+                if isinstance(e, errors.RPCError) and e.code not in (None, 500):
+                    raise
+                if attempt == PART_RETRIES - 1:
+                    raise
+                print(f"\n⚠️ Part {index} failed on connection {sender.index} ({e!r}), retrying...")
+                await asyncio.sleep(2 ** attempt)
+        raise RuntimeError(f"Part {index} failed after {PART_RETRIES} attempts")
+
+    async def _worker(self, sender, queue, fd, loop):
+        while True:
+            try:
+                index = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            data, digest = await self._get_part(sender, index)
+            await loop.run_in_executor(None, os.pwrite, fd, data, index * self.part_size)
+            # Recorded only after the write, so a checkpoint never claims a part that is not on disk
+            self.digests[index] = digest
+            self.downloaded += len(data)
+
+    async def _save_checkpoint(self, fd, loop):
+        """Flush the file, then record the parts that were written before the flush."""
+        digests = dict(self.digests)
+        await loop.run_in_executor(None, os.fdatasync, fd)
+        await loop.run_in_executor(None, self.checkpoint.save, digests)
+
+    async def _checkpoint_loop(self, fd, loop):
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            await self._save_checkpoint(fd, loop)
+
+    async def _reconnect(self, attempt):
+        """Reopen the same connections with the same key, keeping their throughput counters."""
+        await self.close()
+        await asyncio.sleep(min(30, 2 ** attempt))
+        await asyncio.gather(*(sender.connect(self.auth_key) for sender in self.senders))
+
+    async def _report_progress(self, start_time):
+        mb_total = self.size / (1024*1024)
+        while True:
+            await asyncio.sleep(2)
+            elapsed = time.monotonic() - start_time
+            mb_current = self.downloaded / (1024*1024)
+            speed = mb_current / elapsed if elapsed > 0 else 0
+            eta = (mb_total - mb_current) / speed if speed > 0 else 0
+            percent = (self.downloaded / self.size) * 100 if self.size else 100
+            print(f"\r📊 Progress: {percent:.1f}% ({mb_current:.1f}/{mb_total:.1f} MB) | Speed: {speed:.1f} MB/s | ETA: {eta:.0f}s", end='')
+
+    async def connect(self):
+        """
+        Open the senders on the file's DC. The first one authorizes (exporting our
+        authorization if the DC is not the session's home) and, with an automatic
+        part size, measures the round trip; the rest reuse its key.
+        """
+        if self.senders:
+            return
+        first = DCConnection(self.client, self.dc_id, 0)
+        self.auth_key = await first.connect()
+        if not first.home_dc:
+            self.stats['authorization_exports'] += 1
+        if self._auto_part_size:
+            await self._pick_part_size(first)
+        where = 'home DC' if first.home_dc else f'foreign DC, session home is DC {self.client.session.dc_id}'
+        rtt = f", {self.rtt * 1000:.0f} ms round trip" if self.rtt is not None else ''
+        print(f"📡 Opening {self.connections} connections to DC {self.dc_id} ({where}{rtt}), "
+              f"{self.part_size // 1024} KB requests ({self.part_size_source})")
+        self.senders = [first] + [DCConnection(self.client, self.dc_id, i) for i in range(1, self.connections)]
+        await asyncio.gather(*(sender.connect(self.auth_key) for sender in self.senders[1:]))
+
+    async def close(self):
+        await asyncio.gather(*(sender.disconnect() for sender in self.senders), return_exceptions=True)
+
+    async def read_range(self, offset, length):
+        """
+        Read an arbitrary byte range through whole cached parts (header inspection and
+        the deadline sample). Missing parts are fetched across all connections, and
+        stream() hands the cached ones on instead of fetching them again.
+        """
+        first = offset // self.part_size
+        last = min(self.part_count - 1, (offset + length - 1) // self.part_size)
+        missing = [index for index in range(first, last + 1) if index not in self._part_cache]
+        slots = asyncio.Semaphore(self.parts_in_flight)
+
+        async def fetch(i, index):
+            async with slots:
+                self._part_cache[index] = await self._fetch_part(self.senders[i % len(self.senders)], index)
+
+        await asyncio.gather(*(fetch(i, index) for i, index in enumerate(missing)))
+        data = b''.join(self._part_cache[index] for index in range(first, last + 1))
+        start = offset - first * self.part_size
+        return data[start:start + length]
+
+    async def stream(self, write, buffer_bytes=DEFAULT_STREAM_BUFFER_MB * 1024 * 1024):
+        """
+        Fetch parts concurrently but hand them to the async `write` callback strictly in order.
+        At most buffer_bytes of fetched data wait for the consumer; a slow consumer stalls fetching.
+        """
+        await self.connect()
+        window = asyncio.Semaphore(max(self.parts_in_flight, buffer_bytes // self.part_size))
+        ready = {}
+        arrived = asyncio.Condition()
+        indexes = iter(range(self.part_count))
+
+        async def fetch(sender):
+            while True:
+                # Slots are taken in index order, so the next part to write always holds one
+                await window.acquire()
+                index = next(indexes, None)
+                if index is None:
+                    window.release()
+                    return
+                if index in self._part_cache:
+                    data = self._part_cache.pop(index)
+                    if self.verify:
+                        await self._verify_part(sender, index, data)
+                    self.digests[index] = hashlib.sha256(data).hexdigest()
+                else:
+                    data, self.digests[index] = await self._get_part(sender, index)
+                async with arrived:
+                    ready[index] = data
+                    arrived.notify_all()
+
+        async def drain():
+            for index in range(self.part_count):
+                async with arrived:
+                    await arrived.wait_for(lambda: index in ready)
+                    data = ready.pop(index)
+                await write(data)
+                self.downloaded += len(data)
+                window.release()
+
+        start_time = time.monotonic()
+        progress = asyncio.ensure_future(self._report_progress(start_time))
+        tasks = [asyncio.ensure_future(drain())] + [
+            asyncio.ensure_future(fetch(self.senders[i % self.connections]))
+            for i in range(self.parts_in_flight)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            progress.cancel()
+            for task in tasks:
+                task.cancel()
+
+        return time.monotonic() - start_time
+
+    async def download(self):
+        """
+        Download every part not already recorded in the checkpoint sidecar. A dropped
+        connection reconnects and resumes with the parts still missing; the sidecar
+        lets a retried step do the same.
+        """
+        loop = asyncio.get_running_loop()
+        # The part size may depend on the DC, so it is settled before the checkpoint is read
+        await self.connect()
+        resumed = self.checkpoint.load()
+        if resumed:
+            self.digests = dict(self.checkpoint.digests)
+            self.downloaded = sum(min(self.part_size, self.size - index * self.part_size) for index in self.digests)
+            self.stats['resumed_parts'] = resumed
+            print(f"♻️ Resuming from checkpoint: {resumed}/{self.part_count} parts "
+                  f"({self.downloaded / (1024*1024):.1f} MB) already on disk")
+        fd = self._open_output()
+
+        # Parts already fetched while inspecting the header go straight to disk
+        for index, data in self._part_cache.items():
+            if index not in self.digests:
+                if self.verify:
+                    await self._verify_part(self.senders[0], index, data)
+                os.pwrite(fd, data, index * self.part_size)
+                self.digests[index] = hashlib.sha256(data).hexdigest()
+                self.downloaded += len(data)
+        self._part_cache.clear()
+
+        start_time = time.monotonic()
+        progress = asyncio.ensure_future(self._report_progress(start_time))
+        checkpoints = asyncio.ensure_future(self._checkpoint_loop(fd, loop))
+
+        print(f"📥 Downloading {self.part_count - len(self.digests)} parts of {self.part_size // 1024} KB, "
+              f"{self.parts_in_flight} in flight")
+        try:
+            for attempt in range(DOWNLOAD_ROUNDS):
+                self.stats['rounds'] = attempt + 1
+                queue = asyncio.Queue()
+                for index in range(self.part_count):
+                    if index not in self.digests:
+                        queue.put_nowait(index)
+                if queue.empty():
+                    break
+
+                await self.connect()
+                workers = [
+                    asyncio.ensure_future(self._worker(self.senders[i % self.connections], queue, fd, loop))
+                    for i in range(self.parts_in_flight)
+                ]
+                try:
+                    await asyncio.gather(*workers)
+                    break
+                except RESUMABLE_ERRORS as e:
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    await self._save_checkpoint(fd, loop)
+                    if attempt == DOWNLOAD_ROUNDS - 1:
+                        raise
+                    print(f"\n⚠️ Download interrupted ({e!r}) with {len(self.digests)}/{self.part_count} parts done, "
+                          f"reconnecting to resume")
+                    await self._reconnect(attempt)
+            os.fsync(fd)
+        except BaseException:
+            # Whatever happened, keep what we have for the next attempt
+            try:
+                await self._save_checkpoint(fd, loop)
+            except Exception:
+                pass
+            raise
+        finally:
+            progress.cancel()
+            checkpoints.cancel()
+            os.close(fd)
+
+        self.checkpoint.clear()
+        elapsed = time.monotonic() - start_time
+        return elapsed
+
+    def throughput_report(self, elapsed):
+        """Per-connection throughput, used to tune the degree of parallelism."""
+        return {
+            'dc_id': self.dc_id,
+            'home_dc': self.dc_id == self.client.session.dc_id,
+            'rtt_ms': round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            'part_size_source': self.part_size_source,
+            'size': self.size,
+            'elapsed': round(elapsed, 3),
+            'throughput_mb_s': round(self.downloaded / elapsed / (1024*1024), 3) if elapsed > 0 else 0,
+            'connections': self.connections,
+            'parts_in_flight': self.parts_in_flight,
+            'part_size': self.part_size,
+            'sha256_tree': tree_digest(self.digests, self.part_count) if len(self.digests) == self.part_count else None,
+            'verified_with_telegram': self.verify,
+            **self.stats,
+            'per_connection': [
+                {
+                    'connection': sender.index,
+                    'parts': sender.parts,
+                    'bytes': sender.bytes,
+                    'busy_seconds': round(sender.busy_time, 3),
+                    'throughput_mb_s': round(sender.bytes / elapsed / (1024*1024), 3) if elapsed > 0 else 0
+                }
+                for sender in self.senders
+            ]
+        }
+
+
+def print_report(report):
+    print(f"\n📈 Throughput: {report['throughput_mb_s']:.1f} MB/s over {report['elapsed']:.1f}s "
+          f"({report['connections']} connections, {report['parts_in_flight']} parts in flight)")
+    rtt = f", {report['rtt_ms']:.0f} ms round trip" if report['rtt_ms'] is not None else ''
+    print(f"   🌍 DC {report['dc_id']} ({'home' if report['home_dc'] else 'foreign'}{rtt}): "
+          f"{report['throughput_mb_s']:.1f} MB/s with {report['part_size'] // 1024} KB requests "
+          f"({report['part_size_source']}), {report['authorization_exports']} authorization exports")
+    if report['resumed_parts'] or report['rounds'] > 1 or report['reference_refreshes']:
+        print(f"   ♻️ {report['resumed_parts']} parts resumed from checkpoint, {report['rounds']} rounds, "
+              f"{report['reference_refreshes']} file reference refreshes")
+    if report['sha256_tree']:
+        checked = ', checked against Telegram' if report['verified_with_telegram'] else ''
+        print(f"   🔒 SHA-256 tree digest {report['sha256_tree']}{checked}")
+    for conn in report['per_connection']:
+        print(f"   • Connection {conn['connection']}: {conn['parts']} parts, "
+              f"{conn['bytes'] / (1024*1024):.1f} MB, {conn['throughput_mb_s']:.2f} MB/s")
+
+
+def container_type(head):
+    """Rough container sniffing from the first bytes of the file."""
+    if len(head) >= 8 and head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide'):
+        return 'mp4'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return 'matroska'
+    return None
+
+
+async def streamable_head_size(downloader):
+    """
+    Bytes ffmpeg needs before it can decode from a pipe, or None when the file
+    needs random access (MP4 with the moov atom after mdat, or an unknown container).
+    """
+    size = downloader.size
+    kind = container_type(await downloader.read_range(0, 16))
+
+    if kind == 'matroska':
+        return min(size, 4 * 1024 * 1024)
+    if kind != 'mp4':
+        return None
+
+    # Walk the top-level boxes until we meet moov (streamable) or mdat (not)
+    offset = 0
+    while offset + 8 <= size:
+        header = await downloader.read_range(offset, 16)
+        box_size, box_type = struct.unpack('>I4s', header[:8])
+        if box_size == 1:
+            box_size = struct.unpack('>Q', header[8:16])[0]
+        elif box_size == 0:
+            box_size = size - offset
+
+        if box_type == b'moov':
+            end = offset + box_size
+            return min(size, end + downloader.part_size) if end <= STREAM_HEAD_LIMIT else None
+        if box_type == b'mdat' or box_size < 8:
+            return None
+        offset += box_size
+    return None
+
+
+async def sample_preset(downloader, head_size, plan, duration, speed, has_audio, preset, crf, frame_rate,
+                        cores, threads_for, deadline):
+    """
+    Run the deadline budget before streaming: time a sample encode of the first
+    seconds, fetched ahead of the stream, and pick the preset the budget allows.
+    Returns None when even the fastest preset is estimated to overrun.
+    """
+    seconds = min(encode_budget.SAMPLE_SECONDS, duration)
+    # Media data follows the header, at roughly the average bitrate
+    length = min(downloader.size, head_size + int(downloader.size * seconds / duration * 1.25))
+    prefix = await downloader.read_range(0, length)
+    budget = encode_budget.EncodeBudget(plan, speed, cores, threads_for, deadline, slowest=preset)
+    threads = max(threads_for.values())
+    with tempfile.NamedTemporaryFile(suffix='.mp4') as f:
+        f.write(prefix)
+        f.flush()
+        print(f"🧪 Sample encode with preset {preset} ({threads} threads)")
+        sample = lambda: encode_budget.sample_encode(
+            f.name, seconds, speed, has_audio, preset, crf, threads, frame_rate,
+            f"{plan[0].output}.sample.mp4", start=0.0)
+        output_seconds, wall = await asyncio.get_running_loop().run_in_executor(None, sample)
+    budget.observe(output_seconds, threads, preset, wall)
+    chosen = budget.choose()
+    available = budget.encode_deadline - time.time()
+    print(f"🎚️ Preset {chosen}: streamed encode estimated at {budget.estimate / 60:.0f} min, "
+          f"budget {available / 60:.0f} min")
+    return chosen if budget.estimate <= available else None
+
+
+async def stream_into_ffmpeg(downloader, basename, speed, splits, preset, crf,
+                             buffer_bytes=DEFAULT_STREAM_BUFFER_MB * 1024 * 1024, keep_source=False, index=None,
+                             deadline=None):
+    """
+    Pipe the document into ffmpeg while it downloads. Returns (plan, elapsed), or
+    None if the source cannot be read sequentially and must be downloaded first.
+    A media index from an earlier run of the same file replaces the header probe.
+    With a deadline the preset comes from a sample encode, and a job at risk of
+    overrunning is left to download-then-process, which re-picks per part.
+    """
+    await downloader.connect()
+    head_size = await streamable_head_size(downloader)
+    if head_size is None:
+        print("ℹ️ Source needs random access (moov after mdat or unknown container), using download-then-process")
+        return None
+
+    if index is not None:
+        duration, has_audio, frame_rate = index.duration, index.has_audio, index.frame_rate
+    else:
+        # The header alone tells ffprobe the duration, streams and frame rate
+        head = await downloader.read_range(0, head_size)
+        with tempfile.NamedTemporaryFile(suffix='.head') as f:
+            f.write(head)
+            f.flush()
+            try:
+                duration, has_audio, frame_rate = video_processing.probe_media(f.name)
+            except Exception as e:
+                print(f"ℹ️ Could not probe the stream header ({e}), using download-then-process")
+                return None
+
+    plan = video_processing.build_plan(duration, splits, basename, speed)
+    cores = video_processing.available_cores()
+    if len(plan) == 1 and video_processing.chunk_count(duration, cores) > 1:
+        # One x264 cannot use the whole machine; keyframe chunks of the downloaded file can
+        print("ℹ️ A single long part encodes faster in keyframe chunks, using download-then-process")
+        return None
+
+    # Every output encodes at once, so the cores are split between them up front
+    _, jobs = video_processing.schedule_encodes(plan, cores, min_threads=1)
+    threads_for = {part.index: threads for part, threads in jobs}
+    if deadline:
+        chosen = await sample_preset(downloader, head_size, plan, duration, speed, has_audio, preset, crf,
+                                     frame_rate, cores, threads_for, deadline)
+        if chosen is None:
+            print("⚠️ Streamed encode would overrun the job deadline, using download-then-process")
+            return None
+        preset = chosen
+    command = video_processing.build_streaming_command(
+        'pipe:0', plan, speed, has_audio, preset, crf, frame_rate, threads_for
+    )
+    print(f"🌊 Streaming into ffmpeg: {len(plan)} parts, {cores} cores, {buffer_bytes // (1024*1024)} MB buffer")
+
+    loop = asyncio.get_running_loop()
+    process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.PIPE)
+    fd = downloader._open_output() if keep_source else None
+    written = 0
+
+    async def write(data):
+        nonlocal written
+        process.stdin.write(data)
+        await process.stdin.drain()
+        if fd is not None:
+            await loop.run_in_executor(None, os.pwrite, fd, data, written)
+        written += len(data)
+
+    try:
+        elapsed = await downloader.stream(write, buffer_bytes)
+        process.stdin.close()
+        returncode = await process.wait()
+    except BaseException:
+        process.kill()
+        await process.wait()
+        raise
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {returncode} while streaming")
+    return plan, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Download a Telegram document described by metadata.json')
+    parser.add_argument('--metadata', default='metadata.json')
+    parser.add_argument('--output', help='Output path (defaults to the original file name)')
+    parser.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS)
+    parser.add_argument('--parts-in-flight', type=int, default=DEFAULT_PARTS_IN_FLIGHT)
+    parser.add_argument('--part-size', default='auto',
+                        help="Part size in KB, or 'auto' to size requests from the file DC's round trip")
+    parser.add_argument('--report', default='download_report.json', help='Where to write the throughput report')
+    parser.add_argument('--stream', action='store_true',
+                        help='Pipe the download straight into ffmpeg when the container allows it')
+    parser.add_argument('--stream-buffer', type=int, default=DEFAULT_STREAM_BUFFER_MB, help='Stream buffer in MB')
+    parser.add_argument('--keep-source', action='store_true', help='Also write the source to disk while streaming')
+    parser.add_argument('--basename', help='Output base name for streamed parts')
+    parser.add_argument('--speed', help='Playback speed for streamed parts')
+    parser.add_argument('--splits', default='', help='Comma-separated HH:MM:SS split points for streamed parts')
+    parser.add_argument('--preset', default=video_processing.DEFAULT_PRESET)
+    parser.add_argument('--crf', type=int, default=video_processing.DEFAULT_CRF)
+    parser.add_argument('--plan', default='plan.json', help='Where to write the part plan when streaming')
+    parser.add_argument('--deadline', type=float, default=None,
+                        help='Job deadline (epoch seconds); streaming then picks its preset from a sample encode')
+    parser.add_argument('--file-hash', default=None, help='Media index cache key')
+    parser.add_argument('--index-dir', default=media_probe.DEFAULT_INDEX_DIR)
+    parser.add_argument('--verify-hashes', action='store_true',
+                        help="Check every part against Telegram's file hashes while downloading")
+    args = parser.parse_args()
+    if args.stream and not args.speed:
+        parser.error('--stream needs --speed')
+
+    # Read metadata
+    with open(args.metadata, 'r') as f:
+        metadata = json.load(f)
+
+    file_info = metadata['telegram_file']
+    filename = args.output or file_info['file_name']
+
+    # Telegram credentials from GitHub Secrets
+    api_id = int(os.getenv('TELEGRAM_API_ID'))
+    api_hash = os.getenv('TELEGRAM_API_HASH')
+    session_string = os.getenv('TELEGRAM_SESSION_STRING')
+
+    client = TelegramClient(StringSession(session_string), api_id, api_hash)
+    await client.start()
+
+    downloader = ParallelDownloader(
+        client,
+        file_info,
+        filename,
+        connections=args.connections,
+        parts_in_flight=args.parts_in_flight,
+        part_size=None if args.part_size == 'auto' else int(args.part_size) * 1024,
+        verify=args.verify_hashes
+    )
+
+    try:
+        print(f"📥 Downloading: {filename} ({file_info['size']} bytes)")
+        streamed = None
+        if args.stream:
+            index = None
+            if args.file_hash:
+                try:
+                    index = media_probe.MediaIndex.load(media_probe.index_path(args.file_hash, args.index_dir))
+                    if index.size != file_info['size']:
+                        index = None
+                except media_probe.MediaIndexError:
+                    pass
+            streamed = await stream_into_ffmpeg(
+                downloader,
+                args.basename or os.path.splitext(filename)[0],
+                args.speed,
+                args.splits,
+                args.preset,
+                args.crf,
+                buffer_bytes=args.stream_buffer * 1024 * 1024,
+                keep_source=args.keep_source,
+                index=index,
+                deadline=args.deadline
+            )
+
+        if streamed:
+            plan, elapsed = streamed
+            print(f"\n✅ Streamed and processed {len(plan)} parts")
+        else:
+            elapsed = await downloader.download()
+            print(f"\n✅ Download complete: {filename}")
+
+        report = downloader.throughput_report(elapsed)
+        print_report(report)
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        # Verify file size
+        expected_size = file_info['size']
+        actual_size = os.path.getsize(filename) if os.path.exists(filename) else expected_size
+        if downloader.downloaded == expected_size and actual_size == expected_size:
+            print(f"✅ Size verified: {actual_size} bytes")
+        else:
+            print(f"❌ Size mismatch: expected {expected_size}, downloaded {downloader.downloaded}, on disk {actual_size}")
+            sys.exit(1)
+
+        if streamed:
+            missing = [part.output for part in plan
+                       if not os.path.exists(part.output) or os.path.getsize(part.output) == 0]
+            if missing:
+                print(f"❌ Streamed parts missing or empty: {', '.join(missing)}")
+                sys.exit(1)
+            # Only now does the workflow skip the encode stage
+            with open(args.plan, 'w') as f:
+                json.dump([part._asdict() for part in plan], f, indent=2)
+            video_processing.write_github_env({
+                'STREAMED': 'true',
+                'PART_COUNT': len(plan),
+                'TOTAL_DURATION': int(plan[-1].end)
+            })
+
+    finally:
+        await downloader.close()
+        await client.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
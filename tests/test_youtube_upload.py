@@ -0,0 +1,115 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import youtube_upload
+from youtube_upload import ResumableUploader, CHUNK_GRANULARITY
+from upload_standin import UploadStandIn
+
+METADATA = {'snippet': {'title': 'Stand-in test', 'categoryId': '22'}, 'status': {'privacyStatus': 'private'}}
+
+
+class ResumableUploaderTest(unittest.TestCase):
+    """Drives ResumableUploader against the local stand-in with injected faults."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.state_dir = os.path.join(self.tmp, 'state')
+        self.file_path = os.path.join(self.tmp, 'part1.mp4')
+        # Five chunks, the last one short
+        self.content = os.urandom(4 * CHUNK_GRANULARITY + 12345)
+        with open(self.file_path, 'wb') as f:
+            f.write(self.content)
+        self.sleeps = []
+        patcher = mock.patch.object(youtube_upload.time, 'sleep', self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def serve(self, faults=None):
+        server = UploadStandIn(faults=faults).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def uploader(self, server, **kwargs):
+        kwargs.setdefault('backoff_base', 0.01)
+        return ResumableUploader(self.file_path, METADATA, 'token', upload_url=server.upload_url,
+                                 chunk_size=CHUNK_GRANULARITY, state_dir=self.state_dir, **kwargs)
+
+    def stored(self, server):
+        (session,) = server.sessions.values()
+        return bytes(session.data)
+
+    def test_clean_upload(self):
+        server = self.serve()
+        response = self.uploader(server).upload()
+
+        self.assertEqual(response['id'], 'standin-1')
+        self.assertEqual(self.stored(server), self.content)
+        self.assertEqual(server.puts, 5)
+        self.assertEqual(self.sleeps, [])
+
+    def test_short_commit_continues_from_range(self):
+        server = self.serve({2: 'short'})
+        uploader = self.uploader(server)
+        uploader.upload()
+
+        # The server kept half of the second chunk; the 308 Range moved the offset back without a retry
+        self.assertEqual(self.stored(server), self.content)
+        self.assertEqual(server.offsets[2], CHUNK_GRANULARITY + CHUNK_GRANULARITY // 2)
+        self.assertEqual(self.sleeps, [])
+
+    def test_interrupted_chunk_resyncs(self):
+        server = self.serve({3: 'disconnect'})
+        self.uploader(server).upload()
+
+        # Half of chunk 3 survived the drop, so the retry resumes from the Range the status query reported
+        self.assertEqual(self.stored(server), self.content)
+        self.assertEqual(server.offsets[3], 2 * CHUNK_GRANULARITY + CHUNK_GRANULARITY // 2)
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertEqual(server.starts, 1)
+
+    def test_server_errors_back_off(self):
+        server = self.serve({2: 'error', 3: 'error'})
+        self.uploader(server).upload()
+
+        self.assertEqual(self.stored(server), self.content)
+        self.assertEqual(len(self.sleeps), 2)
+        # Exponential: 0.01 * 2**attempt plus up to 0.01 of jitter
+        self.assertTrue(0.01 <= self.sleeps[0] <= 0.02)
+        self.assertTrue(0.02 <= self.sleeps[1] <= 0.03)
+
+    def test_resume_from_saved_session(self):
+        server = self.serve({2: 'disconnect'})
+        first = self.uploader(server, max_retries=0)
+        with self.assertRaises(youtube_upload.RETRY_EXCEPTIONS):
+            first.upload()
+        self.assertTrue(os.path.exists(first.state_path))
+
+        # A new process picks up the persisted session URI instead of opening another session
+        second = self.uploader(server)
+        response = second.upload()
+
+        self.assertEqual(response['id'], 'standin-1')
+        self.assertEqual(server.starts, 1)
+        self.assertEqual(server.offsets[2], CHUNK_GRANULARITY + CHUNK_GRANULARITY // 2)
+        self.assertEqual(self.stored(server), self.content)
+        self.assertFalse(os.path.exists(second.state_path))
+
+    def test_local_file_errors_are_not_retried(self):
+        server = self.serve()
+        uploader = self.uploader(server)
+        os.remove(self.file_path)
+
+        with self.assertRaises(FileNotFoundError):
+            uploader.upload()
+        self.assertEqual(self.sleeps, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import json
+import argparse
+import threading
+from itertools import count
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class UploadSession:
+    def __init__(self, session_id, size, metadata):
+        self.session_id = session_id
+        self.size = size
+        self.metadata = metadata
+        self.data = bytearray()
+        self.complete = False
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _progress(self, session):
+        """308 with the committed range, or the finished video resource."""
+        if session.complete:
+            body = json.dumps({'id': f"standin-{session.session_id}", **session.metadata}).encode()
+            return self._reply(200, body, {'Content-Type': 'application/json'})
+        headers = {'Range': f"bytes=0-{len(session.data) - 1}"} if session.data else {}
+        return self._reply(308, headers=headers)
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        body = self._read_body()
+        if 'uploadType=resumable' not in parts.query:
+            return self._reply(400, b'only resumable uploads are supported')
+        server = self.server
+        with server.lock:
+            session_id = next(server.ids)
+            server.sessions[session_id] = UploadSession(
+                session_id, int(self.headers['X-Upload-Content-Length']), json.loads(body or b'{}')
+            )
+            server.starts += 1
+        host, port = server.server_address[:2]
+        self._reply(200, headers={'Location': f"http://{host}:{port}/session/{session_id}"})
+
+    def do_PUT(self):
+        server = self.server
+        try:
+            session = server.sessions[int(self.path.rsplit('/', 1)[1])]
+        except (KeyError, ValueError):
+            self._read_body()
+            return self._reply(404, b'no such session')
+
+        content_range = self.headers.get('Content-Range', '')
+        # "bytes */N" asks for the committed range without sending data
+        if content_range.startswith('bytes */'):
+            self._read_body()
+            return self._progress(session)
+
+        with server.lock:
+            server.puts += 1
+            fault = server.faults.get(server.puts)
+
+        if fault == 'error':
+            self._read_body()
+            return self._reply(503, b'backend error')
+        span, _, _ = content_range[len('bytes '):].partition('/')
+        start = int(span.split('-')[0])
+        length = int(self.headers['Content-Length'])
+        with server.lock:
+            server.offsets.append(start)
+        if fault == 'disconnect':
+            # Keep half the chunk, then drop the connection before answering
+            received = self.rfile.read(length // 2)
+            self._store(session, start, received)
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        received = self.rfile.read(length)
+        if fault == 'short':
+            # Commit only part of the chunk, as the real service may
+            received = received[:len(received) // 2]
+        self._store(session, start, received)
+        self._progress(session)
+
+    @staticmethod
+    def _store(session, start, data):
+        # Data past what is committed would leave a hole, so it is ignored like the real service does
+        if start <= len(session.data):
+            session.data[start:start + len(data)] = data
+        session.complete = len(session.data) >= session.size
+
+
+class UploadStandIn(ThreadingHTTPServer):
+    """
+    Local server speaking the resumable upload protocol (session start, chunked
+    PUTs answered with 308 and a Range header, committed-range queries), for
+    exercising youtube_upload without Google. faults maps the n-th data PUT
+    (1-based) to 'error' (503), 'disconnect' (keep half, drop the connection)
+    or 'short' (commit half and report it in Range).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), faults=None, verbose=False):
+        super().__init__(address, StandInHandler)
+        self.faults = dict(faults or {})
+        self.verbose = verbose
+        self.sessions = {}
+        self.ids = count(1)
+        self.lock = threading.Lock()
+        self.starts = 0
+        self.puts = 0
+        # Content-Range start of every data PUT that got past fault injection
+        self.offsets = []
+        self._thread = None
+
+    @property
+    def upload_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/upload/youtube/v3/videos"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the resumable upload endpoint')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--fault', action='append', default=[],
+                        help="Inject a fault on a data PUT, e.g. 3=disconnect, 5=error, 2=short")
+    args = parser.parse_args()
+    faults = {int(put): kind for put, kind in (item.split('=', 1) for item in args.fault)}
+
+    server = UploadStandIn(('127.0.0.1', args.port), faults, verbose=True)
+    print(f"🧪 Upload stand-in at {server.upload_url} (use youtube_upload.py --upload-url)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
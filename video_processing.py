@@ -0,0 +1,564 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import media_probe
+
+PartPlan = namedtuple('PartPlan', ['index', 'start', 'end', 'output'])
+
+DEFAULT_PRESET = 'medium'
+DEFAULT_CRF = 23
+AUDIO_BITRATE = '128k'
+# x264 stops scaling well past a handful of threads per process, so prefer more processes
+MIN_THREADS_PER_ENCODE = int(os.getenv('ENCODE_MIN_THREADS', 4))
+# Chunked encoding only pays off when every chunk is long enough to amortise process start-up
+CHUNK_MIN_SECONDS = int(os.getenv('ENCODE_CHUNK_MIN_SECONDS', 120))
+# Fast mode keeps the source frames, so the output frame rate is the source rate times the speed
+FAST_MAX_FPS = float(os.getenv('FAST_MAX_FPS', 60))
+FAST_MIN_FPS = float(os.getenv('FAST_MIN_FPS', 10))
+FAST_VIDEO_CODECS = {'h264', 'hevc', 'av1'}
+FAST_COPY_AUDIO_CODECS = {'aac', 'mp3'}
+
+
+def parse_timestamp(timestamp):
+    """Convert HH:MM:SS (or MM:SS / SS) into seconds."""
+    seconds = 0.0
+    for field in timestamp.strip().split(':'):
+        seconds = seconds * 60 + float(field or 0)
+    return seconds
+
+
+def parse_split_timestamps(split_timestamps):
+    """Parse the comma-separated split input into sorted, de-duplicated seconds."""
+    if not split_timestamps or not split_timestamps.strip():
+        return []
+    return sorted({parse_timestamp(ts) for ts in split_timestamps.split(',') if ts.strip()})
+
+
+def probe_media(path):
+    """Return (duration, has_audio, frame_rate) for a media file using ffprobe."""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration:stream=codec_type,r_frame_rate',
+         '-of', 'json', path],
+        capture_output=True, text=True, check=True
+    )
+    info = json.loads(result.stdout)
+    duration = float(info['format']['duration'])
+    streams = info.get('streams', [])
+    has_audio = any(stream.get('codec_type') == 'audio' for stream in streams)
+    frame_rate = next(
+        (stream['r_frame_rate'] for stream in streams
+         if stream.get('codec_type') == 'video' and stream.get('r_frame_rate', '0/0') != '0/0'),
+        '25/1'
+    )
+    return duration, has_audio, frame_rate
+
+
+def probe_keyframes(path):
+    """Presentation times of every video keyframe, read from packet flags without decoding."""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+         '-of', 'csv=print_section=0', path],
+        capture_output=True, text=True, check=True
+    )
+    keyframes = []
+    for line in result.stdout.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) >= 2 and 'K' in fields[-1] and fields[0] not in ('', 'N/A'):
+            keyframes.append(float(fields[0]))
+    return sorted(keyframes)
+
+
+def probe_frame_rate(path):
+    """Video frame rate as an exact fraction string such as '30000/1001'."""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=r_frame_rate',
+         '-of', 'csv=print_section=0', path],
+        capture_output=True, text=True, check=True
+    )
+    return result.stdout.strip().split(',')[0] or '25/1'
+
+
+def frame_rate_value(rate):
+    numerator, _, denominator = rate.partition('/')
+    return float(numerator) / float(denominator or 1)
+
+
+def atempo_chain(speed):
+    """Build an atempo filter chain, keeping every stage inside atempo's 0.5-2.0 range."""
+    filters = []
+    remaining = float(speed)
+    while remaining > 2.0:
+        filters.append('atempo=2.0')
+        remaining /= 2.0
+    while remaining < 0.5:
+        filters.append('atempo=0.5')
+        remaining /= 0.5
+    filters.append(f'atempo={remaining:.6g}')
+    return ','.join(filters)
+
+
+def part_filename(basename, index, speed_label):
+    return f"{basename}_part{index}_{speed_label}x.mp4"
+
+
+def build_plan(duration, split_timestamps, basename, speed_label):
+    """One PartPlan per non-empty [start, end) range between the split points."""
+    points = [0.0] + [t for t in parse_split_timestamps(split_timestamps) if 0 < t < duration] + [duration]
+    plan = []
+    for start, end in zip(points, points[1:]):
+        if end > start:
+            index = len(plan) + 1
+            plan.append(PartPlan(index, start, end, part_filename(basename, index, speed_label)))
+    return plan
+
+
+def available_cores():
+    """Cores this process may run on, honouring CPU affinity where supported."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def build_encode_command(source, part, speed, has_audio=True, preset=DEFAULT_PRESET, crf=DEFAULT_CRF,
+                         threads=None, frame_rate=None):
+    """
+    ffmpeg command that cuts and speed-adjusts one part in a single pass.
+    Seeking on the input side jumps straight to the part instead of demuxing from
+    the start, and because the video is re-encoded the cut is frame accurate.
+    """
+    speed = float(speed)
+    # setpts drops the stream's frame rate, so pin the source rate or the muxer falls back to 25 fps
+    rate_filter = f",fps={frame_rate}" if frame_rate else ""
+    filters = f"[0:v]setpts=PTS/{speed:.6g}{rate_filter}[v]"
+    maps = ['-map', '[v]']
+    if has_audio:
+        filters += f";[0:a]{atempo_chain(speed)}[a]"
+        maps += ['-map', '[a]']
+
+    command = ['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y']
+    if threads:
+        command += ['-filter_complex_threads', str(threads)]
+    command += [
+        '-ss', f'{part.start:.3f}', '-t', f'{part.end - part.start:.3f}',
+        '-i', source,
+        '-filter_complex', filters,
+        *maps,
+        '-c:v', 'libx264', '-preset', preset, '-crf', str(crf)
+    ]
+    if threads:
+        command += ['-threads', str(threads)]
+    if has_audio:
+        command += ['-c:a', 'aac', '-b:a', AUDIO_BITRATE]
+    command += ['-movflags', '+faststart', part.output]
+    return command
+
+
+def build_streaming_command(source, plan, speed, has_audio=True, preset=DEFAULT_PRESET, crf=DEFAULT_CRF,
+                            frame_rate=None, threads_for=None):
+    """
+    One ffmpeg process that reads the source sequentially (e.g. from a pipe while it
+    is still downloading) and writes every sped-up part at once. Parts are cut with
+    trim/atrim on the single decode instead of seeking, which a pipe cannot do.
+    threads_for maps part index to encoder threads, since every output encodes at once.
+    """
+    speed = float(speed)
+    count = len(plan)
+    rate_filter = f",fps={frame_rate}" if frame_rate else ""
+    graph = ["[0:v]split=" + str(count) + "".join(f"[v{i}]" for i in range(count))]
+    if has_audio:
+        graph.append("[0:a]asplit=" + str(count) + "".join(f"[a{i}]" for i in range(count)))
+
+    for i, part in enumerate(plan):
+        # The last part runs to the end of the stream whatever the header claimed
+        end = f":end={part.end:.6f}" if i < count - 1 else ""
+        graph.append(f"[v{i}]trim=start={part.start:.6f}{end},setpts=(PTS-STARTPTS)/{speed:.6g}{rate_filter}[vo{i}]")
+        if has_audio:
+            graph.append(f"[a{i}]atrim=start={part.start:.6f}{end},asetpts=PTS-STARTPTS,{atempo_chain(speed)}[ao{i}]")
+
+    command = [
+        'ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+        '-i', source,
+        '-filter_complex', ';'.join(graph)
+    ]
+    for i, part in enumerate(plan):
+        command += ['-map', f'[vo{i}]']
+        if has_audio:
+            command += ['-map', f'[ao{i}]', '-c:a', 'aac', '-b:a', AUDIO_BITRATE]
+        command += ['-c:v', 'libx264', '-preset', preset, '-crf', str(crf)]
+        if threads_for:
+            command += ['-threads', str(threads_for[part.index])]
+        command += ['-movflags', '+faststart', part.output]
+    return command
+
+
+def encode_part(source, part, speed, has_audio=True, preset=DEFAULT_PRESET, crf=DEFAULT_CRF, threads=None,
+                frame_rate=None):
+    """Encode one part and return the wall time it took."""
+    command = build_encode_command(source, part, speed, has_audio, preset, crf, threads, frame_rate)
+    started = time.monotonic()
+    subprocess.run(command, check=True)
+    return time.monotonic() - started
+
+
+def fast_path_check(streams, frame_rate, speed):
+    """
+    Whether a part can skip the video encode: (True, None) or (False, reason).
+    Rescaled timestamps multiply the frame rate, and players and YouTube choke on
+    rates far outside the usual range, so those go through a full encode instead.
+    """
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    if video is None:
+        return False, 'no video stream'
+    if video.get('codec_name') not in FAST_VIDEO_CODECS:
+        return False, f"{video.get('codec_name')} video cannot be copied into MP4"
+    fps = frame_rate_value(frame_rate) * float(speed)
+    if fps > FAST_MAX_FPS:
+        return False, f"{fps:.0f} fps output is above the {FAST_MAX_FPS:.0f} fps limit"
+    if fps < FAST_MIN_FPS:
+        return False, f"{fps:.0f} fps output is below the {FAST_MIN_FPS:.0f} fps limit"
+    return True, None
+
+
+def build_fast_commands(source, part, speed, has_audio=True, audio_codec=None):
+    """
+    ffmpeg commands for a part without re-encoding video. The part is cut with
+    stream copy (so it starts on the keyframe at or before part.start); for any
+    speed other than 1.0 a second pass rescales the video timestamps with
+    -itsscale and runs only the audio through atempo.
+    """
+    speed = float(speed)
+    cut = part.output if speed == 1.0 else f"{part.output}.cut.mp4"
+    # Only these go into MP4 as they are; anything else (Vorbis, PCM...) is made AAC in the cut pass
+    copy_audio = audio_codec in FAST_COPY_AUDIO_CODECS
+    command = [
+        'ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+        '-ss', f'{part.start:.3f}', '-t', f'{part.end - part.start:.3f}',
+        '-i', source,
+        '-map', '0:v:0', '-c:v', 'copy'
+    ]
+    if has_audio:
+        command += ['-map', '0:a:0'] + (['-c:a', 'copy'] if copy_audio else ['-c:a', 'aac', '-b:a', AUDIO_BITRATE])
+    command += ['-avoid_negative_ts', 'make_zero', '-movflags', '+faststart', cut]
+    commands = [command]
+
+    if speed != 1.0:
+        rescale = [
+            'ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+            '-itsscale', f'{1 / speed:.9g}', '-i', cut
+        ]
+        if has_audio:
+            rescale += ['-i', cut, '-map', '0:v:0', '-map', '1:a:0',
+                        '-af', atempo_chain(speed), '-c:a', 'aac', '-b:a', AUDIO_BITRATE]
+        else:
+            rescale += ['-map', '0:v:0']
+        rescale += ['-c:v', 'copy', '-movflags', '+faststart', part.output]
+        commands.append(rescale)
+    return commands
+
+
+def encode_fast(source, part, speed, has_audio=True, audio_codec=None):
+    """Run build_fast_commands() for one part and return the wall time it took."""
+    started = time.monotonic()
+    commands = build_fast_commands(source, part, speed, has_audio, audio_codec)
+    try:
+        for command in commands:
+            subprocess.run(command, check=True)
+    finally:
+        cut = f"{part.output}.cut.mp4"
+        if os.path.exists(cut):
+            os.remove(cut)
+    return time.monotonic() - started
+
+
+def schedule_encodes(plan, cores, min_threads=MIN_THREADS_PER_ENCODE):
+    """
+    Split the cores between concurrent ffmpeg processes.
+    Returns (concurrency, [(part, threads), ...]) ordered longest part first, so the
+    longest encode starts immediately and the short ones fill in around it.
+    """
+    if not plan:
+        return 0, []
+    concurrency = max(1, min(len(plan), cores // max(1, min_threads)))
+    base, extra = divmod(cores, concurrency)
+    ordered = sorted(plan, key=lambda part: part.end - part.start, reverse=True)
+    # Leftover cores go to the longest parts
+    return concurrency, [(part, base + (1 if i < extra else 0)) for i, part in enumerate(ordered)]
+
+
+def encode_parallel(source, plan, speed, has_audio=True, preset=DEFAULT_PRESET, crf=DEFAULT_CRF,
+                    cores=None, min_threads=MIN_THREADS_PER_ENCODE, frame_rate=None):
+    """
+    Encode all parts concurrently. Each pool thread only waits on its own ffmpeg
+    process, so the encoders themselves run as separate processes.
+    Returns a timing report.
+    """
+    cores = cores or available_cores()
+    concurrency, jobs = schedule_encodes(plan, cores, min_threads)
+    print(f"🧮 {cores} cores: {concurrency} concurrent encodes, longest part first")
+
+    started = time.monotonic()
+    timings = []
+
+    def run(part, threads):
+        queued = time.monotonic() - started
+        print(f"⚡ Part {part.index}: {part.start:.3f}s to {part.end:.3f}s at {speed}x ({threads} threads)")
+        wall = encode_part(source, part, speed, has_audio, preset, crf, threads, frame_rate)
+        return {
+            'index': part.index,
+            'output': part.output,
+            'source_seconds': round(part.end - part.start, 3),
+            'threads': threads,
+            'started_at': round(queued, 3),
+            'wall_seconds': round(wall, 3),
+            'realtime_factor': round((part.end - part.start) / wall, 2) if wall > 0 else None
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run, part, threads) for part, threads in jobs]
+        for future in as_completed(futures):
+            timing = future.result()
+            timings.append(timing)
+            print(f"✅ {timing['output']} in {timing['wall_seconds']:.1f}s ({timing['realtime_factor']}x realtime)")
+
+    total = time.monotonic() - started
+    return {
+        'cores': cores,
+        'concurrency': concurrency,
+        'preset': preset,
+        'crf': crf,
+        'wall_seconds': round(total, 3),
+        'sum_part_seconds': round(sum(t['wall_seconds'] for t in timings), 3),
+        'parts': sorted(timings, key=lambda t: t['index'])
+    }
+
+
+def print_timing_report(report):
+    print(f"\n⏱️ Encoded {len(report['parts'])} parts in {report['wall_seconds']:.1f}s "
+          f"(serial sum {report['sum_part_seconds']:.1f}s, {report['concurrency']} at a time on {report['cores']} cores)")
+    for timing in report['parts']:
+        print(f"   • Part {timing['index']}: {timing['source_seconds']:.0f}s source, {timing['threads']} threads, "
+              f"started +{timing['started_at']:.1f}s, took {timing['wall_seconds']:.1f}s")
+
+
+def chunk_count(duration, cores, min_threads=MIN_THREADS_PER_ENCODE, min_chunk_seconds=CHUNK_MIN_SECONDS):
+    """One chunk per encoder slot, but never chunks shorter than min_chunk_seconds."""
+    slots = max(1, cores // max(1, min_threads))
+    return max(1, min(slots, int(duration // max(1, min_chunk_seconds))))
+
+
+def plan_chunks(keyframes, start, end, count):
+    """
+    Cut [start, end) into up to `count` balanced chunks whose inner boundaries
+    sit on keyframes, so every chunk decodes independently of its neighbours.
+    """
+    inner = [t for t in keyframes if start < t < end]
+    boundaries = [start]
+    for i in range(1, count):
+        if not inner:
+            break
+        target = start + (end - start) * i / count
+        nearest = min(inner, key=lambda t: abs(t - target))
+        if nearest > boundaries[-1]:
+            boundaries.append(nearest)
+    boundaries.append(end)
+    # Round once so neighbouring chunks share exactly the same seam
+    boundaries = [round(t, 6) for t in boundaries]
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def encode_chunked(source, part, speed, has_audio=True, preset=DEFAULT_PRESET, crf=DEFAULT_CRF,
+                   cores=None, min_threads=MIN_THREADS_PER_ENCODE, min_chunk_seconds=CHUNK_MIN_SECONDS,
+                   frame_rate=None, keyframes=None):
+    """
+    Encode one long part as keyframe-aligned video chunks in parallel, then join
+    them with the concat demuxer without re-encoding. Audio is tempo-adjusted in a
+    single continuous pass alongside the chunks and muxed in at the end, so there
+    are no encoder-priming gaps and timestamps stay continuous across seams.
+    Returns a timing report in the same shape as encode_parallel().
+    Pass keyframes from a media index to skip the packet scan.
+    """
+    cores = cores or available_cores()
+    count = chunk_count(part.end - part.start, cores, min_threads, min_chunk_seconds)
+    chunks = []
+    if count > 1:
+        if keyframes is None:
+            keyframes = probe_keyframes(source)
+        chunks = plan_chunks(keyframes, part.start, part.end, count)
+
+    if len(chunks) < 2:
+        return encode_parallel(source, [part], speed, has_audio, preset, crf, cores, min_threads, frame_rate)
+
+    speed = float(speed)
+    frame_rate = frame_rate or probe_frame_rate(source)
+    fps = frame_rate_value(frame_rate)
+    concurrency = min(len(chunks), max(1, cores // max(1, min_threads)))
+    threads = max(1, cores // concurrency)
+    work_dir = f"{part.output}.chunks"
+    os.makedirs(work_dir, exist_ok=True)
+    print(f"🧩 Part {part.index}: {len(chunks)} keyframe-aligned chunks, {concurrency} at a time ({threads} threads each)")
+
+    started = time.monotonic()
+
+    def output_frames(t):
+        # Frames of the single-pass output that fall before source time t
+        return round((t - part.start) / speed * fps)
+
+    def run_chunk(number, chunk_start, chunk_end):
+        output = os.path.join(work_dir, f"chunk_{number:03d}.mp4")
+        # Every chunk lands on the same constant-rate grid as a single-pass encode and
+        # emits exactly its share of frames, so seams neither drop nor repeat a frame.
+        frames = output_frames(chunk_end) - output_frames(chunk_start)
+        command = [
+            'ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+            '-filter_threads', str(threads),
+            '-ss', f'{chunk_start:.6f}', '-t', f'{chunk_end - chunk_start:.6f}',
+            '-i', source,
+            '-map', '0:v:0', '-an',
+            '-vf', f'setpts=PTS/{speed:.6g},fps={frame_rate},tpad=stop_mode=clone:stop=2',
+            '-frames:v', str(frames),
+            '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-threads', str(threads),
+            output
+        ]
+        chunk_started = time.monotonic()
+        subprocess.run(command, check=True)
+        return {
+            'chunk': number,
+            'start': chunk_start,
+            'end': chunk_end,
+            'started_at': round(chunk_started - started, 3),
+            'wall_seconds': round(time.monotonic() - chunk_started, 3)
+        }
+
+    def run_audio():
+        output = os.path.join(work_dir, 'audio.m4a')
+        command = [
+            'ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+            '-ss', f'{part.start:.6f}', '-t', f'{part.end - part.start:.6f}',
+            '-i', source,
+            '-map', '0:a:0', '-vn',
+            '-af', atempo_chain(speed),
+            '-c:a', 'aac', '-b:a', AUDIO_BITRATE,
+            output
+        ]
+        subprocess.run(command, check=True)
+        return output
+
+    try:
+        # One extra worker keeps the (cheap) continuous audio pass off the chunk slots
+        with ThreadPoolExecutor(max_workers=concurrency + 1) as pool:
+            audio_future = pool.submit(run_audio) if has_audio else None
+            ordered = sorted(enumerate(chunks), key=lambda item: item[1][1] - item[1][0], reverse=True)
+            futures = [pool.submit(run_chunk, number, cs, ce) for number, (cs, ce) in ordered]
+            chunk_timings = sorted((future.result() for future in futures), key=lambda t: t['chunk'])
+            audio_path = audio_future.result() if audio_future else None
+
+        list_path = os.path.join(work_dir, 'chunks.txt')
+        with open(list_path, 'w') as f:
+            for timing in chunk_timings:
+                f.write(f"file 'chunk_{timing['chunk']:03d}.mp4'\n")
+
+        command = ['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+                   '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_path:
+            command += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0']
+        command += ['-c', 'copy', '-movflags', '+faststart', part.output]
+        subprocess.run(command, check=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    wall = time.monotonic() - started
+    return {
+        'cores': cores,
+        'concurrency': concurrency,
+        'preset': preset,
+        'crf': crf,
+        'wall_seconds': round(wall, 3),
+        'sum_part_seconds': round(sum(t['wall_seconds'] for t in chunk_timings), 3),
+        'parts': [{
+            'index': part.index,
+            'output': part.output,
+            'source_seconds': round(part.end - part.start, 3),
+            'threads': threads,
+            'started_at': 0.0,
+            'wall_seconds': round(wall, 3),
+            'realtime_factor': round((part.end - part.start) / wall, 2) if wall > 0 else None
+        }],
+        'chunks': chunk_timings
+    }
+
+
+def write_github_env(values):
+    """Export values to later workflow steps when running inside GitHub Actions."""
+    env_file = os.getenv('GITHUB_ENV')
+    if not env_file:
+        return
+    with open(env_file, 'a') as f:
+        for key, value in values.items():
+            f.write(f"{key}={value}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Split a video and apply a playback speed in one pass')
+    parser.add_argument('--input', required=True)
+    parser.add_argument('--basename', required=True)
+    parser.add_argument('--speed', required=True, help='Playback speed, also used in output names')
+    parser.add_argument('--splits', default='', help='Comma-separated HH:MM:SS split points')
+    parser.add_argument('--preset', default=DEFAULT_PRESET)
+    parser.add_argument('--crf', type=int, default=DEFAULT_CRF)
+    parser.add_argument('--plan', default='plan.json', help='Where to write the part plan')
+    parser.add_argument('--report', default='encode_report.json', help='Where to write the per-part timing report')
+    parser.add_argument('--cores', type=int, default=None, help='Cores to use (defaults to all available)')
+    parser.add_argument('--min-threads', type=int, default=MIN_THREADS_PER_ENCODE,
+                        help='Minimum encoder threads per ffmpeg process')
+    parser.add_argument('--chunked', choices=['auto', 'always', 'never'], default='auto',
+                        help='Encode an unsplit video as parallel keyframe-aligned chunks')
+    parser.add_argument('--chunk-min-seconds', type=int, default=CHUNK_MIN_SECONDS)
+    parser.add_argument('--file-hash', default=None, help='Media index cache key')
+    parser.add_argument('--index-dir', default=media_probe.DEFAULT_INDEX_DIR)
+    args = parser.parse_args()
+
+    index = media_probe.load_or_probe(args.input, args.file_hash, args.index_dir)
+    duration, has_audio, frame_rate = index.duration, index.has_audio, index.frame_rate
+    plan = build_plan(duration, args.splits, args.basename, args.speed)
+
+    with open(args.plan, 'w') as f:
+        json.dump([part._asdict() for part in plan], f, indent=2)
+
+    write_github_env({'TOTAL_DURATION': int(duration), 'PART_COUNT': len(plan)})
+    print(f"📦 Planned {len(plan)} parts from {duration:.1f}s source")
+
+    cores = args.cores or available_cores()
+    chunked = args.chunked == 'always' or (
+        args.chunked == 'auto' and len(plan) == 1 and
+        chunk_count(duration, cores, args.min_threads, args.chunk_min_seconds) > 1
+    )
+
+    if chunked and len(plan) == 1:
+        report = encode_chunked(
+            args.input, plan[0], args.speed, has_audio, args.preset, args.crf,
+            cores=cores, min_threads=args.min_threads, min_chunk_seconds=args.chunk_min_seconds,
+            frame_rate=frame_rate, keyframes=index.keyframes_between(plan[0].start, plan[0].end)
+        )
+    else:
+        report = encode_parallel(
+            args.input, plan, args.speed, has_audio, args.preset, args.crf,
+            cores=cores, min_threads=args.min_threads, frame_rate=frame_rate
+        )
+    print_timing_report(report)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except subprocess.CalledProcessError as e:
+        print(f"❌ ffmpeg failed with exit code {e.returncode}")
+        sys.exit(1)
@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import socket
+import random
+import argparse
+import http.client
+from urllib.parse import urlsplit, urlencode
+
+UPLOAD_URL = 'https://www.googleapis.com/upload/youtube/v3/videos'
+TOKEN_URL = 'https://oauth2.googleapis.com/token'
+# Chunks must be a multiple of 256 KiB except for the last one
+CHUNK_GRANULARITY = 256 * 1024
+DEFAULT_CHUNK_MB = int(os.getenv('YOUTUBE_CHUNK_MB', 32))
+DEFAULT_STATE_DIR = os.getenv('YOUTUBE_UPLOAD_STATE_DIR', '.upload_state')
+MAX_RETRIES = 10
+RETRY_STATUSES = {500, 502, 503, 504}
+# Network faults only; local file errors such as a missing part are not worth retrying
+RETRY_EXCEPTIONS = (ConnectionError, socket.timeout, socket.gaierror, http.client.HTTPException)
+
+
+class ResumableUploadError(Exception):
+    """Raised when the upload server rejects a request"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class ResumableUploader:
+    """
+    Chunked upload over the resumable upload protocol. The session URI is
+    persisted next to the run so a retried step continues from the last byte
+    the server acknowledged instead of starting the part again.
+    """
+
+    def __init__(self, file_path, metadata, access_token, upload_url=UPLOAD_URL,
+                 chunk_size=DEFAULT_CHUNK_MB * 1024 * 1024, state_dir=DEFAULT_STATE_DIR,
+                 max_retries=MAX_RETRIES, backoff_base=1.0, token_refresher=None,
+                 mimetype='video/mp4', timeout=120):
+        self.file_path = file_path
+        self.metadata = metadata
+        self.access_token = access_token
+        self.upload_url = upload_url
+        self.chunk_size = max(CHUNK_GRANULARITY, chunk_size - chunk_size % CHUNK_GRANULARITY)
+        self.state_dir = state_dir
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.token_refresher = token_refresher
+        self.mimetype = mimetype
+        self.timeout = timeout
+        self.size = os.path.getsize(file_path)
+        self.session_uri = None
+        self.offset = 0
+        self.response = None
+        self._connections = {}
+        self._resync = False
+        self._started = None
+        self._start_offset = 0
+
+    # Persistence
+
+    @property
+    def state_path(self):
+        name = os.path.basename(self.file_path)
+        return os.path.join(self.state_dir, f"{name}.{self.size}.json")
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f).get('session_uri')
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'session_uri': self.session_uri, 'size': self.size, 'saved_at': int(time.time())}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _clear_state(self):
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+
+    # HTTP
+
+    def _connection(self, url):
+        """Keep one keep-alive connection per host."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        conn = self._connections.get(key)
+        if conn is None:
+            cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+            conn = cls(parts.netloc, timeout=self.timeout)
+            self._connections[key] = conn
+        return conn
+
+    def _request(self, method, url, body=None, headers=None):
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else '')
+        headers = dict(headers or {})
+        headers['Authorization'] = f'Bearer {self.access_token}'
+        conn = self._connection(url)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except RETRY_EXCEPTIONS:
+            # Drop the broken connection so the next attempt reconnects
+            conn.close()
+            self._connections.pop((parts.scheme, parts.netloc), None)
+            raise
+        return response.status, response, data
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+    # Protocol
+
+    def start_session(self):
+        """Open a new resumable session and remember its URI."""
+        query = urlencode({'uploadType': 'resumable', 'part': ','.join(self.metadata.keys())})
+        body = json.dumps(self.metadata).encode()
+        status, response, data = self._request('POST', f"{self.upload_url}?{query}", body, {
+            'Content-Type': 'application/json; charset=UTF-8',
+            'X-Upload-Content-Length': str(self.size),
+            'X-Upload-Content-Type': self.mimetype
+        })
+        if status != 200 or not response.getheader('Location'):
+            raise ResumableUploadError(f"Could not start upload session: {status} {data[:300]!r}", status)
+        self.session_uri = response.getheader('Location')
+        self.offset = 0
+        self._save_state()
+
+    def _handle_progress(self, status, response, data):
+        """Update offset from a 308 / final response. Returns True when the upload is complete."""
+        if status in (200, 201):
+            self.response = json.loads(data or b'{}')
+            self.offset = self.size
+            return True
+        if status == 308:
+            committed = response.getheader('Range')
+            # "bytes=0-N" means bytes 0..N are stored
+            self.offset = int(committed.rsplit('-', 1)[1]) + 1 if committed else 0
+            return False
+        raise ResumableUploadError(f"Upload failed: {status} {data[:300]!r}", status)
+
+    def query_offset(self):
+        """Ask the server how many bytes of the session it already has."""
+        status, response, data = self._request('PUT', self.session_uri, b'', {
+            'Content-Length': '0',
+            'Content-Range': f'bytes */{self.size}'
+        })
+        return self._handle_progress(status, response, data)
+
+    def next_chunk(self):
+        """Send the next chunk. Returns (fraction done, final response or None)."""
+        end = min(self.offset + self.chunk_size, self.size) - 1
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read(end - self.offset + 1)
+        status, response, data = self._request('PUT', self.session_uri, chunk, {
+            'Content-Length': str(len(chunk)),
+            'Content-Range': f'bytes {self.offset}-{end}/{self.size}'
+        })
+        done = self._handle_progress(status, response, data)
+        return self.offset / self.size if self.size else 1.0, self.response if done else None
+
+    def _resume_or_start(self):
+        saved = self._load_state()
+        if saved:
+            self.session_uri = saved
+            try:
+                if not self.query_offset():
+                    print(f"♻️ Resuming saved session at {self.offset / (1024*1024):.1f} MB")
+                return
+            except ResumableUploadError as e:
+                # 404/410 mean the session expired; anything else is worth a fresh session too
+                print(f"⚠️ Saved session unusable ({e}), starting a new one")
+                self._clear_state()
+        self.start_session()
+
+    def _send_chunk(self):
+        # After a failure the server may hold part of the chunk, so ask where to continue
+        if self._resync:
+            done = self.query_offset()
+            self._resync = False
+            if done:
+                return
+        self.next_chunk()
+
+    def _backoff(self, attempt):
+        return min(64, self.backoff_base * (2 ** attempt)) + random.uniform(0, self.backoff_base)
+
+    def _with_retries(self, func):
+        """Run func, retrying 5xx and connection errors with exponential backoff."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return func()
+            except (ResumableUploadError, *RETRY_EXCEPTIONS) as e:
+                status = getattr(e, 'status', None)
+                if status == 401 and self.token_refresher:
+                    self.access_token = self.token_refresher()
+                elif isinstance(e, ResumableUploadError) and status not in RETRY_STATUSES:
+                    raise
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                print(f"⚠️ {e!r}, retrying in {delay:.1f}s")
+                self._resync = True
+                time.sleep(delay)
+
+    def _report(self):
+        elapsed = time.monotonic() - self._started
+        sent = self.offset - self._start_offset
+        rate = sent / elapsed if elapsed > 0 else 0
+        percent = (self.offset / self.size) * 100 if self.size else 100
+        print(f"📤 {percent:.1f}% ({self.offset / (1024*1024):.1f}/{self.size / (1024*1024):.1f} MB) | "
+              f"{rate / (1024*1024):.2f} MB/s ({rate:.0f} B/s)")
+
+    def upload(self):
+        """Upload the whole file, retrying transient failures from the last acknowledged byte."""
+        try:
+            self._with_retries(self._resume_or_start)
+            self._resync = False
+            self._started = time.monotonic()
+            self._start_offset = self.offset
+
+            while self.response is None:
+                self._with_retries(self._send_chunk)
+                self._report()
+
+            self._clear_state()
+            return self.response
+        finally:
+            self.close()
+
+
+def refresh_access_token(client_id, client_secret, refresh_token, token_url=TOKEN_URL):
+    """Exchange the refresh token for a new access token (tokens expire after an hour)."""
+    parts = urlsplit(token_url)
+    conn = http.client.HTTPSConnection(parts.netloc, timeout=30)
+    try:
+        body = urlencode({
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'refresh_token': refresh_token,
+            'grant_type': 'refresh_token'
+        })
+        conn.request('POST', parts.path, body=body, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        data = json.loads(response.read() or b'{}')
+    finally:
+        conn.close()
+    if 'access_token' not in data:
+        raise ResumableUploadError(f"Token refresh failed: {data.get('error_description', data)}")
+    return data['access_token']
+
+
+def upload_video(file_path, title, description, access_token, privacy_status="private",
+                 chunk_size=DEFAULT_CHUNK_MB * 1024 * 1024, upload_url=UPLOAD_URL, state_dir=DEFAULT_STATE_DIR):
+    body = {
+        'snippet': {
+            'title': title,
+            'description': description,
+            'tags': ['processed', 'telegram', 'github']
+        },
+        'status': {
+            'privacyStatus': privacy_status,
+            'selfDeclaredMadeForKids': False
+        }
+    }
+
+    refresher = None
+    client_id = os.getenv('YOUTUBE_CLIENT_ID')
+    client_secret = os.getenv('YOUTUBE_CLIENT_SECRET')
+    refresh_token = os.getenv('YOUTUBE_REFRESH_TOKEN')
+    if client_id and client_secret and refresh_token:
+        refresher = lambda: refresh_access_token(client_id, client_secret, refresh_token)
+
+    uploader = ResumableUploader(
+        file_path, body, access_token,
+        upload_url=upload_url,
+        chunk_size=chunk_size,
+        state_dir=state_dir,
+        token_refresher=refresher
+    )
+
+    try:
+        started = time.monotonic()
+        response = uploader.upload()
+        elapsed = time.monotonic() - started
+        print(f"Uploaded video ID: {response.get('id')}")
+        print(f"Title: {response.get('snippet', {}).get('title', title)}")
+        if elapsed > 0:
+            print(f"Average throughput: {uploader.size / elapsed / (1024*1024):.2f} MB/s")
+        return response
+    except ResumableUploadError as e:
+        print(f"❌ Upload error: {e}")
+        return None
+    except RETRY_EXCEPTIONS as e:
+        print(f"❌ Connection error after retries: {e!r} (session saved, re-run to resume)")
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--file', required=True)
+    parser.add_argument('--title', required=True)
+    parser.add_argument('--description', required=True)
+    parser.add_argument('--access_token', required=True)
+    parser.add_argument('--privacy', default='private')
+    parser.add_argument('--chunk-mb', type=int, default=DEFAULT_CHUNK_MB, help='Upload chunk size in MB')
+    parser.add_argument('--upload-url', default=UPLOAD_URL, help='Resumable upload endpoint')
+    parser.add_argument('--state-dir', default=DEFAULT_STATE_DIR, help='Where resumable session URIs are kept')
+
+    args = parser.parse_args()
+
+    response = upload_video(
+        args.file,
+        args.title,
+        args.description,
+        args.access_token,
+        args.privacy,
+        chunk_size=args.chunk_mb * 1024 * 1024,
+        upload_url=args.upload_url,
+        state_dir=args.state_dir
+    )
+
+    sys.exit(0 if response else 1)